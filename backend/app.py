@@ -2,28 +2,116 @@
 Personal Cloud Storage - Backend Server
 Flask-based REST API for file upload, storage, and management
 """
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
 import hashlib
+import json
+import shutil
+import sqlite3
+import tempfile
 import mimetypes
+import struct
+import uuid
+import threading
+import time
+import zlib
 from datetime import datetime
-from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
 import config
-from database import Database
+from database import Database, SORT_ORDERS, make_cursor, make_search_cursor
+from ingest import IngestRequest
+from file_responses import send_stored_file, send_bytes, send_file_object
+from cache import LRUCache
+import metrics
+import chunkstore
+from worker import DerivativeWorker
+from media_probe import probe_video, ProbeError
 
 app = Flask(__name__)
+# Stream uploaded files straight to the storage volume while hashing them
+app.request_class = IngestRequest
+app.config['USE_X_SENDFILE'] = config.USE_X_SENDFILE
 # Enable CORS for frontend access (localhost + Vercel + ngrok)
 CORS(app, 
      origins=["*"],
      methods=["GET", "POST", "DELETE", "OPTIONS", "PUT"],
-     allow_headers=["Content-Type", "Authorization"],
+     allow_headers=["Content-Type", "Authorization", "Range",
+                    "If-None-Match", "If-Modified-Since", "If-Range"],
+     expose_headers=["Content-Range", "Content-Length", "Accept-Ranges", "ETag"],
      supports_credentials=False)
 
 # Initialize database
 db = Database()
 
+# Thumbnails are generated in the background (started in start_background_services)
+worker = DerivativeWorker(db)
+
+# File records and small thumbnails for repeated gallery requests
+cache = LRUCache(config.CACHE_MAX_BYTES, config.CACHE_MAX_ITEM_SIZE, config.CACHE_TTL)
+
+# Uploads hold a request thread for as long as the client takes to send the
+# body, so only a few may run at once; the remaining threads serve reads
+UPLOAD_ENDPOINTS = {'upload_file', 'upload_batch', 'upload_chunk', 'complete_upload_session'}
+upload_slots = threading.BoundedSemaphore(config.MAX_CONCURRENT_UPLOADS)
+active_uploads = set()  # Threads holding an upload slot
+
+# Queue depths are computed when /metrics is scraped
+metrics.QUEUE_DEPTH.labels('jobs_queued').set_function(lambda: db.count_jobs().get('queued', 0))
+metrics.QUEUE_DEPTH.labels('jobs_running').set_function(lambda: db.count_jobs().get('running', 0))
+metrics.QUEUE_DEPTH.labels('worker_in_flight').set_function(lambda: worker.in_flight)
+metrics.QUEUE_DEPTH.labels('uploads_active').set_function(lambda: len(active_uploads))
+metrics.QUEUE_DEPTH.labels('cache_entries').set_function(lambda: len(cache.entries))
+
+RECORD_SECONDS = metrics.UPLOAD_PHASE_SECONDS.labels('record')
+PROBE_SECONDS = metrics.UPLOAD_PHASE_SECONDS.labels('probe')
+VERIFY_SECONDS = metrics.UPLOAD_PHASE_SECONDS.labels('verify')
+
+
+@app.before_request
+def start_request_timer():
+    """Note when the request started, for the latency histogram"""
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Observe the request's latency and count it by status"""
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        metrics.REQUEST_SECONDS.labels(endpoint, request.method).observe(time.perf_counter() - started)
+        metrics.REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+    return response
+
+
+@app.before_request
+def limit_concurrent_uploads():
+    """Turn uploads away with a 503 while every upload slot is busy"""
+    if request.endpoint not in UPLOAD_ENDPOINTS or request.method == 'OPTIONS':
+        return None
+    
+    # Runs before the body is read, so a rejected upload costs nothing
+    if not upload_slots.acquire(timeout=config.UPLOAD_SLOT_WAIT):
+        response = jsonify({'error': 'Too many uploads in progress, try again later'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(config.UPLOAD_RETRY_AFTER)
+        metrics.UPLOADS.labels('busy').inc()
+        return response
+    
+    g.upload_slot = True
+    active_uploads.add(threading.get_ident())
+    return None
+
+
+@app.teardown_request
+def release_upload_slot(exc):
+    """Free the upload slot taken by limit_concurrent_uploads"""
+    if g.pop('upload_slot', False):
+        active_uploads.discard(threading.get_ident())
+        upload_slots.release()
+
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
@@ -50,33 +138,337 @@ def get_file_type(mime_type):
     return 'other'
 
 
-def create_thumbnail(image_path, thumbnail_path, size=(300, 300)):
-    """Create thumbnail for image"""
+def is_authorized():
+    """Check the request's bearer token when authentication is enabled"""
+    if not config.REQUIRE_AUTH:
+        return True
+    return request.headers.get('Authorization') == f'Bearer {config.AUTH_TOKEN}'
+
+
+def get_content_path(checksum, original_filename):
+    """
+    Content-addressed location of a file: objects/<c[0:2]>/<c[2:4]>/<checksum><ext>
+    
+    Returns:
+        tuple: (filename, file_path)
+    """
+    extension = os.path.splitext(original_filename)[1].lower()
+    filename = f"{checksum}{extension}"
+    directory = os.path.join(config.OBJECTS_PATH, checksum[:2], checksum[2:4])
+    os.makedirs(directory, exist_ok=True)
+    return filename, os.path.join(directory, filename)
+
+
+def duplicate_result(file_id):
+    """Response body and status for content that is already stored"""
+    return {
+        'message': 'File already exists (duplicate detected)',
+        'file_id': file_id,
+        'duplicate': True
+    }, 200
+
+
+def store_file(place, original_filename, checksum):
+    """
+    Store received content at its content address and record it
+    
+    Args:
+        place (callable): Moves the received data to the path it is given
+        original_filename (str): Sanitized client filename
+        checksum (str): MD5 checksum of the content
+    
+    Returns:
+        tuple: (response body, status code)
+    """
+    existing_file = db.get_file_by_checksum(checksum)
+    if existing_file:
+        metrics.UPLOADS.labels('duplicate').inc()
+        return duplicate_result(existing_file['id'])
+    
+    filename, file_path = get_content_path(checksum, original_filename)
+    place(file_path)
+    
     try:
-        with Image.open(image_path) as img:
-            # Convert RGBA to RGB if necessary
-            if img.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img = background
-            
-            img.thumbnail(size, Image.Resampling.LANCZOS)
-            img.save(thumbnail_path, 'JPEG', quality=85)
-            return True
-    except Exception as e:
-        print(f"Error creating thumbnail: {e}")
-        return False
+        with RECORD_SECONDS.time():
+            file_id, file_size, file_type = register_file(
+                file_path, filename, original_filename, checksum
+            )
+    except sqlite3.IntegrityError:
+        # A concurrent upload of the same content was recorded first; the
+        # bytes at file_path are identical, so that record stays valid
+        existing_file = db.get_file_by_checksum(checksum)
+        if not existing_file:
+            raise
+        if existing_file['storage'] == 'chunks':
+            # That record's content lives in the chunk store, not at file_path
+            os.remove(file_path)
+        metrics.UPLOADS.labels('duplicate').inc()
+        return duplicate_result(existing_file['id'])
+    
+    metrics.UPLOADS.labels('stored').inc()
+    return {
+        'message': 'File uploaded successfully',
+        'file_id': file_id,
+        'filename': original_filename,
+        'size': file_size,
+        'type': file_type
+    }, 201
 
 
-def get_image_dimensions(image_path):
-    """Get image width and height"""
+def register_file(file_path, filename, original_filename, checksum):
+    """
+    Record a file already stored on disk and queue its derivatives
+    
+    Args:
+        file_path (str): Absolute path of the stored file
+        filename (str): On-disk filename
+        original_filename (str): Sanitized client filename
+        checksum (str): MD5 checksum of the file contents
+    
+    Returns:
+        tuple: (file_id, file_size, file_type)
+    """
+    file_data, jobs = build_file_record(file_path, filename, original_filename, checksum)
+    
+    file_id = db.add_file(file_data, jobs=jobs)
+    invalidate_file(file_id)
+    if jobs:
+        worker.notify()
+    return file_id, file_data['file_size'], file_data['file_type']
+
+
+def get_file_record(file_id):
+    """
+    Get a file record, from the cache when possible
+    
+    Records still waiting for a thumbnail are not cached: the worker that
+    completes them may run in another process.
+    """
+    file_record = cache.get(('file', file_id))
+    if file_record is None:
+        file_record = db.get_file_by_id(file_id)
+        if file_record:
+            cache_file_record(file_record)
+    return file_record
+
+
+def get_file_records(file_ids):
+    """
+    Get several file records, querying the database once for cache misses
+    
+    Returns:
+        dict: Mapping of each existing file ID to its record
+    """
+    records = {}
+    uncached = []
+    for file_id in dict.fromkeys(file_ids):
+        file_record = cache.get(('file', file_id))
+        if file_record is None:
+            uncached.append(file_id)
+        else:
+            records[file_id] = file_record
+    
+    if uncached:
+        for file_id, file_record in db.get_files_by_ids(uncached).items():
+            records[file_id] = file_record
+            cache_file_record(file_record)
+    
+    return records
+
+
+def cache_file_record(file_record):
+    """Cache a record unless its thumbnail is still being generated"""
+    if file_record['thumbnail_status'] != 'pending':
+        cache.put(('file', file_record['id']), file_record)
+
+
+def get_thumbnail_body(file_id, thumbnail_path):
+    """
+    Get a thumbnail's bytes from the cache, reading and caching them on a miss
+    
+    Returns:
+        bytes: The thumbnail, or None if it is missing or too large to cache
+    """
+    key = ('thumbnail', file_id)
+    body = cache.get(key)
+    if body is None:
+        try:
+            with open(thumbnail_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size > config.CACHE_MAX_ITEM_SIZE:
+                    return None
+                body = f.read()
+        except OSError:
+            return None
+        cache.put(key, body)
+    return body
+
+
+def invalidate_file(file_id):
+    """Drop a file's record and thumbnail from the cache"""
+    cache.invalidate(('file', file_id), ('thumbnail', file_id))
+
+
+def read_media_info(file_path):
+    """
+    Read video metadata from a stored file's container header
+    
+    Returns:
+        dict: duration (whole seconds), width, height and codec, or an empty
+        dict if the container is not recognised
+    """
     try:
-        with Image.open(image_path) as img:
-            return img.size
-    except:
-        return None, None
+        with PROBE_SECONDS.time():
+            info = probe_video(file_path)
+    except (ProbeError, OSError) as e:
+        app.logger.warning("No video metadata for %s: %s", os.path.basename(file_path), e)
+        return {}
+    
+    if info['duration'] is not None:
+        info['duration'] = round(info['duration'])
+    return info
+
+
+def build_file_record(file_path, filename, original_filename, checksum):
+    """
+    Build the database record for a stored file
+    
+    Images get a thumbnail job; the thumbnail, width and height are filled
+    in by the background worker. Videos have their duration, frame size and
+    codec read from the container header right away, which only touches a
+    few kilobytes of the file. With the chunk store enabled, a 'chunk' job
+    moves the file into it after the other jobs have read the file.
+    
+    Returns:
+        tuple: (file_data, jobs) as taken by Database.add_file
+    """
+    file_size = os.path.getsize(file_path)
+    
+    # Get MIME type
+    mime_type = mimetypes.guess_type(file_path)[0]
+    file_type = get_file_type(mime_type)
+    
+    # Queue thumbnail generation for images
+    jobs = ['thumbnail'] if file_type == 'image' else []
+    if config.CHUNK_STORE_ENABLED:
+        jobs.append('chunk')
+    
+    media_info = {}
+    if file_type == 'video':
+        media_info = read_media_info(file_path)
+    
+    # Store metadata in database
+    file_data = {
+        'filename': filename,
+        'original_filename': original_filename,
+        'file_path': file_path,
+        'file_size': file_size,
+        'file_type': file_type,
+        'mime_type': mime_type,
+        'created_date': datetime.now().isoformat(),
+        'thumbnail_path': None,
+        'width': media_info.get('width'),
+        'height': media_info.get('height'),
+        'duration': media_info.get('duration'),
+        'codec': media_info.get('codec'),
+        'checksum': checksum,
+        'thumbnail_status': 'pending' if 'thumbnail' in jobs else None
+    }
+    
+    return file_data, jobs
+
+
+def get_list_options():
+    """
+    Output options of a file listing from the query string
+    
+    Query params:
+        fields: Comma-separated fields to return (default every field)
+        format: 'json' (default) or 'ndjson'; Accept: application/x-ndjson
+            also selects NDJSON
+    
+    Returns:
+        tuple: (fields or None, whether to send NDJSON)
+    
+    Raises:
+        ValueError: If the format is unknown
+    """
+    fields = request.args.get('fields')
+    if fields:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    
+    output_format = request.args.get('format')
+    if output_format not in (None, 'json', 'ndjson'):
+        raise ValueError("format must be 'json' or 'ndjson'")
+    ndjson = output_format == 'ndjson' or (
+        output_format is None and request.accept_mimetypes.best == 'application/x-ndjson'
+    )
+    
+    return fields or None, ndjson
+
+
+def gzip_chunks(chunks, level):
+    """Compress byte chunks into one gzip stream, flushing after every chunk"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_file_list(batches, ndjson=False, limit=None, next_cursor_for=None):
+    """
+    Response sending file records as they are read from the database
+    
+    The JSON format is the usual {"files": [...], "count": N, "next_cursor":
+    ...} object, written one batch of records at a time. NDJSON has one
+    record per line, followed by a {"next_cursor": ...} line when there is
+    a next page. Either is gzip-compressed for clients that accept it.
+    
+    Args:
+        batches (iterator): Lists of file records, e.g. from Database.iter_files
+        ndjson (bool): Send NDJSON instead of JSON
+        limit (int): Page size; a full page gets a next_cursor
+        next_cursor_for (callable): Builds the cursor following a record
+    
+    Returns:
+        Response: Streamed response
+    """
+    def generate():
+        count = 0
+        last = None
+        if not ndjson:
+            yield b'{"files":['
+        
+        for batch in batches:
+            if ndjson:
+                yield ''.join(json.dumps(file, separators=(',', ':')) + '\n' for file in batch).encode()
+            else:
+                # Serialize a whole batch at once and drop its brackets
+                data = json.dumps(batch, separators=(',', ':'))[1:-1]
+                yield ((',' if count else '') + data).encode()
+            count += len(batch)
+            last = batch[-1]
+        
+        next_cursor = None
+        if limit and count == limit and next_cursor_for:
+            next_cursor = next_cursor_for(last)
+        
+        if not ndjson:
+            yield f'],"count":{count},"next_cursor":{json.dumps(next_cursor)}}}'.encode()
+        elif next_cursor:
+            yield (json.dumps({'next_cursor': next_cursor}, separators=(',', ':')) + '\n').encode()
+    
+    chunks = generate()
+    gzip = config.LIST_GZIP and request.accept_encodings['gzip']
+    if gzip:
+        chunks = gzip_chunks(chunks, config.LIST_GZIP_LEVEL)
+    
+    response = Response(chunks, mimetype='application/x-ndjson' if ndjson else 'application/json')
+    response.vary.add('Accept-Encoding')
+    if gzip:
+        response.content_encoding = 'gzip'
+    return response
 
 
 @app.route('/')
@@ -87,12 +479,21 @@ def index():
         'version': '1.0',
         'endpoints': {
             'POST /upload': 'Upload a file',
-            'GET /files': 'List all files',
+            'POST /upload/batch': 'Upload several files in one request',
+            'GET /files?limit=&cursor=': 'List files (cursor-paginated)',
+            'POST /files/exists': 'Check which checksums are already stored',
             'GET /file/<id>': 'Download file by ID',
             'GET /thumbnail/<id>': 'Get file thumbnail',
+            'GET /thumbnails?ids=<id>,<id>': 'Get many thumbnails in one packed response',
             'DELETE /file/<id>': 'Delete file by ID',
             'GET /stats': 'Get storage statistics',
-            'GET /search?q=<query>': 'Search files'
+            'GET /metrics': 'Server metrics (Prometheus text format)',
+            'GET /search?q=<query>': 'Search files',
+            'POST /upload/session': 'Start a resumable upload session',
+            'GET /upload/session/<id>': 'Get chunks received for a session',
+            'PUT /upload/session/<id>/chunk/<index>': 'Upload one chunk',
+            'POST /upload/session/<id>/complete': 'Finalize a resumable upload',
+            'DELETE /upload/session/<id>': 'Abort a resumable upload'
         }
     })
 
@@ -113,97 +514,457 @@ def upload_file():
     if request.method == 'OPTIONS':
         return '', 200
     
-    print(f"[UPLOAD] Received POST request from {request.remote_addr}")
-    print(f"[UPLOAD] Content-Type: {request.content_type}")
-    print(f"[UPLOAD] Files in request: {list(request.files.keys())}")
-    
     # Check authentication if enabled
-    if config.REQUIRE_AUTH:
-        token = request.headers.get('Authorization')
-        if token != f'Bearer {config.AUTH_TOKEN}':
-            return jsonify({'error': 'Unauthorized'}), 401
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
     
     # Check if file is in request
     if 'file' not in request.files:
-        print(f"[UPLOAD ERROR] No 'file' in request.files")
+        metrics.UPLOADS.labels('rejected').inc()
         return jsonify({'error': 'No file provided'}), 400
     
     file = request.files['file']
     
     if file.filename == '':
+        metrics.UPLOADS.labels('rejected').inc()
         return jsonify({'error': 'No file selected'}), 400
     
     if not allowed_file(file.filename):
+        metrics.UPLOADS.labels('rejected').inc()
         return jsonify({'error': 'File type not allowed'}), 400
     
     try:
-        # Calculate checksum to detect duplicates
-        checksum = get_file_checksum(file.stream)
+        # The checksum was computed while the upload streamed to disk;
+        # duplicates are never committed and are removed when the request ends
+        ingest_file = file.stream
+        result, status = store_file(
+            ingest_file.commit,
+            secure_filename(file.filename),
+            ingest_file.checksum()
+        )
         
-        # Check for duplicate
-        existing_file = db.get_file_by_checksum(checksum)
-        if existing_file:
-            return jsonify({
-                'message': 'File already exists (duplicate detected)',
-                'file_id': existing_file['id'],
-                'duplicate': True
-            }), 200
-        
-        # Generate unique filename
-        original_filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{original_filename}"
-        
-        # Determine file path
-        file_path = os.path.join(config.STORAGE_PATH, filename)
-        
-        # Save file
-        file.save(file_path)
-        file_size = os.path.getsize(file_path)
-        
-        # Get MIME type
-        mime_type = mimetypes.guess_type(file_path)[0]
-        file_type = get_file_type(mime_type)
-        
-        # Create thumbnail for images
-        thumbnail_path = None
-        width, height = None, None
-        
-        if file_type == 'image':
-            thumbnail_filename = f"thumb_{filename}"
-            thumbnail_path = os.path.join(config.THUMBNAILS_PATH, thumbnail_filename)
-            if create_thumbnail(file_path, thumbnail_path):
-                thumbnail_path = thumbnail_filename
+        return jsonify(result), status
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/upload/batch', methods=['POST', 'OPTIONS'])
+@app.route('/api/upload/batch', methods=['POST', 'OPTIONS'])
+def upload_batch():
+    """
+    Upload several files in one request
+    
+    Every file part of the multipart body is stored, and all new files are
+    recorded in a single database transaction. One bad file does not fail
+    the others.
+    
+    Form data:
+        files: The files to upload (any number of parts, up to MAX_BATCH_FILES)
+    
+    Returns:
+        JSON with one result per file part, in request order, each with the
+        status and body a single upload of that file would have returned
+    """
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    files = [file for _, file in request.files.items(multi=True)]
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+    
+    if len(files) > config.MAX_BATCH_FILES:
+        return jsonify({
+            'error': f'At most {config.MAX_BATCH_FILES} files per batch'
+        }), 413
+    
+    try:
+        results = [None] * len(files)
+        accepted = {}  # checksum -> index of the first part with that content
+        
+        for index, file in enumerate(files):
+            if file.filename == '':
+                results[index] = ({'error': 'No file selected'}, 400)
+            elif not allowed_file(file.filename):
+                results[index] = ({'error': 'File type not allowed'}, 400)
             else:
-                thumbnail_path = None
+                accepted.setdefault(file.stream.checksum(), index)
+        
+        existing = db.get_existing_checksums(list(accepted))
+        
+        # Store the new content; duplicates are removed when the request ends
+        records = []
+        for checksum, index in accepted.items():
+            if checksum in existing:
+                continue
             
-            width, height = get_image_dimensions(file_path)
-        
-        # Store metadata in database
-        file_data = {
-            'filename': filename,
-            'original_filename': original_filename,
-            'file_path': file_path,
-            'file_size': file_size,
-            'file_type': file_type,
-            'mime_type': mime_type,
-            'created_date': datetime.now().isoformat(),
-            'thumbnail_path': thumbnail_path,
-            'width': width,
-            'height': height,
-            'duration': None,
-            'checksum': checksum
+            original_filename = secure_filename(files[index].filename)
+            filename, file_path = get_content_path(checksum, original_filename)
+            files[index].stream.commit(file_path)
+            records.append(build_file_record(file_path, filename, original_filename, checksum))
+        
+        with RECORD_SECONDS.time():
+            added = db.add_files(records)
+        if any(jobs for _, jobs in records):
+            worker.notify()
+        
+        for file_data, _ in records:
+            file_id, inserted = added[file_data['checksum']]
+            existing[file_data['checksum']] = file_id
+            invalidate_file(file_id)
+            if inserted:
+                results[accepted[file_data['checksum']]] = ({
+                    'message': 'File uploaded successfully',
+                    'file_id': file_id,
+                    'filename': file_data['original_filename'],
+                    'size': file_data['file_size'],
+                    'type': file_data['file_type']
+                }, 201)
+        
+        # Everything else repeats content stored before or earlier in the batch
+        for index, file in enumerate(files):
+            if results[index] is None:
+                results[index] = duplicate_result(existing[file.stream.checksum()])
+        
+        summary = {
+            'results': [
+                dict(body, status=status, name=file.filename)
+                for file, (body, status) in zip(files, results)
+            ],
+            'uploaded': sum(1 for _, status in results if status == 201),
+            'duplicates': sum(1 for body, _ in results if body.get('duplicate')),
+            'failed': sum(1 for _, status in results if status >= 400)
         }
+        metrics.UPLOADS.labels('stored').inc(summary['uploaded'])
+        metrics.UPLOADS.labels('duplicate').inc(summary['duplicates'])
+        metrics.UPLOADS.labels('rejected').inc(summary['failed'])
+        
+        return jsonify(summary)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def get_session_part_path(session_id):
+    """Path of the partial file that chunks of a session are written into"""
+    return os.path.join(config.UPLOAD_SESSIONS_PATH, f"{session_id}.part")
+
+
+def get_session_total_chunks(session):
+    """Number of chunks needed to cover the whole file of a session"""
+    return max(1, -(-session['total_size'] // session['chunk_size']))
+
+
+def get_expected_chunk_size(session, chunk_index):
+    """Size in bytes the given chunk of a session must have"""
+    start = chunk_index * session['chunk_size']
+    return min(session['chunk_size'], session['total_size'] - start)
+
+
+def discard_upload_session(session_id):
+    """Remove an upload session's partial file and database records"""
+    part_path = get_session_part_path(session_id)
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    db.delete_upload_session(session_id)
+
+
+def cleanup_expired_upload_sessions():
+    """Discard upload sessions that have been idle past UPLOAD_SESSION_TTL"""
+    for session_id in db.get_expired_upload_sessions(config.UPLOAD_SESSION_TTL):
+        app.logger.info("Discarding expired upload session %s", session_id)
+        discard_upload_session(session_id)
+
+
+def is_md5_hex(value):
+    """Check that a value is an MD5 digest written as 32 lowercase hex digits"""
+    return (isinstance(value, str) and len(value) == 32
+            and all(c in '0123456789abcdef' for c in value))
+
+
+def get_missing_chunk_ranges(received, total_chunks):
+    """
+    Chunks of a session not received yet, as ranges
+    
+    Args:
+        received (iterable): Indexes of the chunks received
+        total_chunks (int): Number of chunks in the session
+    
+    Returns:
+        list: [start, end) index pairs, in order
+    """
+    ranges = []
+    start = 0
+    for index in sorted(received):
+        if index > start:
+            ranges.append([start, index])
+        start = index + 1
+    if start < total_chunks:
+        ranges.append([start, total_chunks])
+    return ranges
+
+
+def describe_upload_session(session):
+    """
+    Build the JSON description of an upload session
+    
+    Missing chunks are given as ranges; 'missing' lists only the first
+    UPLOAD_MISSING_LIST_LIMIT of them, for older clients.
+    """
+    chunks = db.get_upload_chunks(session['id'])
+    total_chunks = get_session_total_chunks(session)
+    missing_ranges = get_missing_chunk_ranges(chunks, total_chunks)
+    
+    missing = []
+    for start, end in missing_ranges:
+        missing.extend(range(start, min(end, start + config.UPLOAD_MISSING_LIST_LIMIT - len(missing))))
+        if len(missing) >= config.UPLOAD_MISSING_LIST_LIMIT:
+            break
+    
+    return {
+        'session_id': session['id'],
+        'filename': session['original_filename'],
+        'size': session['total_size'],
+        'chunk_size': session['chunk_size'],
+        'total_chunks': total_chunks,
+        'received_count': len(chunks),
+        'missing_count': sum(end - start for start, end in missing_ranges),
+        'missing_ranges': missing_ranges,
+        'missing': missing,
+        'bytes_received': sum(chunks.values())
+    }
+
+
+@app.route('/upload/session', methods=['POST', 'OPTIONS'])
+@app.route('/api/upload/session', methods=['POST', 'OPTIONS'])
+def create_upload_session():
+    """
+    Start a resumable upload session
+    
+    JSON body:
+        filename: Original filename
+        size: Total file size in bytes
+        checksum: Optional MD5 of the whole file, verified on completion
+        chunk_size: Optional preferred chunk size in bytes (at least
+            MIN_UPLOAD_CHUNK_SIZE; larger ones are capped)
+    
+    Returns:
+        JSON with session ID and the chunk size to use
+    """
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename') or ''
+    total_size = data.get('size')
+    checksum = data.get('checksum')
+    
+    if not filename:
+        return jsonify({'error': 'No filename provided'}), 400
+    
+    if not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    
+    if not isinstance(total_size, int) or isinstance(total_size, bool) or total_size <= 0:
+        return jsonify({'error': 'Invalid file size'}), 400
+    
+    if checksum is not None and not is_md5_hex(checksum):
+        return jsonify({'error': 'Checksum must be a lowercase hex MD5 digest'}), 400
+    
+    if total_size > config.MAX_FILE_SIZE:
+        return jsonify({'error': 'File too large'}), 413
+    
+    try:
+        chunk_size = int(data.get('chunk_size') or config.UPLOAD_CHUNK_SIZE)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid chunk size'}), 400
+    if chunk_size < config.MIN_UPLOAD_CHUNK_SIZE:
+        return jsonify({'error': f'Chunk size must be at least {config.MIN_UPLOAD_CHUNK_SIZE} bytes'}), 400
+    chunk_size = min(chunk_size, config.MAX_UPLOAD_CHUNK_SIZE)
+    
+    try:
+        # Skip the transfer entirely if the content is already stored
+        if checksum:
+            existing_file = db.get_file_by_checksum(checksum)
+            if existing_file:
+                result, status = duplicate_result(existing_file['id'])
+                return jsonify(result), status
         
-        file_id = db.add_file(file_data)
+        cleanup_expired_upload_sessions()
+        
+        session_id = uuid.uuid4().hex
+        db.create_upload_session({
+            'id': session_id,
+            'original_filename': secure_filename(filename),
+            'total_size': total_size,
+            'chunk_size': chunk_size,
+            'checksum': checksum
+        })
+        
+        # Reserve the partial file that chunks are written into
+        open(get_session_part_path(session_id), 'wb').close()
+        
+        session = db.get_upload_session(session_id)
+        return jsonify(describe_upload_session(session)), 201
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/upload/session/<session_id>', methods=['GET'])
+@app.route('/api/upload/session/<session_id>', methods=['GET'])
+def get_upload_session(session_id):
+    """Get the chunks an upload session has already received"""
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        session = db.get_upload_session(session_id)
+        
+        if not session:
+            return jsonify({'error': 'Upload session not found'}), 404
+        
+        return jsonify(describe_upload_session(session))
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/upload/session/<session_id>/chunk/<int:chunk_index>', methods=['PUT', 'OPTIONS'])
+@app.route('/api/upload/session/<session_id>/chunk/<int:chunk_index>', methods=['PUT', 'OPTIONS'])
+def upload_chunk(session_id, chunk_index):
+    """
+    Upload one chunk of a session
+    
+    The request body is the raw chunk data. Chunk N covers bytes
+    N * chunk_size up to the next chunk boundary or the end of the file.
+    Re-sending a chunk that was already received overwrites it, but only
+    once the new copy has arrived complete; a truncated or oversized body
+    leaves the chunk as it was.
+    """
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        session = db.get_upload_session(session_id)
+        
+        if not session:
+            return jsonify({'error': 'Upload session not found'}), 404
+        
+        if chunk_index >= get_session_total_chunks(session):
+            return jsonify({'error': 'Chunk index out of range'}), 400
+        
+        expected_size = get_expected_chunk_size(session, chunk_index)
+        part_path = get_session_part_path(session_id)
+        
+        if not os.path.exists(part_path):
+            return jsonify({'error': 'Upload session data missing on disk'}), 410
+        
+        # Receive the whole chunk before touching the partial file
+        written = 0
+        with tempfile.SpooledTemporaryFile(max_size=config.UPLOAD_CHUNK_SIZE,
+                                           dir=config.UPLOAD_SESSIONS_PATH) as buffer:
+            for data in iter(lambda: request.stream.read(1024 * 1024), b''):
+                written += len(data)
+                if written > expected_size:
+                    break
+                buffer.write(data)
+            
+            if written != expected_size:
+                return jsonify({
+                    'error': f'Chunk size mismatch: expected {expected_size} bytes, got {written}'
+                }), 400
+            
+            # Write the chunk in place at its offset in the partial file
+            buffer.seek(0)
+            with open(part_path, 'r+b') as part:
+                part.seek(chunk_index * session['chunk_size'])
+                shutil.copyfileobj(buffer, part, 1024 * 1024)
+        
+        db.add_upload_chunk(session_id, chunk_index, written)
+        metrics.UPLOAD_BYTES.inc(written)
         
         return jsonify({
-            'message': 'File uploaded successfully',
-            'file_id': file_id,
-            'filename': original_filename,
-            'size': file_size,
-            'type': file_type
-        }), 201
+            'session_id': session_id,
+            'chunk_index': chunk_index,
+            'size': written
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/upload/session/<session_id>/complete', methods=['POST', 'OPTIONS'])
+@app.route('/api/upload/session/<session_id>/complete', methods=['POST', 'OPTIONS'])
+def complete_upload_session(session_id):
+    """Assemble a fully uploaded session into a stored file"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        session = db.get_upload_session(session_id)
+        
+        if not session:
+            return jsonify({'error': 'Upload session not found'}), 404
+        
+        description = describe_upload_session(session)
+        if description['missing_count']:
+            return jsonify({
+                'error': 'Upload incomplete',
+                'missing_count': description['missing_count'],
+                'missing_ranges': description['missing_ranges'],
+                'missing': description['missing']
+            }), 409
+        
+        part_path = get_session_part_path(session_id)
+        with VERIFY_SECONDS.time(), open(part_path, 'rb') as part:
+            checksum = get_file_checksum(part)
+        
+        if session['checksum'] and session['checksum'] != checksum:
+            discard_upload_session(session_id)
+            return jsonify({'error': 'Checksum mismatch, upload discarded'}), 422
+        
+        result, status = store_file(
+            lambda file_path: os.replace(part_path, file_path),
+            session['original_filename'],
+            checksum
+        )
+        
+        # Removes the partial file too if the content was a duplicate
+        discard_upload_session(session_id)
+        
+        return jsonify(result), status
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/upload/session/<session_id>', methods=['DELETE'])
+@app.route('/api/upload/session/<session_id>', methods=['DELETE'])
+def abort_upload_session(session_id):
+    """Abort an upload session and discard its data"""
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        if not db.get_upload_session(session_id):
+            return jsonify({'error': 'Upload session not found'}), 404
+        
+        discard_upload_session(session_id)
+        
+        return jsonify({'message': 'Upload session discarded'})
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -217,19 +978,86 @@ def list_files():
     
     Query params:
         limit: Max number of files to return
+        cursor: next_cursor from the previous page (preferred over offset)
         offset: Number of files to skip
         type: Filter by type ('image' or 'video')
+        order_by: Sort order, e.g. 'upload_date DESC' (the default)
+        fields, format: See get_list_options (the sort column is always included)
+    
+    Returns:
+        JSON with the files, their count and next_cursor (null on the last
+        page), streamed as the records are read
     """
     try:
         limit = request.args.get('limit', type=int)
         offset = request.args.get('offset', 0, type=int)
+        cursor = request.args.get('cursor')
         file_type = request.args.get('type')
+        order_by = request.args.get('order_by', 'upload_date DESC')
+        
+        if order_by not in SORT_ORDERS:
+            return jsonify({
+                'error': 'Invalid order_by',
+                'allowed': list(SORT_ORDERS)
+            }), 400
         
-        files = db.get_all_files(limit=limit, offset=offset, file_type=file_type)
+        try:
+            fields, ndjson = get_list_options()
+            batches = db.iter_files(
+                limit=limit,
+                offset=offset,
+                file_type=file_type,
+                order_by=order_by,
+                cursor=cursor,
+                fields=fields
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return stream_file_list(batches, ndjson, limit,
+                                lambda file_record: make_cursor(file_record, order_by))
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/files/exists', methods=['POST', 'OPTIONS'])
+@app.route('/api/files/exists', methods=['POST', 'OPTIONS'])
+def check_files_exist():
+    """
+    Check which files are already stored, by checksum
+    
+    Lets clients skip uploading content the server already has.
+    
+    JSON body:
+        checksums: List of MD5 checksums (at most MAX_EXISTS_BATCH)
+    
+    Returns:
+        JSON mapping each checksum that exists to its file ID
+    """
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    checksums = data.get('checksums')
+    
+    if not isinstance(checksums, list) or not all(isinstance(c, str) for c in checksums):
+        return jsonify({'error': 'checksums must be a list of strings'}), 400
+    
+    if len(checksums) > config.MAX_EXISTS_BATCH:
+        return jsonify({
+            'error': f'At most {config.MAX_EXISTS_BATCH} checksums per request'
+        }), 413
+    
+    try:
+        existing = db.get_existing_checksums(list({c.lower() for c in checksums}))
         
         return jsonify({
-            'files': files,
-            'count': len(files)
+            'existing': existing,
+            'count': len(existing)
         })
     
     except Exception as e:
@@ -241,19 +1069,38 @@ def list_files():
 def download_file(file_id):
     """Download file by ID"""
     try:
-        file_record = db.get_file_by_id(file_id)
+        file_record = get_file_record(file_id)
         
         if not file_record:
             return jsonify({'error': 'File not found'}), 404
         
         file_path = file_record['file_path']
         
+        if file_record['storage'] is None and not os.path.exists(file_path):
+            # The worker process may have moved it into the chunk store since
+            # the record was cached
+            invalidate_file(file_id)
+            file_record = get_file_record(file_id)
+            if not file_record:
+                return jsonify({'error': 'File not found'}), 404
+        
+        if file_record['storage'] == 'chunks':
+            chunks = db.get_file_chunks(file_id)
+            return send_file_object(
+                lambda: chunkstore.open_chunked_file(chunks),
+                file_record['file_size'],
+                etag=file_record['checksum'],
+                mimetype=file_record['mime_type'] or 'application/octet-stream',
+                download_name=file_record['original_filename']
+            )
+        
         if not os.path.exists(file_path):
             return jsonify({'error': 'File not found on disk'}), 404
         
-        return send_file(
+        return send_stored_file(
             file_path,
-            as_attachment=True,
+            etag=file_record['checksum'],
+            mimetype=file_record['mime_type'],
             download_name=file_record['original_filename']
         )
     
@@ -266,20 +1113,148 @@ def download_file(file_id):
 def get_thumbnail(file_id):
     """Get thumbnail for file"""
     try:
-        file_record = db.get_file_by_id(file_id)
+        file_record = get_file_record(file_id)
         
         if not file_record:
             return jsonify({'error': 'File not found'}), 404
         
+        if file_record['thumbnail_status'] == 'pending':
+            response = jsonify({'status': 'pending'})
+            response.headers['Retry-After'] = '1'
+            response.cache_control.no_store = True
+            return response, 202
+        
         if not file_record['thumbnail_path']:
             return jsonify({'error': 'No thumbnail available'}), 404
         
         thumbnail_path = os.path.join(config.THUMBNAILS_PATH, file_record['thumbnail_path'])
         
+        # Whole thumbnails are served from memory; range requests from disk
+        if 'Range' not in request.headers:
+            body = get_thumbnail_body(file_id, thumbnail_path)
+            if body is not None:
+                return send_bytes(
+                    body,
+                    etag=get_thumbnail_etag(file_record),
+                    mimetype='image/jpeg',
+                    max_age=config.THUMBNAIL_MAX_AGE,
+                    immutable=True
+                )
+        
         if not os.path.exists(thumbnail_path):
             return jsonify({'error': 'Thumbnail not found on disk'}), 404
         
-        return send_file(thumbnail_path, mimetype='image/jpeg')
+        return send_stored_file(
+            thumbnail_path,
+            etag=get_thumbnail_etag(file_record),
+            mimetype='image/jpeg',
+            max_age=config.THUMBNAIL_MAX_AGE,
+            immutable=True
+        )
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def get_thumbnail_etag(file_record):
+    """Strong ETag of a file's thumbnail (None if the file has no checksum)"""
+    if not file_record['checksum']:
+        return None
+    return f"{file_record['checksum']}-thumb"
+
+
+@app.route('/thumbnails', methods=['GET'])
+@app.route('/api/thumbnails', methods=['GET'])
+def get_thumbnails():
+    """
+    Get the thumbnails of several files in one response
+    
+    Query params:
+        ids: Comma-separated file IDs (at most MAX_THUMBNAIL_BATCH)
+    
+    The body is a 4-byte big-endian length, a JSON index of that many bytes
+    and then the thumbnails back to back. The index has an entry per
+    requested ID with its status: 'ready' entries give the offset and length
+    of the thumbnail in the data after the index, plus its ETag; 'pending'
+    entries are still being generated; 'missing' ones have no thumbnail.
+    The response ETag covers the whole index, so an unchanged gallery page
+    is answered with a 304.
+    """
+    try:
+        try:
+            file_ids = [int(part) for part in request.args.get('ids', '').split(',') if part.strip()]
+        except ValueError:
+            return jsonify({'error': 'ids must be a comma-separated list of file IDs'}), 400
+        
+        if not file_ids:
+            return jsonify({'error': 'No file IDs given'}), 400
+        
+        if len(file_ids) > config.MAX_THUMBNAIL_BATCH:
+            return jsonify({
+                'error': f'At most {config.MAX_THUMBNAIL_BATCH} thumbnails per request'
+            }), 413
+        
+        records = get_file_records(file_ids)
+        
+        items = []
+        parts = []  # (file ID, path, length) of each ready thumbnail
+        offset = 0
+        for file_id in file_ids:
+            file_record = records.get(file_id)
+            if file_record and file_record['thumbnail_status'] == 'pending':
+                items.append({'id': file_id, 'status': 'pending'})
+                continue
+            
+            length = None
+            if file_record and file_record['thumbnail_path']:
+                thumbnail_path = os.path.join(config.THUMBNAILS_PATH, file_record['thumbnail_path'])
+                body = cache.get(('thumbnail', file_id))
+                if body is not None:
+                    length = len(body)
+                else:
+                    try:
+                        length = os.path.getsize(thumbnail_path)
+                    except OSError:
+                        pass
+            
+            if length is None:
+                items.append({'id': file_id, 'status': 'missing'})
+                continue
+            
+            items.append({
+                'id': file_id,
+                'status': 'ready',
+                'offset': offset,
+                'length': length,
+                'etag': get_thumbnail_etag(file_record) or file_record['thumbnail_path']
+            })
+            parts.append((file_id, thumbnail_path, length))
+            offset += length
+        
+        index = json.dumps({'items': items}, separators=(',', ':')).encode()
+        etag = hashlib.md5(index).hexdigest()
+        
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            def generate():
+                yield struct.pack('>I', len(index)) + index
+                for file_id, thumbnail_path, length in parts:
+                    body = get_thumbnail_body(file_id, thumbnail_path)
+                    if body is None:
+                        with open(thumbnail_path, 'rb') as f:
+                            body = f.read(length)
+                    if len(body) != length:
+                        raise IOError(f'Thumbnail of file {file_id} changed while being sent')
+                    yield body
+            
+            response = Response(generate(), mimetype='application/x-thumbnail-pack',
+                                direct_passthrough=True)
+            response.content_length = 4 + len(index) + offset
+        
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -289,10 +1264,8 @@ def get_thumbnail(file_id):
 def delete_file(file_id):
     """Delete file by ID"""
     # Check authentication if enabled
-    if config.REQUIRE_AUTH:
-        token = request.headers.get('Authorization')
-        if token != f'Bearer {config.AUTH_TOKEN}':
-            return jsonify({'error': 'Unauthorized'}), 401
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
     
     try:
         file_record = db.get_file_by_id(file_id)
@@ -313,6 +1286,11 @@ def delete_file(file_id):
         
         # Delete database record
         db.delete_file(file_id)
+        invalidate_file(file_id)
+        
+        # Remove the chunks no other file shares
+        if file_record['storage'] == 'chunks':
+            db.delete_orphan_chunks(chunkstore.remove_chunk)
         
         return jsonify({'message': 'File deleted successfully'})
     
@@ -320,6 +1298,12 @@ def delete_file(file_id):
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Metrics of this server process in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/stats', methods=['GET'])
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
@@ -331,6 +1315,9 @@ def get_stats():
         total_size = stats.get('total_size', 0) or 0
         stats['total_size_formatted'] = format_file_size(total_size)
         
+        # Hit/miss counters of this server process's cache
+        stats['cache'] = cache.stats()
+        
         return jsonify(stats)
     
     except Exception as e:
@@ -340,24 +1327,61 @@ def get_stats():
 @app.route('/search', methods=['GET'])
 @app.route('/api/search', methods=['GET'])
 def search_files():
-    """Search files by filename"""
+    """
+    Search files by filename
+    
+    Query params:
+        q: Search text (each word is matched as a prefix)
+        limit: Max number of results (default SEARCH_DEFAULT_LIMIT)
+        cursor: next_cursor from the previous page
+        fields, format: See get_list_options
+    """
     try:
         query = request.args.get('q', '')
         
         if not query:
             return jsonify({'error': 'Search query required'}), 400
         
-        files = db.search_files(query)
+        limit = request.args.get('limit', config.SEARCH_DEFAULT_LIMIT, type=int)
+        limit = max(1, min(limit, config.SEARCH_MAX_LIMIT))
         
-        return jsonify({
-            'files': files,
-            'count': len(files)
-        })
+        cursor = request.args.get('cursor')
+        try:
+            fields, ndjson = get_list_options()
+            batches = db.iter_search_results(query, limit=limit, cursor=cursor, fields=fields)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        last_rank = []
+        
+        def without_rank(batches):
+            # The rank only matters to the cursor, so set the last one aside
+            for batch in batches:
+                last_rank[:] = [batch[-1]['search_rank']]
+                for file_record in batch:
+                    del file_record['search_rank']
+                yield batch
+        
+        return stream_file_list(
+            without_rank(batches), ndjson, limit,
+            lambda file_record: make_search_cursor(dict(file_record, search_rank=last_rank[0]))
+        )
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.errorhandler(RequestEntityTooLarge)
+def handle_file_too_large(e):
+    """Report uploads over MAX_FILE_SIZE as JSON"""
+    return jsonify({'error': e.description}), 413
+
+
+def start_background_services():
+    """Start the derivative worker (call once per server process)"""
+    worker.start()
+
+
 def format_file_size(size_bytes):
     """Format bytes to human readable size"""
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
@@ -376,6 +1400,10 @@ if __name__ == '__main__':
     print(f"Authentication: {'Enabled' if config.REQUIRE_AUTH else 'Disabled'}")
     print("=" * 60)
     
+    print("Development server; use serve.py for production")
+    
+    start_background_services()
+    
     app.run(
         host=config.HOST,
         port=config.PORT,
@@ -0,0 +1,129 @@
+"""
+In-process LRU cache
+
+Holds file records and small thumbnail bodies so that repeated gallery
+requests are answered without a database query or a disk read. The cache is
+bounded by an estimate of the memory its values use, not by entry count,
+since a thumbnail is a few hundred times larger than a record.
+
+Every server process has its own cache. Changes made in this process call
+invalidate(); entries also expire after a TTL, which bounds how long another
+process (a second gunicorn worker, manage.py) can see a stale entry.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Rough per-entry bookkeeping cost (key, OrderedDict node, tuple)
+ENTRY_OVERHEAD = 200
+
+
+def estimate_size(value):
+    """Approximate memory used by a cached value in bytes"""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value) + ENTRY_OVERHEAD
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + ENTRY_OVERHEAD + sum(
+            sys.getsizeof(item) for item in value.values()
+        )
+    return sys.getsizeof(value) + ENTRY_OVERHEAD
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache limited by total size in bytes"""
+
+    def __init__(self, max_bytes, max_item_size=None, ttl=None):
+        """
+        Args:
+            max_bytes (int): Total size the cache may hold
+            max_item_size (int): Larger values are not cached (default max_bytes)
+            ttl (float): Seconds an entry stays valid (None means forever)
+        """
+        self.max_bytes = max_bytes
+        self.max_item_size = max_item_size or max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, size, expires)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Look up a key, marking it as recently used
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """
+        Store a value, evicting the least recently used entries to make room
+
+        Returns:
+            bool: False if the value is too large to cache
+        """
+        size = estimate_size(value) if size is None else size
+        if size > self.max_item_size:
+            return False
+
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, expires)
+            self.size += size
+            while self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return True
+
+    def invalidate(self, *keys):
+        """Drop keys from the cache (missing keys are ignored)"""
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self._remove(key)
+
+    def clear(self):
+        """Drop every entry"""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+    def stats(self):
+        """
+        Hit/miss counters and current usage
+
+        Returns:
+            dict: hits, misses, hit_rate, evictions, entries, size, max_size
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'size': self.size,
+                'max_size': self.max_bytes
+            }
@@ -0,0 +1,252 @@
+"""
+Content-defined chunk store
+
+Stored files can be split into variable-size chunks whose boundaries depend
+on the content rather than on offsets, so inserting or removing bytes (a
+trimmed video, a photo with edited metadata) only changes the chunks around
+the edit. Chunks are named by their SHA-256 and kept once under
+CHUNKS_PATH, however many files contain them; the database records which
+chunks make up each file and how many references every chunk has.
+
+Boundaries are placed where a fixed bit pattern occurs in a fingerprint of
+the content that has one bit per byte (each byte mapped through a random
+table). Whether a position is a boundary depends only on the bytes just
+before it, as with a gear or Rabin rolling hash, but the fingerprint is
+built with bytes.translate and searched with bytes.find, so splitting runs
+at C speed instead of one Python operation per byte.
+"""
+import hashlib
+import io
+import os
+import random
+import tempfile
+from bisect import bisect_right
+from itertools import accumulate
+import config
+
+READ_SIZE = 8 * 1024 * 1024  # Bytes read from the source file at a time
+
+# Byte -> fingerprint bit (0 or 1); half of the byte values map to each.
+# Fixed seeds: changing the table or pattern would stop new chunks from
+# matching the stored ones.
+_bits = [0] * 128 + [1] * 128
+random.Random(0x5eed).shuffle(_bits)
+FINGERPRINT_TABLE = bytes(_bits)
+
+
+
+def unbordered_pattern(length, seed):
+    """
+    Random bit pattern none of whose prefixes is also a suffix
+
+    Such a pattern cannot overlap itself, so in random data it occurs on
+    average once every 2 ** length positions (a pattern like 000...0 would
+    occur far less evenly).
+    """
+    rng = random.Random(seed)
+    while True:
+        pattern = bytes(rng.getrandbits(1) for _ in range(length))
+        if not any(pattern[:k] == pattern[-k:] for k in range(1, length)):
+            return pattern
+
+
+# A boundary follows every occurrence of this pattern in the fingerprint,
+# on average once per CHUNK_AVG_SIZE bytes of random content
+BOUNDARY_PATTERN = unbordered_pattern(max(config.CHUNK_AVG_SIZE.bit_length() - 1, 1), 0xc0de)
+
+
+def split_chunks(f, min_size=config.CHUNK_MIN_SIZE, max_size=config.CHUNK_MAX_SIZE):
+    """
+    Split a file into content-defined chunks
+
+    Args:
+        f: Binary file object to read from its current position
+        min_size (int): Smallest chunk, except for the last one
+        max_size (int): Largest chunk; a chunk is cut here if no boundary occurs
+
+    Yields:
+        bytes: Consecutive chunks of the file
+    """
+    buffer = b''
+    eof = False
+    while not eof:
+        data = f.read(READ_SIZE)
+        eof = not data
+        buffer += data
+        fingerprint = buffer.translate(FINGERPRINT_TABLE)
+
+        start = 0
+        # Without max_size bytes in hand the boundary may lie in the next read
+        while len(buffer) - start >= (1 if eof else max_size):
+            if len(buffer) - start <= min_size:
+                end = len(buffer)
+            else:
+                # The pattern must end at or after min_size and by max_size
+                found = fingerprint.find(
+                    BOUNDARY_PATTERN,
+                    start + min_size - len(BOUNDARY_PATTERN),
+                    start + max_size
+                )
+                if found == -1:
+                    end = min(start + max_size, len(buffer))
+                else:
+                    end = found + len(BOUNDARY_PATTERN)
+            yield buffer[start:end]
+            start = end
+
+        buffer = buffer[start:]
+
+
+def chunk_path(chunk_hash):
+    """Location of a chunk: chunks/<h[0:2]>/<h[2:4]>/<hash>"""
+    return os.path.join(config.CHUNKS_PATH, chunk_hash[:2], chunk_hash[2:4], chunk_hash)
+
+
+def write_chunk(chunk_hash, data):
+    """Write a chunk unless it is already stored (atomically, via a temporary file)"""
+    path = chunk_path(chunk_hash)
+    if os.path.exists(path):
+        return False
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return True
+
+
+def store_chunks(file_path):
+    """
+    Split a stored file and write the chunks that are not stored yet
+
+    Runs in a worker process. The file itself is left in place; it is
+    removed once the chunk list has been recorded.
+
+    Returns:
+        list: (chunk hash, size) of each chunk, in file order
+    """
+    chunks = []
+    with open(file_path, 'rb') as f:
+        for data in split_chunks(f):
+            chunk_hash = hashlib.sha256(data).hexdigest()
+            write_chunk(chunk_hash, data)
+            chunks.append((chunk_hash, len(data)))
+    return chunks
+
+
+def restore_missing_chunks(file_path, chunks):
+    """
+    Rewrite chunks that were removed after store_chunks found them stored
+
+    A chunk that only a deleted file referenced can be garbage collected
+    between store_chunks seeing it on disk and the new references being
+    recorded; this puts such chunks back from the original file.
+
+    Returns:
+        int: Number of chunks rewritten
+    """
+    restored = 0
+    with open(file_path, 'rb') as f:
+        offset = 0
+        for chunk_hash, size in chunks:
+            if not os.path.exists(chunk_path(chunk_hash)):
+                f.seek(offset)
+                restored += write_chunk(chunk_hash, f.read(size))
+            offset += size
+    return restored
+
+
+def remove_chunk(chunk_hash):
+    """Delete a chunk's file (missing files are ignored)"""
+    try:
+        os.remove(chunk_path(chunk_hash))
+    except FileNotFoundError:
+        pass
+
+
+class ChunkReader(io.RawIOBase):
+    """Read-only, seekable file object reassembling a file from its chunks"""
+
+    def __init__(self, chunks):
+        """
+        Args:
+            chunks (list): (chunk hash, size) of each chunk, in file order
+        """
+        self.hashes = [chunk_hash for chunk_hash, _ in chunks]
+        self.offsets = list(accumulate((size for _, size in chunks), initial=0))
+        self.size = self.offsets[-1]
+        self.position = 0
+        self.index = None  # Chunk open in self.file
+        self.file = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('Negative seek position')
+        self.position = offset
+        return offset
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+
+        index = bisect_right(self.offsets, self.position) - 1
+        if index != self.index:
+            if self.file is not None:
+                self.file.close()
+            self.file = open(chunk_path(self.hashes[index]), 'rb')
+            self.index = index
+        self.file.seek(self.position - self.offsets[index])
+
+        length = min(len(buffer), self.offsets[index + 1] - self.position)
+        count = self.file.readinto(memoryview(buffer)[:length])
+        if not count:
+            raise IOError(f'Chunk {self.hashes[index]} is shorter than recorded')
+        self.position += count
+        return count
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        super().close()
+
+
+def open_chunked_file(chunks, buffer_size=256 * 1024):
+    """Buffered file object over a file's chunks (see ChunkReader)"""
+    return io.BufferedReader(ChunkReader(chunks), buffer_size)
+
+
+def open_stored_file(file_path, chunks=None):
+    """
+    Open a stored file for reading, wherever its content is kept
+
+    Args:
+        file_path (str): The file's recorded path
+        chunks (list): (chunk hash, size) of each chunk if the file is in
+            the chunk store (its file_path no longer exists), else None
+
+    Returns:
+        Binary file object
+    """
+    if chunks is None:
+        return open(file_path, 'rb')
+    return open_chunked_file(chunks)
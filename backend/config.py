@@ -3,15 +3,31 @@ Backend Server Configuration
 """
 import os
 
-# Server settings
-HOST = '0.0.0.0'  # Listen on all interfaces (accessible from network)
-PORT = 5000
+# Server settings (PCS_* environment variables override the defaults)
+HOST = os.environ.get('PCS_HOST', '0.0.0.0')  # Listen on all interfaces (accessible from network)
+PORT = int(os.environ.get('PCS_PORT', 5000))
 DEBUG = False  # Disabled for Python 3.13 compatibility
 
+# Production serving (serve.py)
+SERVER_WORKERS = int(os.environ.get('PCS_WORKERS', 2))  # Processes (gunicorn only)
+SERVER_THREADS = int(os.environ.get('PCS_THREADS', 16))  # Request threads per process
+MAX_CONCURRENT_UPLOADS = int(os.environ.get('PCS_MAX_UPLOADS', 4))  # Per process; the other threads stay free for reads
+UPLOAD_SLOT_WAIT = 2  # Seconds an upload waits for a free slot before getting a 503
+UPLOAD_RETRY_AFTER = 10  # Retry-After seconds sent with that 503
+GRACEFUL_SHUTDOWN_TIMEOUT = int(os.environ.get('PCS_GRACEFUL_TIMEOUT', 30))  # Seconds to finish in-flight requests
+
 # Storage settings
-STORAGE_PATH = os.path.join(os.path.expanduser('~'), 'MyCloud', 'Photos')
+STORAGE_PATH = os.environ.get('PCS_STORAGE_PATH', os.path.join(os.path.expanduser('~'), 'MyCloud', 'Photos'))
 THUMBNAILS_PATH = os.path.join(STORAGE_PATH, '.thumbnails')
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'storage.db')
+OBJECTS_PATH = os.path.join(STORAGE_PATH, 'objects')  # Content-addressed file store
+DATABASE_PATH = os.environ.get('PCS_DATABASE_PATH', os.path.join(os.path.dirname(__file__), 'storage.db'))
+
+# Database connection tuning (one connection is kept per thread)
+DB_BUSY_TIMEOUT = 10  # Seconds to wait for a lock held by another writer
+DB_SYNCHRONOUS = 'NORMAL'  # Safe with WAL; only the last commits can be lost on power failure
+DB_CACHE_SIZE_KB = 64 * 1024  # Page cache per connection
+DB_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the database file to memory-map
+DB_STATEMENT_CACHE_SIZE = 256  # Prepared statements cached per connection
 
 # Upload settings
 MAX_FILE_SIZE = 500 * 1024 * 1024  # 500 MB
@@ -20,6 +36,52 @@ ALLOWED_EXTENSIONS = {
     'mp4', 'avi', 'mov', 'mkv', 'wmv', 'flv', 'webm'  # Videos
 }
 
+MAX_EXISTS_BATCH = 10000  # Checksums accepted by one /files/exists request
+MAX_BATCH_FILES = 200  # Files accepted by one /upload/batch request
+
+# Resumable upload sessions (chunked uploads for large files)
+UPLOAD_SESSIONS_PATH = os.path.join(STORAGE_PATH, '.uploads')
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Default chunk size offered to clients
+MIN_UPLOAD_CHUNK_SIZE = 256 * 1024  # Smallest chunk size a client may request
+MAX_UPLOAD_CHUNK_SIZE = 64 * 1024 * 1024  # Largest chunk size a client may request
+UPLOAD_MISSING_LIST_LIMIT = 1000  # Missing chunk indices listed in a session status
+UPLOAD_SESSION_TTL = 7 * 24 * 60 * 60  # Seconds before an idle session is discarded
+
+# Download settings
+THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60  # Thumbnails never change for a given file ID
+MAX_BYTE_RANGES = 16  # Requests for more ranges than this get the whole file
+MAX_THUMBNAIL_BATCH = 500  # Thumbnails returned by one /thumbnails request
+USE_X_SENDFILE = False  # Let a front-end server (Apache, lighttpd) send files itself
+
+# In-memory cache of file records and thumbnails (per server process)
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_MAX_ITEM_SIZE = 256 * 1024  # Larger thumbnails are always read from disk
+CACHE_TTL = 60  # Seconds before an entry is re-read (bounds staleness across processes)
+
+# Search settings
+SEARCH_DEFAULT_LIMIT = 100  # Results per page when no limit is given
+SEARCH_MAX_LIMIT = 1000
+
+# File listings (/files and /search) are streamed as rows are read
+LIST_FETCH_SIZE = 500  # Records read from the database and sent per chunk
+LIST_GZIP = True  # Compress listings for clients that accept gzip
+LIST_GZIP_LEVEL = 5
+
+# Content-defined chunk store (optional). Stored files are split into chunks
+# in the background and a chunk shared by several files is kept once
+CHUNK_STORE_ENABLED = os.environ.get('PCS_CHUNK_STORE', '').lower() in ('1', 'true', 'yes')
+CHUNKS_PATH = os.path.join(STORAGE_PATH, 'chunks')
+CHUNK_MIN_SIZE = 64 * 1024
+CHUNK_AVG_SIZE = 256 * 1024  # Power of two; typical chunks are the minimum plus this
+CHUNK_MAX_SIZE = 1024 * 1024
+
+# Background derivative worker (thumbnails)
+THUMBNAIL_SIZE = (300, 300)
+WORKER_PROCESSES = os.cpu_count() or 1  # Processes used for image decoding
+JOB_POLL_INTERVAL = 2  # Seconds between checks of the job queue when idle
+JOB_MAX_ATTEMPTS = 3  # Attempts before a job is marked as failed
+JOB_RETRY_DELAY = 30  # Seconds before a failed job is retried (multiplied by attempt)
+
 # Security settings (optional - set to enable authentication)
 REQUIRE_AUTH = False
 AUTH_TOKEN = 'your-secret-token-here'  # Change this!
@@ -27,3 +89,4 @@ AUTH_TOKEN = 'your-secret-token-here'  # Change this!
 # Create directories if they don't exist
 os.makedirs(STORAGE_PATH, exist_ok=True)
 os.makedirs(THUMBNAILS_PATH, exist_ok=True)
+os.makedirs(UPLOAD_SESSIONS_PATH, exist_ok=True)
@@ -1,23 +1,240 @@
 """
 Database operations for file metadata storage
+
+Each thread reuses one SQLite connection (opened on first use and reopened
+after a fork), so per-call connection setup and the prepared statement
+cache are not thrown away between queries. The database runs in WAL mode
+so readers are never blocked by the writer.
 """
 import sqlite3
 import os
+import re
+import json
+import base64
+import threading
 from datetime import datetime
+import config
+import metrics
 from config import DATABASE_PATH
 
 
+# Sort orders accepted by get_all_files: order_by -> (column, descending)
+SORT_ORDERS = {
+    'upload_date DESC': ('upload_date', True),
+    'upload_date ASC': ('upload_date', False),
+    'created_date DESC': ('created_date', True),
+    'created_date ASC': ('created_date', False),
+    'file_size DESC': ('file_size', True),
+    'file_size ASC': ('file_size', False),
+    'original_filename ASC': ('original_filename', False),
+    'original_filename DESC': ('original_filename', True),
+}
+
+# Sort columns that may hold NULL; those rows are listed last in either direction.
+# upload_date is always filled in by its default, so it keeps its plain index order.
+NULLABLE_SORT_COLUMNS = {'created_date'}
+
+# Columns written when a file record is added
+FILE_COLUMNS = (
+    'filename', 'original_filename', 'file_path', 'file_size',
+    'file_type', 'mime_type', 'created_date', 'thumbnail_path',
+    'width', 'height', 'duration', 'codec', 'checksum', 'thumbnail_status'
+)
+
+# Fields a listing can be narrowed to with select_fields (every column of files)
+FILE_FIELDS = ('id',) + FILE_COLUMNS + ('upload_date', 'storage')
+
+# Breakdowns kept in the file_stats table: dimension -> SQL for a row's key
+# ({row} is the table or trigger row the file's columns come from)
+STATS_DIMENSIONS = {
+    'total': "''",
+    'type': "{row}.file_type",
+    'month': "COALESCE(strftime('%Y-%m', {row}.upload_date), '')",
+    'extension': '''
+        CASE WHEN instr({row}.original_filename, '.') = 0 THEN ''
+        ELSE lower(substr({row}.original_filename,
+            length(rtrim({row}.original_filename, replace({row}.original_filename, '.', ''))) + 1))
+        END''',
+}
+
+
+def encode_cursor(values):
+    """Encode a list of JSON values as an opaque, URL-safe cursor"""
+    payload = json.dumps(values)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def parse_cursor(cursor):
+    """
+    Decode a cursor made by encode_cursor
+    
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def make_cursor(file_record, order_by='upload_date DESC'):
+    """Build the opaque pagination cursor pointing just after file_record"""
+    column, _ = SORT_ORDERS[order_by]
+    return encode_cursor([order_by, file_record[column], file_record['id']])
+
+
+def decode_cursor(cursor, order_by):
+    """
+    Decode a pagination cursor
+    
+    Returns:
+        tuple: (sort value, id) of the last row already returned
+    
+    Raises:
+        ValueError: If the cursor is malformed or was made for another order
+    """
+    values = parse_cursor(cursor)
+    if len(values) != 3 or values[0] != order_by:
+        raise ValueError('Cursor does not match the requested sort order')
+    sort_value, file_id = values[1], values[2]
+    # Anything else would reach SQLite as an unbindable parameter
+    if not isinstance(sort_value, (str, int, float, type(None))) or isinstance(sort_value, bool):
+        raise ValueError('Invalid cursor sort value')
+    if not isinstance(file_id, int) or isinstance(file_id, bool):
+        raise ValueError('Invalid cursor')
+    return sort_value, file_id
+
+
+def make_search_cursor(file_record):
+    """Build the opaque cursor pointing just after a search result"""
+    return encode_cursor([
+        'search', file_record['search_rank'], file_record['upload_date'], file_record['id']
+    ])
+
+
+def decode_search_cursor(cursor):
+    """
+    Decode a search cursor
+    
+    Returns:
+        tuple: (rank, upload date, id) of the last result already returned
+    
+    Raises:
+        ValueError: If the cursor is malformed or not a search cursor
+    """
+    values = parse_cursor(cursor)
+    if len(values) != 4 or values[0] != 'search':
+        raise ValueError('Not a search cursor')
+    rank, upload_date, file_id = values[1:]
+    if not isinstance(rank, (int, float)) or isinstance(rank, bool):
+        raise ValueError('Invalid cursor')
+    if not isinstance(upload_date, str):
+        raise ValueError('Invalid cursor')
+    if not isinstance(file_id, int) or isinstance(file_id, bool):
+        raise ValueError('Invalid cursor')
+    return rank, upload_date, file_id
+
+
+def select_fields(fields, table=None):
+    """
+    Column list for a SELECT of file records, narrowed to some fields
+    
+    The id is always included, since every other endpoint needs it.
+    
+    Args:
+        fields (list): Names from FILE_FIELDS, or None for every column
+        table (str): Table to qualify the column names with
+    
+    Returns:
+        str: SQL column list
+    
+    Raises:
+        ValueError: If a field is not a column of files
+    """
+    prefix = f'{table}.' if table else ''
+    if fields is None:
+        return f'{prefix}*'
+    
+    unknown = [field for field in fields if field not in FILE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    
+    return ', '.join(prefix + field for field in FILE_FIELDS if field == 'id' or field in fields)
+
+
+def escape_like(text):
+    """Escape LIKE wildcards so text matches literally (with ESCAPE '\\')"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def stats_trigger_sql(row, sign):
+    """
+    Statements that add a file to (sign '+') or remove it from (sign '-')
+    every file_stats breakdown, for use in a trigger body
+    """
+    return ''.join(f'''
+                INSERT INTO file_stats (dimension, key, file_count, total_size)
+                VALUES ('{dimension}', {key.format(row=row)}, {sign}1, {sign}{row}.file_size)
+                ON CONFLICT (dimension, key) DO UPDATE SET
+                    file_count = file_count + excluded.file_count,
+                    total_size = total_size + excluded.total_size;'''
+        for dimension, key in STATS_DIMENSIONS.items()
+    )
+
+
+# Every query method is timed; setup and connection handling are not
+@metrics.time_methods(metrics.DB_QUERY_SECONDS, exclude={
+    'get_connection', 'open_connection', 'close', 'init_db',
+    'init_search_index', 'init_stats', 'fill_stats', 'migrate_checksum_index',
+    'init_chunk_store'
+})
 class Database:
     def __init__(self):
         self.db_path = DATABASE_PATH
+        self.local = threading.local()
         self.init_db()
     
     def get_connection(self):
-        """Get database connection"""
-        conn = sqlite3.connect(self.db_path)
+        """Get this thread's database connection, opening it on first use"""
+        conn = getattr(self.local, 'conn', None)
+        
+        # Connections must not be shared with a forked child process
+        if conn is None or self.local.pid != os.getpid():
+            conn = self.open_connection()
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        
+        return conn
+    
+    def open_connection(self):
+        """Open and tune a new database connection"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=config.DB_BUSY_TIMEOUT,
+            cached_statements=config.DB_STATEMENT_CACHE_SIZE
+        )
         conn.row_factory = sqlite3.Row  # Enable column access by name
+        
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA synchronous = {config.DB_SYNCHRONOUS}')
+        conn.execute(f'PRAGMA cache_size = {-int(config.DB_CACHE_SIZE_KB)}')
+        conn.execute(f'PRAGMA mmap_size = {int(config.DB_MMAP_SIZE)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
         return conn
     
+    def close(self):
+        """Close the calling thread's connection, if it has one"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            if self.local.pid == os.getpid():
+                conn.close()
+            self.local.conn = None
+    
     def init_db(self):
         """Initialize database with required tables"""
         conn = self.get_connection()
@@ -39,98 +256,563 @@ class Database:
                 width INTEGER,
                 height INTEGER,
                 duration INTEGER,
-                checksum TEXT
+                checksum TEXT,
+                thumbnail_status TEXT,
+                codec TEXT,
+                storage TEXT
+            )
+        ''')
+        
+        # Migrate databases created before thumbnails were generated in the background
+        columns = [row['name'] for row in cursor.execute('PRAGMA table_info(files)')]
+        if 'thumbnail_status' not in columns:
+            cursor.execute('ALTER TABLE files ADD COLUMN thumbnail_status TEXT')
+            cursor.execute('''
+                UPDATE files SET thumbnail_status = 'ready'
+                WHERE thumbnail_path IS NOT NULL
+            ''')
+        
+        # Video codec, read from the container header along with the duration
+        if 'codec' not in columns:
+            cursor.execute('ALTER TABLE files ADD COLUMN codec TEXT')
+        
+        # 'chunks' once the content has been moved into the chunk store
+        # (NULL: a plain file at file_path)
+        if 'storage' not in columns:
+            cursor.execute('ALTER TABLE files ADD COLUMN storage TEXT')
+        
+        # Create indexes for keyset pagination (newest first, optionally by type)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_upload_date_id
+            ON files(upload_date, id)
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_file_type_upload_date_id
+            ON files(file_type, upload_date, id)
+        ''')
+        
+        # Superseded by the composite indexes above
+        cursor.execute('DROP INDEX IF EXISTS idx_upload_date')
+        cursor.execute('DROP INDEX IF EXISTS idx_file_type')
+        
+        # Resumable upload sessions and the chunks received for each
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                id TEXT PRIMARY KEY,
+                original_filename TEXT NOT NULL,
+                total_size INTEGER NOT NULL,
+                chunk_size INTEGER NOT NULL,
+                checksum TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_chunks (
+                session_id TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                PRIMARY KEY (session_id, chunk_index)
+            )
+        ''')
+        
+        # Background jobs (thumbnail generation etc.)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                run_after TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
         
-        # Create index for faster searches
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_upload_date 
-            ON files(upload_date)
+            CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after
+            ON jobs(status, run_after)
         ''')
         
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_file_type 
-            ON files(file_type)
+            CREATE INDEX IF NOT EXISTS idx_jobs_file_id
+            ON jobs(file_id)
         ''')
         
+        self.migrate_checksum_index(cursor)
+        self.fts_enabled = self.init_search_index(cursor)
+        self.init_stats(cursor)
+        self.init_chunk_store(cursor)
+        
         conn.commit()
-        conn.close()
     
-    def add_file(self, file_data):
+    def init_search_index(self, cursor):
+        """
+        Create the FTS5 full-text index over filenames and file metadata
+        
+        The index is an external-content table over files, kept in sync by
+        triggers and built from existing rows the first time it is created.
+        
+        Returns:
+            bool: False if this SQLite build has no FTS5 (search then falls
+            back to a LIKE scan)
+        """
+        cursor.execute('''
+            SELECT 1 FROM sqlite_master
+            WHERE type = 'table' AND name = 'files_fts'
+        ''')
+        exists = cursor.fetchone() is not None
+        
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+                    original_filename, file_type, mime_type,
+                    content='files', content_rowid='id',
+                    prefix='2 3'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            print(f"[DATABASE] Full-text search unavailable ({e}), using LIKE search")
+            return False
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN
+                INSERT INTO files_fts (rowid, original_filename, file_type, mime_type)
+                VALUES (new.id, new.original_filename, new.file_type, new.mime_type);
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN
+                INSERT INTO files_fts (files_fts, rowid, original_filename, file_type, mime_type)
+                VALUES ('delete', old.id, old.original_filename, old.file_type, old.mime_type);
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS files_fts_update
+            AFTER UPDATE OF original_filename, file_type, mime_type ON files BEGIN
+                INSERT INTO files_fts (files_fts, rowid, original_filename, file_type, mime_type)
+                VALUES ('delete', old.id, old.original_filename, old.file_type, old.mime_type);
+                INSERT INTO files_fts (rowid, original_filename, file_type, mime_type)
+                VALUES (new.id, new.original_filename, new.file_type, new.mime_type);
+            END
+        ''')
+        
+        if not exists:
+            cursor.execute("INSERT INTO files_fts (files_fts) VALUES ('rebuild')")
+        
+        return True
+    
+    def init_stats(self, cursor):
+        """
+        Create the file_stats table and the triggers that maintain it
+        
+        Counts and sizes per file type, upload month and extension are
+        updated as files are added and removed, so /stats never scans the
+        files table. The table is filled from existing rows when first created.
+        """
+        cursor.execute('''
+            SELECT 1 FROM sqlite_master
+            WHERE type = 'table' AND name = 'file_stats'
+        ''')
+        exists = cursor.fetchone() is not None
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS file_stats (
+                dimension TEXT NOT NULL,
+                key TEXT NOT NULL,
+                file_count INTEGER NOT NULL DEFAULT 0,
+                total_size INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (dimension, key)
+            ) WITHOUT ROWID
+        ''')
+        
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS file_stats_insert AFTER INSERT ON files BEGIN
+                {stats_trigger_sql('new', '+')}
+            END
+        ''')
+        
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS file_stats_delete AFTER DELETE ON files BEGIN
+                {stats_trigger_sql('old', '-')}
+                DELETE FROM file_stats WHERE file_count = 0;
+            END
+        ''')
+        
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS file_stats_update
+            AFTER UPDATE OF file_size, file_type, upload_date, original_filename ON files BEGIN
+                {stats_trigger_sql('old', '-')}
+                {stats_trigger_sql('new', '+')}
+                DELETE FROM file_stats WHERE file_count = 0;
+            END
+        ''')
+        
+        if not exists:
+            self.fill_stats(cursor)
+    
+    def fill_stats(self, cursor):
+        """Recompute every file_stats row from the files table"""
+        cursor.execute('DELETE FROM file_stats')
+        for dimension, key in STATS_DIMENSIONS.items():
+            cursor.execute(f'''
+                INSERT INTO file_stats (dimension, key, file_count, total_size)
+                SELECT '{dimension}', {key.format(row='files')}, COUNT(*), SUM(file_size)
+                FROM files
+                GROUP BY 2
+            ''')
+    
+    def rebuild_stats(self):
+        """
+        Rebuild the file_stats table from scratch
+        
+        The triggers keep it exact, so this is only needed to repair drift
+        (e.g. after the files table was edited with triggers disabled).
+        
+        Returns:
+            dict: The rebuilt statistics
+        """
+        conn = self.get_connection()
+        with conn:
+            self.fill_stats(conn.cursor())
+        return self.get_stats()
+    
+    def init_chunk_store(self, cursor):
+        """
+        Create the chunk store tables and the triggers that keep its totals
+        
+        chunks has one row per stored chunk with the number of references
+        to it from file_chunks; a chunk whose count drops to zero is removed
+        by delete_orphan_chunks. chunk_totals holds a single row with the
+        number and size of stored chunks and the size they would take
+        without deduplication, so /stats never scans the chunk tables.
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chunks (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_chunks_unreferenced
+            ON chunks(refcount) WHERE refcount <= 0
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS file_chunks (
+                file_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                chunk_hash TEXT NOT NULL,
+                PRIMARY KEY (file_id, position)
+            ) WITHOUT ROWID
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chunk_totals (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                chunk_count INTEGER NOT NULL DEFAULT 0,
+                stored_size INTEGER NOT NULL DEFAULT 0,
+                referenced_size INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO chunk_totals (id) VALUES (1)')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS chunk_totals_insert AFTER INSERT ON chunks BEGIN
+                UPDATE chunk_totals SET
+                    chunk_count = chunk_count + 1,
+                    stored_size = stored_size + new.size,
+                    referenced_size = referenced_size + new.size * new.refcount;
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS chunk_totals_update AFTER UPDATE OF refcount ON chunks BEGIN
+                UPDATE chunk_totals SET
+                    referenced_size = referenced_size + new.size * (new.refcount - old.refcount);
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS chunk_totals_delete AFTER DELETE ON chunks BEGIN
+                UPDATE chunk_totals SET
+                    chunk_count = chunk_count - 1,
+                    stored_size = stored_size - old.size,
+                    referenced_size = referenced_size - old.size * old.refcount;
+            END
+        ''')
+    
+    def migrate_checksum_index(self, cursor):
+        """
+        Make checksums unique so duplicate detection is an index lookup
+        
+        Older libraries may hold several rows with the same checksum. The
+        oldest row keeps it; later copies get a NULL checksum and a failed
+        'checksum' job explaining why, so they are not hashed again. Rows that
+        have no checksum at all get a 'checksum' job, which the background
+        worker uses to fill the index in without blocking startup.
+        """
+        cursor.execute('''
+            SELECT 1 FROM sqlite_master
+            WHERE type = 'index' AND name = 'idx_files_checksum'
+        ''')
+        if cursor.fetchone() is None:
+            cursor.execute('''
+                SELECT files.id, originals.first_id
+                FROM files JOIN (
+                    SELECT checksum, MIN(id) AS first_id FROM files
+                    WHERE checksum IS NOT NULL
+                    GROUP BY checksum HAVING COUNT(*) > 1
+                ) AS originals ON originals.checksum = files.checksum
+                WHERE files.id != originals.first_id
+            ''')
+            duplicates = cursor.fetchall()
+            
+            if duplicates:
+                print(f"[DATABASE] {len(duplicates)} duplicate files found, keeping the oldest copy's checksum")
+            cursor.executemany('''
+                INSERT INTO jobs (file_id, kind, status, last_error)
+                VALUES (?, 'checksum', 'failed', ?)
+            ''', [(row['id'], f"Duplicate of file {row['first_id']}") for row in duplicates])
+            cursor.executemany(
+                'UPDATE files SET checksum = NULL WHERE id = ?',
+                [(row['id'],) for row in duplicates]
+            )
+            
+            cursor.execute('''
+                CREATE UNIQUE INDEX idx_files_checksum
+                ON files(checksum)
+            ''')
+        
+        # Queue hashing of rows that have never had a checksum
+        cursor.execute('''
+            INSERT INTO jobs (file_id, kind)
+            SELECT id, 'checksum' FROM files
+            WHERE checksum IS NULL AND NOT EXISTS (
+                SELECT 1 FROM jobs
+                WHERE jobs.file_id = files.id AND jobs.kind = 'checksum'
+            )
+        ''')
+        if cursor.rowcount > 0:
+            print(f"[DATABASE] Queued checksum backfill for {cursor.rowcount} files")
+    
+    def add_file(self, file_data, jobs=()):
         """
         Add a new file record
         
         Args:
             file_data (dict): File metadata
+            jobs (iterable): Kinds of background jobs to queue for the file,
+                inserted in the same transaction as the record
         
         Returns:
             int: ID of inserted record
         """
         conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO files (
-                filename, original_filename, file_path, file_size,
-                file_type, mime_type, created_date, thumbnail_path,
-                width, height, duration, checksum
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            file_data.get('filename'),
-            file_data.get('original_filename'),
-            file_data.get('file_path'),
-            file_data.get('file_size'),
-            file_data.get('file_type'),
-            file_data.get('mime_type'),
-            file_data.get('created_date'),
-            file_data.get('thumbnail_path'),
-            file_data.get('width'),
-            file_data.get('height'),
-            file_data.get('duration'),
-            file_data.get('checksum')
-        ))
-        
-        file_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                f'''
+                INSERT INTO files ({', '.join(FILE_COLUMNS)})
+                VALUES ({', '.join('?' * len(FILE_COLUMNS))})
+                ''',
+                [file_data.get(column) for column in FILE_COLUMNS]
+            )
+            
+            file_id = cursor.lastrowid
+            cursor.executemany(
+                'INSERT INTO jobs (file_id, kind) VALUES (?, ?)',
+                [(file_id, kind) for kind in jobs]
+            )
         
         return file_id
     
-    def get_all_files(self, limit=None, offset=0, file_type=None, order_by='upload_date DESC'):
+    def add_files(self, files):
+        """
+        Add several file records in one transaction
+        
+        Records whose checksum is already stored (e.g. by a concurrent
+        upload) are skipped rather than failing the whole batch.
+        
+        Args:
+            files (list): (file_data, jobs) pairs as taken by add_file; every
+                file_data must have a checksum
+        
+        Returns:
+            dict: Mapping of checksum to (file_id, inserted), where inserted
+            is False for records that were skipped as duplicates
+        """
+        if not files:
+            return {}
+        
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            # Hold the write lock so the new rows are exactly those above last_id
+            cursor.execute('BEGIN IMMEDIATE')
+            last_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM files').fetchone()[0]
+            
+            cursor.executemany(
+                f'''
+                INSERT OR IGNORE INTO files ({', '.join(FILE_COLUMNS)})
+                VALUES ({', '.join('?' * len(FILE_COLUMNS))})
+                ''',
+                [[file_data.get(column) for column in FILE_COLUMNS] for file_data, _ in files]
+            )
+            
+            results = {}
+            checksums = [file_data['checksum'] for file_data, _ in files]
+            for start in range(0, len(checksums), 500):
+                batch = checksums[start:start + 500]
+                cursor.execute(
+                    f'SELECT id, checksum FROM files WHERE checksum IN ({", ".join("?" * len(batch))})',
+                    batch
+                )
+                for row in cursor.fetchall():
+                    results[row['checksum']] = (row['id'], row['id'] > last_id)
+            
+            cursor.executemany(
+                'INSERT INTO jobs (file_id, kind) VALUES (?, ?)',
+                [
+                    (results[file_data['checksum']][0], kind)
+                    for file_data, jobs in files
+                    if results[file_data['checksum']][1]
+                    for kind in jobs
+                ]
+            )
+        
+        return results
+    
+    def get_all_files(self, limit=None, offset=0, file_type=None,
+                      order_by='upload_date DESC', cursor=None):
         """
         Get all files with optional filtering
         
+        Pages can be fetched with offset or, preferably, with the opaque
+        cursor returned by make_cursor for the last row of the previous page.
+        A cursor continues from that row through the index, so every page
+        costs the same regardless of how deep it is.
+        
         Args:
             limit (int): Maximum number of records to return
-            offset (int): Number of records to skip
+            offset (int): Number of records to skip (ignored with a cursor)
             file_type (str): Filter by file type ('image' or 'video')
-            order_by (str): Sort order
+            order_by (str): Sort order, one of SORT_ORDERS
+            cursor (str): Cursor of the last row already returned
         
         Returns:
             list: List of file records as dictionaries
+        
+        Raises:
+            ValueError: If order_by or cursor is invalid
         """
+        sql, params = self._list_query(limit, offset, file_type, order_by, cursor)
+        
         conn = self.get_connection()
-        cursor = conn.cursor()
+        db_cursor = conn.cursor()
+        
+        db_cursor.execute(sql, params)
+        files = [dict(row) for row in db_cursor.fetchall()]
+        
+        return files
+    
+    def iter_files(self, limit=None, offset=0, file_type=None,
+                   order_by='upload_date DESC', cursor=None, fields=None):
+        """
+        Like get_all_files, but read the records in batches as they are used
+        
+        Only LIST_FETCH_SIZE records are in memory at a time, however many
+        the query returns. The query runs (and invalid arguments raise) when
+        this is called; the batches are read from the open statement.
         
-        query = 'SELECT * FROM files'
+        Args:
+            fields (list): Fields to return (see select_fields); the sort
+                column is added so the caller can build a cursor
+            Others as for get_all_files
+        
+        Returns:
+            iterator: Lists of file records as dictionaries
+        
+        Raises:
+            ValueError: If order_by, cursor or fields is invalid
+        """
+        if fields is not None and order_by in SORT_ORDERS:
+            fields = list(fields) + [SORT_ORDERS[order_by][0]]
+        sql, params = self._list_query(limit, offset, file_type, order_by, cursor, fields)
+        
+        db_cursor = self.get_connection().cursor()
+        db_cursor.execute(sql, params)
+        return self._fetch_batches(db_cursor)
+    
+    def _list_query(self, limit, offset, file_type, order_by, cursor, fields=None):
+        """SQL and parameters of a get_all_files / iter_files query"""
+        if order_by not in SORT_ORDERS:
+            raise ValueError(f'Invalid sort order: {order_by}')
+        column, descending = SORT_ORDERS[order_by]
+        direction = 'DESC' if descending else 'ASC'
+        
+        query = f'SELECT {select_fields(fields)} FROM files'
+        conditions = []
         params = []
         
         if file_type:
-            query += ' WHERE file_type = ?'
+            conditions.append('file_type = ?')
             params.append(file_type)
         
-        query += f' ORDER BY {order_by}'
+        nullable = column in NULLABLE_SORT_COLUMNS
+        comparison = '<' if descending else '>'
         
-        if limit:
-            query += ' LIMIT ? OFFSET ?'
-            params.extend([limit, offset])
+        if cursor:
+            value, last_id = decode_cursor(cursor, order_by)
+            if value is None:
+                # Only the remaining NULL rows come after a NULL sort value
+                conditions.append(f'({column} IS NULL AND id {comparison} ?)')
+                params.append(last_id)
+            elif nullable:
+                conditions.append(f'({column} IS NULL OR ({column}, id) {comparison} (?, ?))')
+                params.extend([value, last_id])
+            else:
+                conditions.append(f'({column}, id) {comparison} (?, ?)')
+                params.extend([value, last_id])
         
-        cursor.execute(query, params)
-        files = [dict(row) for row in cursor.fetchall()]
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
         
-        conn.close()
-        return files
+        # id breaks ties so the order (and therefore the cursor) is stable
+        query += ' ORDER BY '
+        if nullable:
+            query += f'{column} IS NULL, '
+        query += f'{column} {direction}, id {direction}'
+        
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+            if offset and not cursor:
+                query += ' OFFSET ?'
+                params.append(offset)
+        
+        return query, params
+    
+    def _fetch_batches(self, db_cursor):
+        """Yield the rows of an executed statement as lists of dictionaries"""
+        try:
+            while True:
+                rows = db_cursor.fetchmany(config.LIST_FETCH_SIZE)
+                if not rows:
+                    break
+                yield [dict(row) for row in rows]
+        finally:
+            db_cursor.close()
     
     def get_file_by_id(self, file_id):
         """Get file by ID"""
@@ -140,7 +822,6 @@ class Database:
         cursor.execute('SELECT * FROM files WHERE id = ?', (file_id,))
         result = cursor.fetchone()
         
-        conn.close()
         return dict(result) if result else None
     
     def get_file_by_checksum(self, checksum):
@@ -151,55 +832,635 @@ class Database:
         cursor.execute('SELECT * FROM files WHERE checksum = ?', (checksum,))
         result = cursor.fetchone()
         
-        conn.close()
         return dict(result) if result else None
     
+    def get_files_by_ids(self, file_ids):
+        """
+        Get several files by ID
+        
+        Args:
+            file_ids (list): File IDs to look up
+        
+        Returns:
+            dict: Mapping of each existing file ID to its record
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        files = {}
+        # Stay well below SQLite's limit on bound parameters
+        for start in range(0, len(file_ids), 500):
+            batch = file_ids[start:start + 500]
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(f'SELECT * FROM files WHERE id IN ({placeholders})', batch)
+            files.update((row['id'], dict(row)) for row in cursor.fetchall())
+        
+        return files
+    
+    def get_existing_checksums(self, checksums):
+        """
+        Find which checksums are already stored
+        
+        Args:
+            checksums (list): MD5 checksums to look up
+        
+        Returns:
+            dict: Mapping of each stored checksum to its file ID
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        existing = {}
+        # Stay well below SQLite's limit on bound parameters
+        for start in range(0, len(checksums), 500):
+            batch = checksums[start:start + 500]
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(
+                f'SELECT id, checksum FROM files WHERE checksum IN ({placeholders})',
+                batch
+            )
+            existing.update((row['checksum'], row['id']) for row in cursor.fetchall())
+        
+        return existing
+    
     def delete_file(self, file_id):
         """Delete file record by ID"""
         conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM jobs WHERE file_id = ?', (file_id,))
+            
+            # Release the file's chunks; unreferenced ones are removed by
+            # delete_orphan_chunks
+            cursor.execute('''
+                UPDATE chunks SET refcount = refcount - (
+                    SELECT COUNT(*) FROM file_chunks
+                    WHERE file_id = ? AND chunk_hash = chunks.hash
+                )
+                WHERE hash IN (SELECT chunk_hash FROM file_chunks WHERE file_id = ?)
+            ''', (file_id, file_id))
+            cursor.execute('DELETE FROM file_chunks WHERE file_id = ?', (file_id,))
+            
+            cursor.execute('DELETE FROM files WHERE id = ?', (file_id,))
+            deleted = cursor.rowcount > 0
+        
+        return deleted
+    
+    def get_stats(self):
+        """
+        Get storage statistics
+        
+        Read from the file_stats table, which triggers keep up to date.
+        
+        Returns:
+            dict: Totals, image and video counts, and per-type, per-month and
+            per-extension breakdowns of file count and size
+        """
+        conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('DELETE FROM files WHERE id = ?', (file_id,))
-        deleted = cursor.rowcount > 0
+        stats = {
+            'total_files': 0,
+            'total_size': 0,
+            'image_count': 0,
+            'video_count': 0,
+            'by_type': {},
+            'by_month': {},
+            'by_extension': {}
+        }
         
-        conn.commit()
-        conn.close()
+        cursor.execute('SELECT dimension, key, file_count, total_size FROM file_stats')
+        for row in cursor.fetchall():
+            if row['dimension'] == 'total':
+                stats['total_files'] = row['file_count']
+                stats['total_size'] = row['total_size']
+            else:
+                stats[f"by_{row['dimension']}"][row['key']] = {
+                    'count': row['file_count'],
+                    'size': row['total_size']
+                }
+        
+        stats['image_count'] = stats['by_type'].get('image', {}).get('count', 0)
+        stats['video_count'] = stats['by_type'].get('video', {}).get('count', 0)
+        
+        cursor.execute('SELECT chunk_count, stored_size, referenced_size FROM chunk_totals')
+        totals = cursor.fetchone()
+        stats['chunk_store'] = {
+            'chunks': totals['chunk_count'],
+            'stored_size': totals['stored_size'],
+            'referenced_size': totals['referenced_size'],
+            'saved_size': totals['referenced_size'] - totals['stored_size'],
+            'dedupe_ratio': (
+                round(totals['referenced_size'] / totals['stored_size'], 3)
+                if totals['stored_size'] else None
+            )
+        }
+        
+        return stats
+    
+    def search_files(self, query, limit=None, cursor=None):
+        """
+        Search files by filename and metadata
+        
+        Every word in the query must match the start of a word in the
+        filename, file type or MIME type ("beach 2024" finds
+        "Beach_20240812.jpg"). Results are ranked by relevance, then newest
+        first, and paged with a keyset on (rank, upload_date, id) like
+        list_files. Relevance scores depend on the whole index, so files
+        added or deleted while paging can move a result across a page
+        boundary.
+        
+        Args:
+            query (str): Search text
+            limit (int): Maximum number of records to return
+            cursor (str): Cursor of the last result already returned
+        
+        Returns:
+            list: List of file records as dictionaries, each with its
+            search_rank (lower is more relevant)
+        
+        Raises:
+            ValueError: If cursor is invalid
+        """
+        return [file for batch in self.iter_search_results(query, limit, cursor) for file in batch]
+    
+    def iter_search_results(self, query, limit=None, cursor=None, fields=None):
+        """
+        Like search_files, but read the results in batches as they are used
+        
+        Args:
+            fields (list): Fields to return (see select_fields); upload_date
+                is added, and search_rank is always returned, so the caller
+                can build a cursor
+            Others as for search_files
+        
+        Returns:
+            iterator: Lists of file records as dictionaries
+        
+        Raises:
+            ValueError: If cursor or fields is invalid
+        """
+        after = decode_search_cursor(cursor) if cursor else None
+        if fields is not None:
+            fields = list(fields) + ['upload_date']
+        
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            select_fields(fields)  # Still reject unknown fields
+            return iter(())
+        
+        if self.fts_enabled:
+            sql = f'''
+                SELECT {select_fields(fields, 'files')}, files_fts.rank AS search_rank
+                FROM files_fts
+                JOIN files ON files.id = files_fts.rowid
+                WHERE files_fts MATCH ?
+            '''
+            params = [' '.join(f'"{term}"*' for term in terms)]
+            if after:
+                rank, upload_date, last_id = after
+                sql += '''
+                    AND (files_fts.rank > ? OR (files_fts.rank = ?
+                         AND (files.upload_date, files.id) < (?, ?)))
+                '''
+                params.extend([rank, rank, upload_date, last_id])
+            sql += ' ORDER BY files_fts.rank, files.upload_date DESC, files.id DESC'
+        else:
+            # Without FTS5 every match ranks the same
+            sql = f'SELECT {select_fields(fields)}, 0 AS search_rank FROM files WHERE '
+            sql += ' AND '.join("original_filename LIKE ? ESCAPE '\\'" for _ in terms)
+            params = [f'%{escape_like(term)}%' for term in terms]
+            if after:
+                _, upload_date, last_id = after
+                sql += ' AND (upload_date, id) < (?, ?)'
+                params.extend([upload_date, last_id])
+            sql += ' ORDER BY upload_date DESC, id DESC'
+        
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        
+        db_cursor = self.get_connection().cursor()
+        db_cursor.execute(sql, params)
+        return self._fetch_batches(db_cursor)
+    
+    def create_upload_session(self, session_data):
+        """
+        Create a resumable upload session
+        
+        Args:
+            session_data (dict): Session metadata (id, original_filename,
+                total_size, chunk_size, checksum)
+        """
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO upload_sessions (
+                    id, original_filename, total_size, chunk_size, checksum
+                ) VALUES (?, ?, ?, ?, ?)
+            ''', (
+                session_data.get('id'),
+                session_data.get('original_filename'),
+                session_data.get('total_size'),
+                session_data.get('chunk_size'),
+                session_data.get('checksum')
+            ))
+    
+    def get_upload_session(self, session_id):
+        """Get upload session by ID"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM upload_sessions WHERE id = ?', (session_id,))
+        result = cursor.fetchone()
+        
+        return dict(result) if result else None
+    
+    def get_upload_chunks(self, session_id):
+        """
+        Get the chunks already received for an upload session
+        
+        Returns:
+            dict: Mapping of chunk index to chunk size in bytes
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT chunk_index, size FROM upload_chunks
+            WHERE session_id = ?
+            ORDER BY chunk_index
+        ''', (session_id,))
+        chunks = {row['chunk_index']: row['size'] for row in cursor.fetchall()}
+        
+        return chunks
+    
+    def add_upload_chunk(self, session_id, chunk_index, size):
+        """Record that a chunk of an upload session has been written to disk"""
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT OR REPLACE INTO upload_chunks (session_id, chunk_index, size)
+                VALUES (?, ?, ?)
+            ''', (session_id, chunk_index, size))
+            cursor.execute('''
+                UPDATE upload_sessions SET updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (session_id,))
+    
+    def delete_upload_session(self, session_id):
+        """Delete an upload session and its chunk records"""
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM upload_chunks WHERE session_id = ?', (session_id,))
+            cursor.execute('DELETE FROM upload_sessions WHERE id = ?', (session_id,))
+            deleted = cursor.rowcount > 0
         
         return deleted
     
-    def get_stats(self):
-        """Get storage statistics"""
+    def get_expired_upload_sessions(self, max_age_seconds):
+        """Get IDs of upload sessions idle for longer than max_age_seconds"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        # Total files and size
         cursor.execute('''
-            SELECT 
-                COUNT(*) as total_files,
-                SUM(file_size) as total_size,
-                SUM(CASE WHEN file_type = 'image' THEN 1 ELSE 0 END) as image_count,
-                SUM(CASE WHEN file_type = 'video' THEN 1 ELSE 0 END) as video_count
-            FROM files
-        ''')
+            SELECT id FROM upload_sessions
+            WHERE updated_at < datetime('now', ?)
+        ''', (f'-{int(max_age_seconds)} seconds',))
+        session_ids = [row['id'] for row in cursor.fetchall()]
         
-        result = cursor.fetchone()
-        stats = dict(result) if result else {}
+        return session_ids
+    
+    def claim_jobs(self, limit):
+        """
+        Atomically claim queued jobs that are due to run
         
-        conn.close()
-        return stats
+        Claimed jobs are marked 'running' so no other worker picks them up.
+        A file's jobs run one at a time in the order they were queued, so a
+        'chunk' job, which replaces the stored file, waits for the jobs that
+        read it.
+        
+        Args:
+            limit (int): Maximum number of jobs to claim
+        
+        Returns:
+            list: Job records joined with the filename and path of their file
+        """
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            # Take the write lock up front so concurrent workers cannot claim the same job
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT jobs.*, files.filename, files.file_path, files.storage
+                FROM jobs JOIN files ON files.id = jobs.file_id
+                WHERE jobs.status = 'queued' AND jobs.run_after <= CURRENT_TIMESTAMP
+                    AND NOT EXISTS (
+                        SELECT 1 FROM jobs AS earlier
+                        WHERE earlier.file_id = jobs.file_id AND earlier.id < jobs.id
+                            AND earlier.status IN ('queued', 'running')
+                    )
+                ORDER BY jobs.id
+                LIMIT ?
+            ''', (limit,))
+            jobs = [dict(row) for row in cursor.fetchall()]
+            
+            cursor.executemany('''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', [(job['id'],) for job in jobs])
+        
+        for job in jobs:
+            job['attempts'] += 1
+        return jobs
+    
+    def complete_job(self, job_id):
+        """Remove a job that finished successfully"""
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+    
+    def fail_job(self, job_id, error, retry_delay=None):
+        """
+        Record a job failure
+        
+        Args:
+            job_id (int): Job ID
+            error (str): Error message
+            retry_delay (int): Seconds until the job is retried, or None to
+                mark it permanently failed
+        """
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            if retry_delay is None:
+                cursor.execute('''
+                    UPDATE jobs SET status = 'failed', last_error = ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (error, job_id))
+            else:
+                cursor.execute('''
+                    UPDATE jobs SET status = 'queued', last_error = ?,
+                        run_after = datetime('now', ?), updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (error, f'+{int(retry_delay)} seconds', job_id))
+    
+    def requeue_running_jobs(self):
+        """Return jobs left 'running' by a previous process to the queue"""
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                UPDATE jobs SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'running'
+            ''')
+            requeued = cursor.rowcount
+        
+        return requeued
+    
+    def count_jobs(self):
+        """Get the number of jobs in each status"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT status, COUNT(*) AS count FROM jobs GROUP BY status')
+        counts = {row['status']: row['count'] for row in cursor.fetchall()}
+        
+        return counts
+    
+    def update_file_thumbnail(self, file_id, thumbnail_path, thumbnail_status,
+                              width=None, height=None):
+        """
+        Record the outcome of thumbnail generation for a file
+        
+        Returns:
+            bool: False if the file no longer exists
+        """
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                UPDATE files SET thumbnail_path = ?, thumbnail_status = ?,
+                    width = COALESCE(?, width), height = COALESCE(?, height)
+                WHERE id = ?
+            ''', (thumbnail_path, thumbnail_status, width, height, file_id))
+            updated = cursor.rowcount > 0
+        
+        return updated
     
-    def search_files(self, query):
-        """Search files by filename"""
+    def get_videos_without_media_info(self, after_id=0, limit=500, include_probed=False):
+        """
+        Get a batch of videos whose duration has not been read yet
+        
+        Args:
+            after_id (int): Only return files with a larger ID (keyset paging)
+            limit (int): Maximum number of files
+            include_probed (bool): Return every video, not just unprobed ones
+            
+        Returns:
+            list: (id, file_path, storage) rows in ID order
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(f'''
+            SELECT id, file_path, storage FROM files
+            WHERE file_type = 'video' AND id > ?
+            {'' if include_probed else 'AND duration IS NULL'}
+            ORDER BY id
+            LIMIT ?
+        ''', (after_id, limit))
+        
+        return [(row['id'], row['file_path'], row['storage']) for row in cursor.fetchall()]
+    
+    def update_media_info(self, rows):
+        """
+        Store video metadata for several files in one transaction
+        
+        Args:
+            rows (list): (duration, width, height, codec, file_id) tuples
+        """
+        conn = self.get_connection()
+        with conn:
+            conn.executemany('''
+                UPDATE files SET duration = ?, width = COALESCE(?, width),
+                    height = COALESCE(?, height), codec = ?
+                WHERE id = ?
+            ''', rows)
+    
+    def set_file_checksum(self, file_id, checksum):
+        """
+        Store the checksum of a file
+        
+        Returns:
+            int: ID of another file that already has this checksum (the
+            checksum is then left unset), or None on success
+        """
+        conn = self.get_connection()
+        try:
+            with conn:
+                conn.execute(
+                    'UPDATE files SET checksum = ? WHERE id = ?',
+                    (checksum, file_id)
+                )
+        except sqlite3.IntegrityError:
+            existing_file = self.get_file_by_checksum(checksum)
+            return existing_file['id'] if existing_file else None
+        
+        return None
+    
+    def add_file_chunks(self, file_id, chunks):
+        """
+        Record that a file is now stored as chunks
+        
+        Adds a reference to every chunk (creating the chunk rows that do not
+        exist yet) and marks the file's storage as 'chunks'. If the file was
+        deleted in the meantime, the chunks are recorded without references
+        so delete_orphan_chunks removes them.
+        
+        Args:
+            file_id (int): File the chunks belong to
+            chunks (list): (chunk hash, size) of each chunk, in file order
+        
+        Returns:
+            bool: False if the file no longer exists
+        """
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(
+                "UPDATE files SET storage = 'chunks' WHERE id = ? AND storage IS NULL",
+                (file_id,)
+            )
+            exists = cursor.rowcount > 0
+            
+            references = {}
+            for chunk_hash, size in chunks:
+                count, _ = references.get(chunk_hash, (0, size))
+                references[chunk_hash] = (count + 1, size)
+            
+            cursor.executemany('''
+                INSERT INTO chunks (hash, size, refcount) VALUES (?, ?, ?)
+                ON CONFLICT (hash) DO UPDATE SET refcount = refcount + excluded.refcount
+            ''', [
+                (chunk_hash, size, count if exists else 0)
+                for chunk_hash, (count, size) in references.items()
+            ])
+            
+            if exists:
+                cursor.executemany(
+                    'INSERT INTO file_chunks (file_id, position, chunk_hash) VALUES (?, ?, ?)',
+                    [(file_id, position, chunk_hash) for position, (chunk_hash, _) in enumerate(chunks)]
+                )
+        
+        return exists
+    
+    def get_file_chunks(self, file_id):
+        """
+        Get the chunks a file is stored as
+        
+        Returns:
+            list: (chunk hash, size) of each chunk, in file order
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT * FROM files 
-            WHERE original_filename LIKE ?
-            ORDER BY upload_date DESC
-        ''', (f'%{query}%',))
+            SELECT chunks.hash, chunks.size FROM file_chunks
+            JOIN chunks ON chunks.hash = file_chunks.chunk_hash
+            WHERE file_chunks.file_id = ?
+            ORDER BY file_chunks.position
+        ''', (file_id,))
+        
+        return [(row['hash'], row['size']) for row in cursor.fetchall()]
+    
+    def delete_orphan_chunks(self, remove):
+        """
+        Garbage-collect chunks that no file references any more
         
-        files = [dict(row) for row in cursor.fetchall()]
+        The rows are deleted and their files removed while the write lock is
+        held, so a chunk cannot gain a new reference halfway through.
         
-        conn.close()
-        return files
+        Args:
+            remove (callable): Deletes a chunk's file, given its hash
+        
+        Returns:
+            tuple: (number of chunks removed, bytes freed)
+        """
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT hash, size FROM chunks WHERE refcount <= 0')
+            orphans = cursor.fetchall()
+            
+            for row in orphans:
+                remove(row['hash'])
+            cursor.executemany(
+                'DELETE FROM chunks WHERE hash = ?',
+                [(row['hash'],) for row in orphans]
+            )
+        
+        return len(orphans), sum(row['size'] for row in orphans)
+    
+    def get_known_chunks(self, chunk_hashes):
+        """
+        Find which chunk hashes have a row in the chunks table
+        
+        Returns:
+            set: The hashes that are recorded
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        known = set()
+        # Stay well below SQLite's limit on bound parameters
+        for start in range(0, len(chunk_hashes), 500):
+            batch = chunk_hashes[start:start + 500]
+            placeholders = ', '.join('?' * len(batch))
+            cursor.execute(f'SELECT hash FROM chunks WHERE hash IN ({placeholders})', batch)
+            known.update(row['hash'] for row in cursor.fetchall())
+        
+        return known
+    
+    def queue_chunk_jobs(self):
+        """
+        Queue a 'chunk' job for every plain file that does not have one
+        
+        Returns:
+            int: Number of jobs queued
+        """
+        conn = self.get_connection()
+        with conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO jobs (file_id, kind)
+                SELECT id, 'chunk' FROM files
+                WHERE storage IS NULL AND NOT EXISTS (
+                    SELECT 1 FROM jobs
+                    WHERE jobs.file_id = files.id AND jobs.kind = 'chunk'
+                        AND jobs.status IN ('queued', 'running')
+                )
+            ''')
+            queued = cursor.rowcount
+        
+        return queued
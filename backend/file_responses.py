@@ -0,0 +1,280 @@
+"""
+HTTP responses for stored files
+
+Builds on Flask's send_file, which already answers If-None-Match,
+If-Modified-Since and If-Range with 304s and single byte ranges with 206s.
+Here the ETag is the file's checksum (so it is strong and stable across
+restarts), thumbnails can be marked immutable, and requests for several
+ranges get a multipart/byteranges response instead of a 416.
+
+Full-file responses go through the WSGI server's file_wrapper, which lets
+servers such as gunicorn use sendfile(); with USE_X_SENDFILE the front-end
+web server sends the file instead. Small bodies already in memory (cached
+thumbnails) are sent with send_bytes, and files reassembled from the chunk
+store with send_file_object; both answer the same conditional requests.
+"""
+import functools
+import os
+import time
+import uuid
+import mimetypes
+from datetime import datetime, timezone
+from flask import Response, request, send_file
+from werkzeug.datastructures import Range
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+import config
+
+
+def send_stored_file(path, etag=None, mimetype=None, download_name=None,
+                     max_age=None, immutable=False):
+    """
+    Send a file from disk with validators and byte-range support
+
+    Args:
+        path (str): Path of the file to send
+        etag (str): Strong ETag, normally the file checksum; None falls back
+            to Werkzeug's mtime/size based tag
+        mimetype (str): Content type (guessed from the path if None)
+        download_name (str): Send as an attachment with this filename
+        max_age (int): Cache lifetime in seconds (None means revalidate)
+        immutable (bool): Tell caches the content for this URL never changes
+
+    Returns:
+        Response: 200, 206 or 304 response
+    """
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    if etag and request.if_none_match.contains(etag):
+        # Answered here because send_file checks the Range header first
+        response = Response(status=304)
+        response.set_etag(etag)
+        if max_age is not None:
+            response.cache_control.max_age = max_age
+    else:
+        ranges = None
+        if request.range is not None:
+            stat = os.stat(path)
+            ranges = get_multiple_ranges(stat.st_size, etag, stat.st_mtime)
+        if ranges:
+            response = send_byte_ranges(functools.partial(open, path, 'rb'), stat.st_size,
+                                        ranges, mimetype)
+            if etag:
+                response.set_etag(etag)
+        else:
+            try:
+                response = send_file(
+                    path,
+                    mimetype=mimetype,
+                    as_attachment=download_name is not None,
+                    download_name=download_name,
+                    etag=etag if etag else True,
+                    conditional=True,
+                    max_age=max_age
+                )
+            except RequestedRangeNotSatisfiable as e:
+                return e.get_response()
+
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+
+def send_bytes(data, etag=None, mimetype='application/octet-stream',
+               max_age=None, immutable=False):
+    """
+    Send an in-memory body with the same caching headers as send_stored_file
+
+    Args:
+        data (bytes): Response body
+        etag (str): Strong ETag (None hashes the body)
+        mimetype (str): Content type
+        max_age (int): Cache lifetime in seconds (None means revalidate)
+        immutable (bool): Tell caches the content for this URL never changes
+
+    Returns:
+        Response: 200, 206 or 304 response
+    """
+    response = Response(data, mimetype=mimetype)
+
+    if max_age is not None:
+        if max_age > 0:
+            response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response.expires = int(time.time() + max_age)
+
+    if etag:
+        response.set_etag(etag)
+    else:
+        response.add_etag()
+
+    try:
+        response = response.make_conditional(request.environ, accept_ranges=True,
+                                              complete_length=len(data))
+    except RequestedRangeNotSatisfiable as e:
+        return e.get_response()
+
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+
+def send_file_object(open_file, size, etag, mimetype, download_name=None):
+    """
+    Send a file that is not a plain file on disk, with byte-range support
+
+    Args:
+        open_file (callable): Returns a new seekable binary file object
+        size (int): Length of the file
+        etag (str): Strong ETag, normally the file checksum
+        mimetype (str): Content type
+        download_name (str): Send as an attachment with this filename
+
+    Returns:
+        Response: 200, 206 or 304 response
+    """
+    if etag and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    ranges = get_multiple_ranges(size, etag)
+    if ranges:
+        response = send_byte_ranges(open_file, size, ranges, mimetype)
+        if etag:
+            response.set_etag(etag)
+        return response
+
+    # send_file cannot tell the length of a file object, so the single
+    # range and conditional handling is applied here
+    response = send_file(
+        open_file(),
+        mimetype=mimetype,
+        as_attachment=download_name is not None,
+        download_name=download_name,
+        etag=etag,
+        conditional=False
+    )
+    response.content_length = size
+    try:
+        return response.make_conditional(request.environ, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable as e:
+        response.close()
+        return e.get_response()
+
+
+def get_multiple_ranges(size, etag, mtime=None):
+    """
+    Resolve a Range header asking for more than one range
+
+    Args:
+        size (int): Length of the file
+        etag (str): The file's ETag, for If-Range
+        mtime (float): The file's modification time, for If-Range (None
+            sends the whole file when If-Range has a date)
+
+    Returns:
+        list: Sorted (start, stop) byte ranges, or None when the request
+        should be left to send_file (no Range, a single range or a failed
+        If-Range)
+    """
+    parsed = request.range
+    if parsed is None or parsed.units != 'bytes' or len(parsed.ranges) < 2:
+        return None
+
+    # If-Range must match, otherwise the whole file is sent
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None:
+        if mtime is None or if_range.date < datetime.fromtimestamp(int(mtime), timezone.utc):
+            return None
+
+    # Many tiny ranges are a known amplification trick; just send the file
+    if len(parsed.ranges) > config.MAX_BYTE_RANGES:
+        return None
+
+    resolved = []
+    for start, stop in parsed.ranges:
+        single = Range('bytes', [(start, stop)]).range_for_length(size)
+        if single is not None:
+            resolved.append(single)
+
+    if not resolved:
+        return None
+
+    # Merge adjacent ranges (Werkzeug already rejects overlapping ones)
+    merged = []
+    for start, stop in sorted(resolved):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def send_byte_ranges(open_file, size, ranges, mimetype):
+    """
+    Build a 206 response for one or more resolved byte ranges
+
+    Args:
+        open_file (callable): Returns a new binary file object for the content
+        size (int): Length of the file
+        ranges (list): (start, stop) byte ranges
+        mimetype (str): Content type
+    """
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        response = Response(
+            read_range(open_file, start, stop),
+            status=206,
+            mimetype=mimetype,
+            direct_passthrough=True
+        )
+        response.content_length = stop - start
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        response.accept_ranges = 'bytes'
+        return response
+
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (
+            f'--{boundary}\r\n'
+            f'Content-Type: {mimetype}\r\n'
+            f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n'
+        ).encode()
+        for start, stop in ranges
+    ]
+    closing = f'--{boundary}--\r\n'.encode()
+
+    def generate():
+        for header, (start, stop) in zip(part_headers, ranges):
+            yield header
+            yield from read_range(open_file, start, stop)
+            yield b'\r\n'
+        yield closing
+
+    response = Response(
+        generate(),
+        status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+        direct_passthrough=True
+    )
+    response.content_length = (
+        sum(len(header) + (stop - start) + 2 for header, (start, stop) in zip(part_headers, ranges))
+        + len(closing)
+    )
+    response.accept_ranges = 'bytes'
+    return response
+
+
+def read_range(open_file, start, stop, block_size=256 * 1024):
+    """Yield the bytes of a file between start and stop"""
+    with open_file() as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            data = f.read(min(block_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
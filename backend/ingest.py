@@ -0,0 +1,109 @@
+"""
+Streaming ingest of uploaded files
+
+Multipart file parts are written straight into a temporary file on the
+storage volume and hashed as the bytes arrive. Once the upload has been
+accepted the temporary file is renamed into place, so every upload is
+received once, written once and never copied or re-read for its checksum.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+import config
+import metrics
+
+CHECKSUM_SECONDS = metrics.UPLOAD_PHASE_SECONDS.labels('checksum')
+WRITE_SECONDS = metrics.UPLOAD_PHASE_SECONDS.labels('write')
+
+
+class IngestFile:
+    """Temporary upload file that computes its MD5 checksum while being written"""
+
+    def __init__(self, max_size=None, directory=None):
+        fd, self.path = tempfile.mkstemp(
+            suffix='.ingest',
+            dir=directory or config.UPLOAD_SESSIONS_PATH
+        )
+        self.file = os.fdopen(fd, 'w+b')
+        self.md5 = hashlib.md5()
+        self.size = 0
+        self.max_size = max_size
+        self.committed = False
+        self.closed = False
+        # Time spent hashing and writing, excluding waits for the network
+        self.hash_seconds = 0.0
+        self.write_seconds = 0.0
+
+    def write(self, data):
+        """Append data, updating the checksum and enforcing the size limit"""
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge(
+                f'File exceeds the maximum size of {self.max_size} bytes'
+            )
+        started = time.perf_counter()
+        self.md5.update(data)
+        hashed = time.perf_counter()
+        written = self.file.write(data)
+        self.hash_seconds += hashed - started
+        self.write_seconds += time.perf_counter() - hashed
+        return written
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def readline(self, size=-1):
+        return self.file.readline(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def flush(self):
+        self.file.flush()
+
+    def checksum(self):
+        """MD5 hex digest of everything written so far"""
+        return self.md5.hexdigest()
+
+    def commit(self, dest_path):
+        """Atomically move the received file to its final location"""
+        started = time.perf_counter()
+        self.file.close()
+        os.replace(self.path, dest_path)
+        self.write_seconds += time.perf_counter() - started
+        self.committed = True
+
+    def close(self):
+        """Close the file, deleting it unless it has been committed"""
+        self.file.close()
+        if not self.committed and os.path.exists(self.path):
+            os.remove(self.path)
+
+        if not self.closed:
+            self.closed = True
+            metrics.UPLOAD_BYTES.inc(self.size)
+            CHECKSUM_SECONDS.observe(self.hash_seconds)
+            WRITE_SECONDS.observe(self.write_seconds)
+
+
+class IngestRequest(Request):
+    """Request that streams uploaded file parts into IngestFile objects"""
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        ingest_file = IngestFile(max_size=config.MAX_FILE_SIZE)
+        # Tracked separately so parts of a rejected upload are cleaned up too
+        self.__dict__.setdefault('ingest_files', []).append(ingest_file)
+        return ingest_file
+
+    def close(self):
+        """Close the request, removing any uploaded files that were not committed"""
+        super().close()
+        for ingest_file in self.__dict__.pop('ingest_files', []):
+            ingest_file.close()
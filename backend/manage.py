@@ -0,0 +1,147 @@
+"""
+Maintenance commands for the storage server
+
+Usage:
+    python manage.py rebuild-stats
+    python manage.py probe-videos [--all]
+    python manage.py chunk-files
+    python manage.py gc-chunks
+"""
+import argparse
+import os
+import time
+import config
+import chunkstore
+from database import Database
+from media_probe import probe_video_file, ProbeError
+
+# Videos probed per database transaction
+PROBE_BATCH_SIZE = 500
+
+# Chunk files younger than this may belong to a chunk job still running
+STRAY_CHUNK_AGE = 60 * 60
+
+
+def rebuild_stats(db, args):
+    """Recompute the materialized storage statistics"""
+    before = db.get_stats()
+    after = db.rebuild_stats()
+
+    print(f"Files: {before['total_files']} -> {after['total_files']}")
+    print(f"Total size: {before['total_size']} -> {after['total_size']} bytes")
+    if before == after:
+        print("Statistics were already up to date")
+    else:
+        print("Statistics rebuilt")
+
+
+def probe_videos(db, args):
+    """Fill in duration, frame size and codec of stored videos"""
+    probed = skipped = 0
+    last_id = 0
+
+    while True:
+        videos = db.get_videos_without_media_info(last_id, PROBE_BATCH_SIZE, args.all)
+        if not videos:
+            break
+        last_id = videos[-1][0]
+
+        rows = []
+        for file_id, file_path, storage in videos:
+            chunks = db.get_file_chunks(file_id) if storage == 'chunks' else None
+            try:
+                with chunkstore.open_stored_file(file_path, chunks) as f:
+                    info = probe_video_file(f)
+            except (ProbeError, OSError) as e:
+                print(f"Skipping {file_path}: {e}")
+                skipped += 1
+                continue
+            duration = round(info['duration']) if info['duration'] is not None else None
+            rows.append((duration, info['width'], info['height'], info['codec'], file_id))
+
+        db.update_media_info(rows)
+        probed += len(rows)
+        print(f"Probed {probed} videos...")
+
+    print(f"Updated {probed} videos, {skipped} could not be read")
+
+
+def chunk_files(db, args):
+    """Queue every plain file for moving into the chunk store"""
+    queued = db.queue_chunk_jobs()
+    print(f"Queued {queued} files; the server's background worker will split them")
+
+
+def format_size(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def gc_chunks(db, args):
+    """Remove unreferenced chunks, and chunk files with no database row"""
+    removed, freed = db.delete_orphan_chunks(chunkstore.remove_chunk)
+    print(f"Removed {removed} unreferenced chunks ({format_size(freed)})")
+
+    # Left behind when a chunk job stopped between writing and recording
+    stray = stray_size = 0
+    cutoff = time.time() - STRAY_CHUNK_AGE
+    for directory, _, filenames in os.walk(config.CHUNKS_PATH):
+        candidates = {}
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            stat = os.stat(path)
+            if stat.st_mtime < cutoff:
+                candidates[filename] = (path, stat.st_size)
+
+        known = db.get_known_chunks([name for name in candidates if not name.endswith('.tmp')])
+        for name, (path, size) in candidates.items():
+            if name not in known:
+                os.remove(path)
+                stray += 1
+                stray_size += size
+    print(f"Removed {stray} stray chunk files ({format_size(stray_size)})")
+
+    totals = db.get_stats()['chunk_store']
+    print(f"Chunk store: {totals['chunks']} chunks, {format_size(totals['stored_size'])} stored "
+          f"for {format_size(totals['referenced_size'])} of files "
+          f"(dedupe ratio {totals['dedupe_ratio'] or 1:.2f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Personal Cloud Storage maintenance')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_stats = subparsers.add_parser(
+        'rebuild-stats',
+        help='Recompute storage statistics from the files table'
+    )
+    parser_stats.set_defaults(func=rebuild_stats)
+
+    parser_probe = subparsers.add_parser(
+        'probe-videos',
+        help='Read duration, dimensions and codec from video headers'
+    )
+    parser_probe.add_argument(
+        '--all', action='store_true',
+        help='Probe every video again, not only those without a duration'
+    )
+    parser_probe.set_defaults(func=probe_videos)
+
+    parser_chunk = subparsers.add_parser(
+        'chunk-files',
+        help='Move existing files into the deduplicating chunk store'
+    )
+    parser_chunk.set_defaults(func=chunk_files)
+
+    parser_gc = subparsers.add_parser(
+        'gc-chunks',
+        help='Delete chunks no file references and report the dedupe ratio'
+    )
+    parser_gc.set_defaults(func=gc_chunks)
+
+    args = parser.parse_args()
+    db = Database()
+    args.func(db, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+"""
+Video metadata from container headers
+
+Reads duration, frame size and video codec from MP4/MOV (ISO base media
+boxes), Matroska/WebM (EBML elements) and AVI (RIFF chunks) without
+decoding anything or running external tools. Only headers are read: large
+media payloads (mdat, Clusters, movi) are skipped with a seek, so probing a
+multi-gigabyte file touches a few kilobytes, plus the moov box when an MP4
+keeps it at the end.
+"""
+import os
+import struct
+
+# The moov box of a long recording can be several megabytes; refuse silly sizes
+MAX_HEADER_SIZE = 64 * 1024 * 1024
+
+MP4_CODECS = {
+    'avc1': 'h264', 'avc3': 'h264',
+    'hvc1': 'hevc', 'hev1': 'hevc',
+    'av01': 'av1', 'vp08': 'vp8', 'vp09': 'vp9',
+    'mp4v': 'mpeg4', 'jpeg': 'mjpeg', 'apcn': 'prores', 'apch': 'prores',
+}
+
+MATROSKA_CODECS = {
+    'V_MPEG4/ISO/AVC': 'h264', 'V_MPEGH/ISO/HEVC': 'hevc',
+    'V_AV1': 'av1', 'V_VP8': 'vp8', 'V_VP9': 'vp9',
+    'V_MPEG4/ISO/ASP': 'mpeg4', 'V_MJPEG': 'mjpeg', 'V_THEORA': 'theora',
+}
+
+AVI_CODECS = {
+    'h264': 'h264', 'x264': 'h264', 'avc1': 'h264',
+    'hevc': 'hevc', 'h265': 'hevc',
+    'xvid': 'mpeg4', 'divx': 'mpeg4', 'dx50': 'mpeg4', 'fmp4': 'mpeg4', 'mp4v': 'mpeg4',
+    'mjpg': 'mjpeg',
+}
+
+
+class ProbeError(Exception):
+    """The file is not a supported container or its headers are damaged"""
+
+
+def probe_video(path):
+    """
+    Read video metadata from a container's headers
+
+    Args:
+        path (str): Path of an MP4, MOV, MKV, WebM or AVI file
+
+    Returns:
+        dict: duration (seconds, float), width, height and codec; any of
+        them may be None if the container does not record it
+
+    Raises:
+        ProbeError: If the container is not recognised or is malformed
+    """
+    with open(path, 'rb') as f:
+        return probe_video_file(f)
+
+
+def probe_video_file(f):
+    """
+    Read video metadata from an open, seekable binary file (see probe_video)
+    """
+    head = f.read(12)
+    f.seek(0)
+
+    try:
+        if head[:4] == b'\x1a\x45\xdf\xa3':
+            return probe_matroska(f)
+        if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+            return probe_avi(f)
+        if head[4:8] in (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip'):
+            return probe_mp4(f)
+    except (struct.error, ValueError, TypeError, IndexError, OverflowError, OSError) as e:
+        # TypeError: an unknown-size element where a size is required;
+        # OSError: a seek to an impossible offset read from the file
+        raise ProbeError(f'Malformed container header: {e}')
+
+    raise ProbeError('Unrecognised container format')
+
+
+def get_file_size(f):
+    """Size of a seekable file (which need not be on disk)"""
+    position = f.tell()
+    size = f.seek(0, os.SEEK_END)
+    f.seek(position)
+    return size
+
+
+def empty_result():
+    return {'duration': None, 'width': None, 'height': None, 'codec': None}
+
+
+# MP4 / MOV
+
+def iter_boxes(data, start=0, end=None):
+    """Yield (type, payload start, payload end) for the boxes in a buffer"""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise ValueError('Box size smaller than its header')
+        yield box_type.decode('latin-1'), offset + header, min(offset + size, end)
+        offset += size
+
+
+def find_box(data, path, start=0, end=None):
+    """Payload range of the first box at a path such as 'mdia/minf/stbl'"""
+    name, _, rest = path.partition('/')
+    for box_type, box_start, box_end in iter_boxes(data, start, end):
+        if box_type == name:
+            return find_box(data, rest, box_start, box_end) if rest else (box_start, box_end)
+    return None
+
+
+def read_moov(f):
+    """Read the moov box, seeking over mdat and anything else in between"""
+    file_size = get_file_size(f)
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        size, box_type = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header:
+            raise ValueError('Box size smaller than its header')
+
+        if box_type == b'moov':
+            if size > MAX_HEADER_SIZE:
+                raise ValueError('moov box too large')
+            return f.read(size - header)
+        offset += size
+    raise ValueError('No moov box')
+
+
+def probe_mp4(f):
+    """Metadata from the mvhd, tkhd, hdlr and stsd boxes of an MP4/MOV file"""
+    moov = read_moov(f)
+    result = empty_result()
+
+    # Every valid moov has a movie header
+    mvhd = find_box(moov, 'mvhd')
+    if not mvhd:
+        raise ValueError('No mvhd box')
+    start = mvhd[0]
+    if moov[start] == 1:
+        timescale, duration = struct.unpack_from('>IQ', moov, start + 20)
+    else:
+        timescale, duration = struct.unpack_from('>II', moov, start + 12)
+    if timescale and duration not in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+        result['duration'] = duration / timescale
+
+    for box_type, trak_start, trak_end in iter_boxes(moov):
+        if box_type != 'trak':
+            continue
+
+        hdlr = find_box(moov, 'mdia/hdlr', trak_start, trak_end)
+        if not hdlr or moov[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+            continue
+
+        tkhd = find_box(moov, 'tkhd', trak_start, trak_end)
+        if tkhd:
+            start = tkhd[0]
+            matrix_offset = start + (52 if moov[start] == 1 else 40)
+            a, b = struct.unpack_from('>ii', moov, matrix_offset)
+            width, height = struct.unpack_from('>II', moov, matrix_offset + 36)
+            width, height = width >> 16, height >> 16
+            # Phones store portrait video as landscape plus a 90° rotation
+            if a == 0 and abs(b) == 0x10000:
+                width, height = height, width
+            result['width'], result['height'] = width or None, height or None
+
+        stsd = find_box(moov, 'mdia/minf/stbl/stsd', trak_start, trak_end)
+        if stsd and stsd[1] - stsd[0] >= 16:
+            fourcc = moov[stsd[0] + 12:stsd[0] + 16].decode('latin-1')
+            result['codec'] = MP4_CODECS.get(fourcc, fourcc.strip().lower() or None)
+        break
+
+    return result
+
+
+# Matroska / WebM
+
+def read_vint(f, keep_marker=False):
+    """Read an EBML variable-length integer; None at end of file"""
+    first = f.read(1)
+    if not first:
+        return None, 0
+    value = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not value & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError('Invalid EBML variable-length integer')
+
+    rest = f.read(length - 1)
+    if len(rest) != length - 1:
+        raise ValueError('Truncated EBML element')
+    if not keep_marker:
+        value &= mask - 1
+    for byte in rest:
+        value = (value << 8) | byte
+    return value, length
+
+
+def iter_elements(f, end):
+    """Yield (id, data size, data offset) for EBML elements up to end"""
+    while f.tell() < end:
+        element_id, _ = read_vint(f, keep_marker=True)
+        if element_id is None:
+            return
+        size, length = read_vint(f)
+        if size == (1 << (7 * length)) - 1:
+            size = None  # Unknown size (live streams)
+        yield element_id, size, f.tell()
+
+
+def read_uint(f, size):
+    if size is None or size > 8:
+        raise ValueError('Invalid integer element size')
+    return int.from_bytes(f.read(size), 'big')
+
+
+def read_float(f, size):
+    if size not in (4, 8):
+        raise ValueError('Invalid float element size')
+    data = f.read(size)
+    return struct.unpack('>f' if size == 4 else '>d', data)[0]
+
+
+def read_string(f, size):
+    # Codec IDs are short; a huge size means the header is damaged
+    if size is None or size > 1024:
+        raise ValueError('Invalid string element size')
+    return f.read(size).decode('ascii').rstrip('\x00')
+
+
+def probe_matroska(f):
+    """Metadata from the Info and Tracks elements of a Matroska/WebM file"""
+    file_size = get_file_size(f)
+    result = empty_result()
+
+    for element_id, size, offset in iter_elements(f, file_size):
+        if element_id == 0x18538067:  # Segment
+            segment_end = file_size if size is None else min(offset + size, file_size)
+            break
+        f.seek(offset + (size or 0))
+    else:
+        raise ValueError('No Segment element')
+
+    timecode_scale = 1000000
+    raw_duration = None
+    found_info = found_tracks = False
+
+    for element_id, size, offset in iter_elements(f, segment_end):
+        if element_id == 0x1549A966:  # Info
+            for child_id, child_size, _ in iter_elements(f, offset + size):
+                if child_id == 0x2AD7B1:  # TimecodeScale
+                    timecode_scale = read_uint(f, child_size)
+                elif child_id == 0x4489:  # Duration
+                    raw_duration = read_float(f, child_size)
+                else:
+                    f.seek(child_size, os.SEEK_CUR)
+            found_info = True
+        elif element_id == 0x1654AE6B:  # Tracks
+            probe_matroska_tracks(f, offset + size, result)
+            found_tracks = True
+        elif element_id == 0x1F43B675 or size is None:  # Cluster: media data starts
+            break
+        else:
+            f.seek(offset + size)
+
+        if found_info and found_tracks:
+            break
+
+    if raw_duration:
+        result['duration'] = raw_duration * timecode_scale / 1e9
+    return result
+
+
+def probe_matroska_tracks(f, end, result):
+    """Fill in the codec and frame size of the first video TrackEntry"""
+    for entry_id, entry_size, entry_offset in iter_elements(f, end):
+        if entry_id != 0xAE:  # TrackEntry
+            f.seek(entry_offset + entry_size)
+            continue
+
+        track = {}
+        for child_id, child_size, child_offset in iter_elements(f, entry_offset + entry_size):
+            if child_id == 0x83:  # TrackType
+                track['type'] = read_uint(f, child_size)
+            elif child_id == 0x86:  # CodecID
+                track['codec'] = read_string(f, child_size)
+            elif child_id == 0xE0:  # Video
+                for video_id, video_size, _ in iter_elements(f, child_offset + child_size):
+                    if video_id == 0xB0:  # PixelWidth
+                        track['width'] = read_uint(f, video_size)
+                    elif video_id == 0xBA:  # PixelHeight
+                        track['height'] = read_uint(f, video_size)
+                    else:
+                        f.seek(video_size, os.SEEK_CUR)
+            else:
+                f.seek(child_size, os.SEEK_CUR)
+
+        if track.get('type') == 1:  # Video
+            codec = track.get('codec')
+            result['codec'] = MATROSKA_CODECS.get(codec, codec.lower() if codec else None)
+            result['width'] = track.get('width')
+            result['height'] = track.get('height')
+            return
+
+
+# AVI
+
+def probe_avi(f):
+    """Metadata from the avih, strh and strf chunks of an AVI file"""
+    f.seek(12)
+    result = empty_result()
+
+    chunk_id, size = struct.unpack('<4sI', f.read(8))
+    if chunk_id != b'LIST' or size < 4 or f.read(4) != b'hdrl':
+        raise ValueError('No hdrl list')
+    hdrl = f.read(min(size - 4, MAX_HEADER_SIZE))
+
+    offset = 0
+    stream_type = None
+    while offset + 8 <= len(hdrl):
+        chunk_id, size = struct.unpack_from('<4sI', hdrl, offset)
+        data = hdrl[offset + 8:offset + 8 + size]
+
+        if chunk_id == b'avih':
+            micro_sec_per_frame, = struct.unpack_from('<I', data, 0)
+            total_frames, = struct.unpack_from('<I', data, 16)
+            width, height = struct.unpack_from('<II', data, 32)
+            if micro_sec_per_frame and total_frames:
+                result['duration'] = total_frames * micro_sec_per_frame / 1e6
+            result['width'], result['height'] = width or None, height or None
+        elif chunk_id == b'LIST' and data[:4] == b'strl':
+            # Descend into the stream list
+            offset += 12
+            continue
+        elif chunk_id == b'strh':
+            stream_type = data[:4]
+            if stream_type == b'vids' and result['codec'] is None:
+                handler = data[4:8].decode('latin-1').strip('\x00 ').lower()
+                if handler:
+                    result['codec'] = AVI_CODECS.get(handler, handler)
+        elif chunk_id == b'strf' and stream_type == b'vids':
+            # BITMAPINFOHEADER.biCompression is more reliable than the handler
+            compression = data[16:20].decode('latin-1').strip('\x00 ').lower()
+            if compression:
+                result['codec'] = AVI_CODECS.get(compression, compression)
+            stream_type = None
+
+        offset += 8 + size + (size & 1)
+
+    return result
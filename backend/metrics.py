@@ -0,0 +1,322 @@
+"""
+Lightweight metrics in the Prometheus text exposition format
+
+Counters, gauges and histograms are kept in plain Python objects and
+rendered on demand by GET /metrics. Label sets are resolved to a child
+object once (metric.labels(...)). Each thread updates its own shard of a
+child, so an observation takes no lock: it is a dictionary lookup, a bisect
+and two additions, well under a microsecond. Rendering sums the shards.
+
+Metrics are per process. Under gunicorn each web worker reports its own
+request and upload metrics, and the derivative worker process (thumbnail
+timings) is not scraped; queue depths are read from the database at scrape
+time and are the same everywhere.
+"""
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from threading import get_ident
+
+# Default latency buckets in seconds (1 ms to 30 s)
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30
+)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class: a named metric with children per label set"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        """Get the child for a label set (pass strings), creating it on first use"""
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}')
+            values = tuple(str(value) for value in values)
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}'
+        ]
+        for values, child in sorted(self.children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+    # Unlabelled metrics can be used directly
+    def __getattr__(self, attr):
+        if attr in ('inc', 'set', 'set_function', 'observe', 'time'):
+            return getattr(self.labels(), attr)
+        raise AttributeError(attr)
+
+
+class CounterChild:
+    __slots__ = ('shards',)
+
+    def __init__(self):
+        self.shards = {}  # thread ID -> [value]
+
+    def inc(self, amount=1):
+        shard = self.shards.get(get_ident())
+        if shard is None:
+            shard = self.shards.setdefault(get_ident(), [0])
+        shard[0] += amount
+
+    def render(self, name, labelnames, values):
+        value = sum(shard[0] for shard in list(self.shards.values()))
+        return [f'{name}{format_labels(labelnames, values)} {format_value(value)}']
+
+
+class Counter(Metric):
+    """Monotonically increasing count; exported with a _total suffix"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        if not name.endswith('_total'):
+            name += '_total'
+        super().__init__(name, documentation, labelnames, registry)
+
+    def new_child(self):
+        return CounterChild()
+
+
+class GaugeChild:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Compute the value when metrics are rendered"""
+        self.function = function
+
+    def render(self, name, labelnames, values):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                return []  # Leave the sample out rather than fail the scrape
+        return [f'{name}{format_labels(labelnames, values)} {format_value(value)}']
+
+
+class Gauge(Metric):
+    """Value that can go up and down, optionally computed at render time"""
+
+    kind = 'gauge'
+
+    def new_child(self):
+        return GaugeChild()
+
+
+class HistogramChild:
+    __slots__ = ('buckets', 'shards')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.shards = {}  # thread ID -> [count per bucket..., +Inf count, sum]
+
+    def observe(self, value):
+        shard = self.shards.get(get_ident())
+        if shard is None:
+            shard = self.shards.setdefault(get_ident(), [0] * (len(self.buckets) + 1) + [0.0])
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def time(self):
+        """Context manager / decorator observing the elapsed seconds"""
+        return Timer(self)
+
+    def render(self, name, labelnames, values):
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for shard in list(self.shards.values()):
+            for index in range(len(counts)):
+                counts[index] += shard[index]
+            total += shard[-1]
+
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = format_labels(labelnames, values, f'le="{format_value(float(bound))}"')
+            lines.append(f'{name}_bucket{labels} {cumulative}')
+        labels = format_labels(labelnames, values)
+        lines.append(f'{name}_sum{labels} {format_value(total)}')
+        lines.append(f'{name}_count{labels} {cumulative}')
+        return lines
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS,
+                 registry=None):
+        self.buckets = tuple(float(bound) for bound in sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+
+class Timer:
+    """Observes elapsed wall time into a histogram child"""
+
+    __slots__ = ('child', 'started')
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.child.observe(time.perf_counter() - self.started)
+
+    def __call__(self, function):
+        child = self.child
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self.metrics[metric.name] = metric
+
+    def render(self):
+        """Text exposition format (version 0.0.4) of every metric"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# Metrics shared by the server modules
+
+REQUEST_SECONDS = Histogram(
+    'pcs_http_request_duration_seconds',
+    'Time spent handling HTTP requests',
+    ('endpoint', 'method')
+)
+REQUESTS = Counter(
+    'pcs_http_requests',
+    'HTTP requests handled',
+    ('endpoint', 'method', 'status')
+)
+UPLOAD_BYTES = Counter(
+    'pcs_upload_bytes',
+    'Bytes of file content received in uploads'
+)
+UPLOADS = Counter(
+    'pcs_uploads',
+    'Uploaded files by outcome',
+    ('result',)
+)
+UPLOAD_PHASE_SECONDS = Histogram(
+    'pcs_upload_phase_seconds',
+    'Time spent in each phase of storing an upload',
+    ('phase',)
+)
+DB_QUERY_SECONDS = Histogram(
+    'pcs_db_query_duration_seconds',
+    'Time spent in Database methods',
+    ('operation',)
+)
+JOBS = Counter(
+    'pcs_jobs',
+    'Background jobs finished by outcome',
+    ('kind', 'result')
+)
+JOB_SECONDS = Histogram(
+    'pcs_job_duration_seconds',
+    'Time from handing a job to the process pool until it finished',
+    ('kind',)
+)
+QUEUE_DEPTH = Gauge(
+    'pcs_queue_depth',
+    'Items waiting or in progress',
+    ('queue',)
+)
+
+
+def time_methods(histogram, exclude=()):
+    """
+    Class decorator timing every public method into a labelled histogram
+
+    The method name is used as the label value.
+    """
+    def decorate(cls):
+        for name, function in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude or not inspect.isfunction(function):
+                continue
+            setattr(cls, name, histogram.labels(name).time()(function))
+        return cls
+    return decorate
@@ -0,0 +1,190 @@
+"""
+Production server for Personal Cloud Storage
+
+Runs the Flask app under gunicorn (Linux/macOS) with several processes of
+threaded workers, or under waitress (Windows, or wherever gunicorn is not
+installed) with a pool of threads. `python app.py` remains the development
+server.
+
+The app module is imported once here, before any worker process is forked,
+so the database schema and migrations run exactly once; each process then
+opens its own connections. Thumbnail generation runs in a single separate
+process instead of once per web worker; under gunicorn the arbiter starts
+it once it is ready, restarts it if it dies and stops it on exit. Web
+workers therefore have no dispatcher of their own to wake: worker.notify()
+after an upload does nothing there, and the separate process picks new
+jobs up on its next poll, at most JOB_POLL_INTERVAL seconds later.
+
+On SIGTERM or Ctrl+C the server stops accepting connections and gives
+in-flight requests up to GRACEFUL_SHUTDOWN_TIMEOUT seconds to finish.
+
+Usage:
+    python serve.py
+"""
+import signal
+import subprocess
+import sys
+import threading
+import time
+import config
+import app as app_module
+
+
+def run_derivative_worker():
+    """Derivative worker process: generate thumbnails until terminated"""
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    # Ctrl+C reaches the whole process group; the server stops us with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    app_module.start_background_services()
+    while not stopping.wait(1):
+        pass
+    app_module.worker.stop()
+
+
+class DerivativeWorkerSupervisor:
+    """
+    Keeps one derivative worker process running in the gunicorn arbiter
+
+    start and stop are gunicorn's when_ready and on_exit hooks, which only
+    run in the arbiter, never in the web workers it forks. The worker is a
+    separate `serve.py --derivative-worker` process rather than a fork, so
+    the web workers inherit nothing that refers to it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.process = None
+
+    def start(self, server=None):
+        """Start the worker process, and a thread restarting it if it dies"""
+        threading.Thread(target=self.run, name='derivative-supervisor', daemon=True).start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if self.stopping.is_set():
+                    return
+                self.process = subprocess.Popen([sys.executable, __file__, '--derivative-worker'])
+                process = self.process
+
+            # Returns when the process ends, also if the arbiter reaped it first
+            process.wait()
+            if self.stopping.wait(1):
+                return
+            print("[SERVER] Derivative worker exited, restarting it")
+
+    def stop(self, server=None):
+        """Stop the worker process and let it finish its current jobs"""
+        with self.lock:
+            self.stopping.set()
+            process = self.process
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(config.GRACEFUL_SHUTDOWN_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def serve_gunicorn():
+    """Serve with gunicorn: SERVER_WORKERS processes of SERVER_THREADS threads"""
+    from gunicorn.app.base import BaseApplication
+
+    supervisor = DerivativeWorkerSupervisor()
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{config.HOST}:{config.PORT}')
+            self.cfg.set('workers', config.SERVER_WORKERS)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', config.SERVER_THREADS)
+            self.cfg.set('graceful_timeout', config.GRACEFUL_SHUTDOWN_TIMEOUT)
+            self.cfg.set('keepalive', 75)  # Clients reuse connections through the tunnel
+            self.cfg.set('when_ready', supervisor.start)
+            self.cfg.set('on_exit', supervisor.stop)
+
+        def load(self):
+            return app_module.app
+
+    Application().run()
+
+
+def serve_waitress():
+    """Serve with waitress: one process with SERVER_THREADS threads"""
+    from waitress import create_server
+
+    server = create_server(
+        app_module.app,
+        host=config.HOST,
+        port=config.PORT,
+        threads=config.SERVER_THREADS
+    )
+    draining = threading.Event()
+
+    def drain(signum, frame):
+        draining.set()
+
+    signal.signal(signal.SIGINT, drain)
+    signal.signal(signal.SIGTERM, drain)
+
+    app_module.start_background_services()
+    print(f"[SERVER] waitress listening on http://{config.HOST}:{config.PORT} "
+          f"with {config.SERVER_THREADS} threads")
+
+    # waitress has no public graceful shutdown: server.run() only returns on
+    # an exception and then drops queued requests. So the event loop is
+    # driven here through waitress 3.0 internals (asyncore, _map, the
+    # channels' request state and task_dispatcher). requirements.txt pins
+    # the version; re-check this function before upgrading waitress.
+    while not draining.is_set():
+        server.asyncore.loop(timeout=1, map=server._map, count=1)
+
+    # Stop accepting and let requests that have started finish
+    print("[SERVER] Shutting down, finishing in-flight requests...")
+    server.accepting = False
+    deadline = time.monotonic() + config.GRACEFUL_SHUTDOWN_TIMEOUT
+    while time.monotonic() < deadline and any(
+            channel.request is not None or channel.requests or channel.total_outbufs_len
+            for channel in list(server.active_channels.values())):
+        server.asyncore.loop(timeout=1, map=server._map, count=1)
+
+    server.close()
+    server.task_dispatcher.shutdown()
+    app_module.worker.stop()
+
+
+def main():
+    if sys.argv[1:] == ['--derivative-worker']:
+        run_derivative_worker()
+        return
+
+    print("=" * 60)
+    print("Personal Cloud Storage Server (production)")
+    print("=" * 60)
+    print(f"Storage location: {config.STORAGE_PATH}")
+    print(f"Server address: http://{config.HOST}:{config.PORT}")
+    print(f"Authentication: {'Enabled' if config.REQUIRE_AUTH else 'Disabled'}")
+    print(f"Concurrent uploads per process: {config.MAX_CONCURRENT_UPLOADS}")
+    print("=" * 60)
+
+    if config.MAX_CONCURRENT_UPLOADS >= config.SERVER_THREADS:
+        print("[SERVER] Warning: MAX_CONCURRENT_UPLOADS should be below SERVER_THREADS, "
+              "otherwise uploads can occupy every thread")
+
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        serve_waitress()
+        return
+
+    if sys.platform == 'win32':
+        serve_waitress()
+    else:
+        serve_gunicorn()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Test setup: point the server at a temporary storage folder and database
+
+Storage lives under the home directory and the database path is read when
+the app is imported, so both are redirected before any test module imports
+the app.
+"""
+import io
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = tempfile.mkdtemp(prefix='pcs-tests-')
+os.environ['HOME'] = ROOT
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+config.DATABASE_PATH = os.path.join(ROOT, 'storage.db')
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def upload(client):
+    """Upload bytes under a filename and return the new file's ID"""
+    def upload(data, filename):
+        response = client.post('/upload', data={'file': (io.BytesIO(data), filename)},
+                               content_type='multipart/form-data')
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()['file_id']
+    return upload
@@ -0,0 +1,93 @@
+"""LRU cache bounded by size, with a TTL"""
+import pytest
+import cache as cache_module
+from cache import LRUCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module, 'time', clock)
+    return clock
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    lru = LRUCache(max_bytes=300)
+    lru.put('a', b'', size=100)
+    lru.put('b', b'', size=100)
+    lru.put('c', b'', size=100)
+    lru.get('a')  # 'b' is now the least recently used
+
+    lru.put('d', b'', size=150)
+
+    assert lru.get('b') is None and lru.get('c') is None
+    assert lru.get('a') == b'' and lru.get('d') == b''
+    assert lru.size == 250 <= lru.max_bytes
+    assert lru.stats()['evictions'] == 2
+
+
+def test_size_is_estimated_from_the_value():
+    lru = LRUCache(max_bytes=10000)
+    lru.put('thumb', b'x' * 5000)
+    lru.put('record', {'id': 1, 'name': 'photo.jpg'})
+
+    assert lru.size > 5000
+    lru.put('thumb2', b'y' * 5000)
+    assert lru.get('thumb') is None  # Two bodies do not fit together
+    assert lru.size <= lru.max_bytes
+
+
+def test_values_over_the_item_limit_are_not_cached():
+    lru = LRUCache(max_bytes=1000, max_item_size=100)
+
+    assert not lru.put('big', b'', size=101)
+    assert lru.get('big') is None
+    assert lru.size == 0
+
+
+def test_replacing_a_key_does_not_count_it_twice():
+    lru = LRUCache(max_bytes=1000)
+    lru.put('a', 1, size=400)
+    lru.put('a', 2, size=300)
+
+    assert lru.get('a') == 2
+    assert lru.size == 300
+
+
+def test_entries_expire_after_the_ttl(clock):
+    lru = LRUCache(max_bytes=1000, ttl=30)
+    lru.put('a', 'record', size=10)
+
+    clock.now += 29
+    assert lru.get('a') == 'record'
+    clock.now += 2
+    assert lru.get('a') is None
+    assert lru.size == 0
+    assert lru.stats()['hits'] == 1 and lru.stats()['misses'] == 1
+
+
+def test_invalidate_and_clear():
+    lru = LRUCache(max_bytes=1000)
+    lru.put('a', 1, size=10)
+    lru.put('b', 2, size=10)
+
+    lru.invalidate('a', 'missing')
+    assert lru.get('a') is None and lru.get('b') == 2
+    lru.clear()
+    assert lru.stats()['entries'] == 0 and lru.size == 0
+
+
+def test_deleted_file_is_not_served_from_the_cache(client, upload):
+    file_id = upload(b'\x00' * 64 + b'cache', 'cached.mp4')
+    assert client.get(f'/file/{file_id}').status_code == 200
+
+    assert client.delete(f'/file/{file_id}').status_code == 200
+    assert client.get(f'/file/{file_id}').status_code == 404
@@ -0,0 +1,109 @@
+"""Content-defined chunking, reassembly and garbage collection"""
+import hashlib
+import io
+import os
+import random
+import chunkstore
+import config
+from app import db, worker
+from media_probe import probe_video_file
+from test_media_probe import make_mp4
+from worker import compute_checksum
+
+
+def random_bytes(size, seed):
+    return random.Random(seed).randbytes(size)
+
+
+def stored_chunk_count():
+    return sum(len(names) for _, _, names in os.walk(config.CHUNKS_PATH))
+
+
+def chunk_file(file_id):
+    """Run a file's chunk job in this process"""
+    job = {'file_id': file_id, 'file_path': db.get_file_by_id(file_id)['file_path']}
+    worker.finish_chunk_job(job, chunkstore.store_chunks(job['file_path']))
+
+
+def test_split_respects_size_limits_and_reassembles():
+    data = random_bytes(3 * 1024 * 1024, 1)
+    chunks = list(chunkstore.split_chunks(io.BytesIO(data), 1024, 64 * 1024))
+    assert b''.join(chunks) == data
+    assert all(1024 <= len(chunk) <= 64 * 1024 for chunk in chunks[:-1])
+    assert len(chunks) > 3 * 1024 * 1024 // (64 * 1024)
+
+
+def test_boundaries_follow_content_not_offsets():
+    data = random_bytes(8 * 1024 * 1024, 2)
+    before = set(chunkstore.split_chunks(io.BytesIO(data)))
+    after = set(chunkstore.split_chunks(io.BytesIO(data[:3000000] + b'inserted' + data[3000000:])))
+    # Only the chunks around the edit differ
+    assert len(before) > 10
+    assert len(before - after) <= 2
+
+
+def test_chunk_reader_seeks_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CHUNKS_PATH', str(tmp_path))
+    data = random_bytes(300000, 3)
+    chunks = []
+    for start in range(0, len(data), 70000):
+        piece = data[start:start + 70000]
+        chunk_hash = hashlib.sha256(piece).hexdigest()
+        chunkstore.write_chunk(chunk_hash, piece)
+        chunks.append((chunk_hash, len(piece)))
+
+    with chunkstore.open_chunked_file(chunks) as f:
+        assert f.read() == data
+        f.seek(69990)
+        assert f.read(20) == data[69990:70010]
+        assert f.seek(-5, io.SEEK_END) == len(data) - 5
+        assert f.read() == data[-5:]
+
+
+def test_chunked_file_downloads_and_is_readable_by_jobs(client, upload):
+    data = random_bytes(2 * 1024 * 1024, 4)
+    file_id = upload(data, 'chunked.mp4')
+    chunk_file(file_id)
+
+    record = db.get_file_by_id(file_id)
+    assert record['storage'] == 'chunks'
+    assert not os.path.exists(record['file_path'])
+
+    assert client.get(f'/file/{file_id}').data == data
+    response = client.get(f'/file/{file_id}', headers={'Range': 'bytes=1000000-1000099'})
+    assert response.status_code == 206 and response.data == data[1000000:1000100]
+    assert compute_checksum(record['file_path'], db.get_file_chunks(file_id)) == hashlib.md5(data).hexdigest()
+
+
+def test_chunked_video_can_be_probed(upload):
+    # Enough payload after the header for the file to be split into chunks
+    file_id = upload(make_mp4() + random_bytes(2 * 1024 * 1024, 8), 'probed.mp4')
+    chunk_file(file_id)
+    record = db.get_file_by_id(file_id)
+    assert record['storage'] == 'chunks'
+
+    with chunkstore.open_stored_file(record['file_path'], db.get_file_chunks(file_id)) as f:
+        info = probe_video_file(f)
+
+    assert info == {'duration': 12.5, 'width': 1920, 'height': 1080, 'codec': 'h264'}
+
+
+def test_deleting_files_collects_unshared_chunks(client, upload):
+    shared = random_bytes(2 * 1024 * 1024, 5)
+    first = upload(shared + random_bytes(512 * 1024, 6), 'first.mp4')
+    second = upload(shared + random_bytes(512 * 1024, 7), 'second.mp4')
+    before = stored_chunk_count()
+    chunk_file(first)
+    chunk_file(second)
+    first_chunks = set(db.get_file_chunks(first))
+    second_chunks = set(db.get_file_chunks(second))
+    assert first_chunks & second_chunks
+    assert stored_chunk_count() == before + len(first_chunks | second_chunks)
+
+    assert client.delete(f'/file/{first}').status_code == 200
+    assert stored_chunk_count() == before + len(second_chunks)
+    assert all(os.path.exists(chunkstore.chunk_path(h)) for h, _ in second_chunks)
+    assert client.get(f'/file/{second}').data[:len(shared)] == shared
+
+    assert client.delete(f'/file/{second}').status_code == 200
+    assert stored_chunk_count() == before
@@ -0,0 +1,68 @@
+"""Range, multi-range and conditional downloads of stored files"""
+import os
+import pytest
+
+
+@pytest.fixture
+def stored(upload):
+    data = os.urandom(10000)
+    return upload(data, 'clip.mp4'), data
+
+
+def parse_byteranges(response):
+    """Split a multipart/byteranges body into (Content-Range, data) parts"""
+    boundary = response.headers['Content-Type'].split('boundary=')[1].encode()
+    parts = []
+    for part in response.data.split(b'--' + boundary)[1:-1]:
+        headers, body = part.split(b'\r\n\r\n', 1)
+        content_range = [line for line in headers.split(b'\r\n') if line.startswith(b'Content-Range')]
+        parts.append((content_range[0].split(b': ')[1].decode(), body[:-2]))
+    return parts
+
+
+def test_whole_file(client, stored):
+    file_id, data = stored
+    response = client.get(f'/file/{file_id}')
+    assert response.status_code == 200
+    assert response.data == data
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+
+def test_single_range(client, stored):
+    file_id, data = stored
+    response = client.get(f'/file/{file_id}', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(data)}'
+    assert response.data == data[100:200]
+
+
+def test_multiple_ranges(client, stored):
+    file_id, data = stored
+    response = client.get(f'/file/{file_id}', headers={'Range': 'bytes=0-9,500-599,-10'})
+    assert response.status_code == 206
+    assert response.headers['Content-Type'].startswith('multipart/byteranges')
+    assert parse_byteranges(response) == [
+        (f'bytes 0-9/{len(data)}', data[:10]),
+        (f'bytes 500-599/{len(data)}', data[500:600]),
+        (f'bytes {len(data) - 10}-{len(data) - 1}/{len(data)}', data[-10:]),
+    ]
+
+
+def test_unsatisfiable_range(client, stored):
+    file_id, data = stored
+    response = client.get(f'/file/{file_id}', headers={'Range': f'bytes={len(data) + 1}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(data)}'
+
+
+def test_if_range_with_a_stale_etag_sends_the_whole_file(client, stored):
+    file_id, data = stored
+    response = client.get(f'/file/{file_id}', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == data
+
+
+def test_etag_revalidation(client, stored):
+    file_id, _ = stored
+    etag = client.get(f'/file/{file_id}').headers['ETag']
+    assert client.get(f'/file/{file_id}', headers={'If-None-Match': etag}).status_code == 304
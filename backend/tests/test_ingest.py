@@ -0,0 +1,49 @@
+"""Streaming ingest of uploads"""
+import hashlib
+import io
+import os
+import config
+from app import db
+from ingest import IngestFile
+
+
+def leftover_ingest_files():
+    return [name for name in os.listdir(config.UPLOAD_SESSIONS_PATH) if name.endswith('.ingest')]
+
+
+def test_ingest_file_hashes_while_writing(tmp_path):
+    ingest_file = IngestFile(directory=str(tmp_path))
+    ingest_file.write(b'hello ')
+    ingest_file.write(b'world')
+    assert ingest_file.checksum() == hashlib.md5(b'hello world').hexdigest()
+
+    dest_path = str(tmp_path / 'stored')
+    ingest_file.commit(dest_path)
+    ingest_file.close()
+    with open(dest_path, 'rb') as f:
+        assert f.read() == b'hello world'
+
+
+def test_uncommitted_ingest_file_is_removed(tmp_path):
+    ingest_file = IngestFile(directory=str(tmp_path))
+    ingest_file.write(b'data')
+    ingest_file.close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_upload_is_stored_with_its_checksum(upload):
+    data = os.urandom(5000)
+    file_id = upload(data, 'ingested.png')
+    record = db.get_file_by_id(file_id)
+    assert record['checksum'] == hashlib.md5(data).hexdigest()
+    with open(record['file_path'], 'rb') as f:
+        assert f.read() == data
+    assert leftover_ingest_files() == []
+
+
+def test_oversize_upload_is_rejected_and_cleaned_up(client, monkeypatch):
+    monkeypatch.setattr(config, 'MAX_FILE_SIZE', 1000)
+    response = client.post('/upload', data={'file': (io.BytesIO(os.urandom(5000)), 'big.png')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 413
+    assert leftover_ingest_files() == []
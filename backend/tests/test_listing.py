@@ -0,0 +1,112 @@
+"""Streamed /files and /search listings: field projection, NDJSON and gzip"""
+import gzip
+import json
+import os
+import pytest
+import config
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    """Read a couple of records per batch so pages span several chunks"""
+    monkeypatch.setattr(config, 'LIST_FETCH_SIZE', 2)
+
+
+def read_ndjson(response):
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    if lines and set(lines[-1]) == {'next_cursor'}:
+        return lines[:-1], lines[-1]['next_cursor']
+    return lines, None
+
+
+def test_fields_narrow_the_records(client, upload):
+    upload(os.urandom(100), 'fields.mp4')
+
+    response = client.get('/files', query_string={'limit': 5, 'fields': 'original_filename'})
+
+    assert response.status_code == 200
+    for file_record in response.get_json()['files']:
+        # The id is always sent, and the sort column for the cursor
+        assert set(file_record) == {'id', 'original_filename', 'upload_date'}
+
+
+@pytest.mark.parametrize('params', [
+    {'fields': 'id,password'},
+    {'format': 'xml'},
+])
+def test_bad_list_options_are_client_errors(client, params):
+    assert client.get('/files', query_string=params).status_code == 400
+    assert client.get('/search', query_string=dict(params, q='x')).status_code == 400
+
+
+def test_json_pages_span_several_batches(client, upload, small_batches):
+    for index in range(5):
+        upload(os.urandom(100), f'batched_{index}.mp4')
+
+    names = []
+    ids = []
+    cursor = None
+    while True:
+        params = {'limit': 3, 'fields': 'original_filename'}
+        if cursor:
+            params['cursor'] = cursor
+        page = client.get('/files', query_string=params).get_json()
+        assert page['count'] == len(page['files'])
+        names.extend(f['original_filename'] for f in page['files'])
+        ids.extend(f['id'] for f in page['files'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+
+    assert sorted(name for name in names if name.startswith('batched_')) == [
+        f'batched_{index}.mp4' for index in range(5)
+    ]
+    assert len(ids) == len(set(ids))
+
+
+def test_ndjson_has_one_record_per_line_then_the_cursor(client, upload):
+    for index in range(3):
+        upload(os.urandom(100), f'lines_{index}.mp4')
+
+    response = client.get('/files', query_string={'limit': 2, 'format': 'ndjson'})
+
+    assert response.mimetype == 'application/x-ndjson'
+    records, next_cursor = read_ndjson(response)
+    assert len(records) == 2 and next_cursor
+
+    by_accept = client.get('/files', query_string={'limit': 2},
+                           headers={'Accept': 'application/x-ndjson'})
+    assert read_ndjson(by_accept) == (records, next_cursor)
+
+
+def test_gzip_is_sent_to_clients_that_accept_it(client, upload, small_batches):
+    for index in range(3):
+        upload(os.urandom(100), f'gzip_{index}.mp4')
+    plain = client.get('/files', query_string={'limit': 10})
+
+    response = client.get('/files', query_string={'limit': 10},
+                          headers={'Accept-Encoding': 'gzip'})
+
+    assert 'gzip' not in plain.headers.get('Content-Encoding', '')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(gzip.decompress(response.get_data())) == plain.get_json()
+
+
+def test_search_streams_pages_without_the_rank(client, upload, small_batches):
+    for index in range(5):
+        upload(os.urandom(100), f'streamed_{index}.mp4')
+
+    names = []
+    cursor = None
+    while True:
+        params = {'q': 'streamed', 'limit': 3, 'format': 'ndjson', 'fields': 'original_filename'}
+        if cursor:
+            params['cursor'] = cursor
+        records, cursor = read_ndjson(client.get('/search', query_string=params))
+        assert all(set(f) == {'id', 'original_filename', 'upload_date'} for f in records)
+        names.extend(f['original_filename'] for f in records)
+        if not cursor:
+            break
+
+    assert sorted(names) == [f'streamed_{index}.mp4' for index in range(5)]
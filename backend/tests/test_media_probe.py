@@ -0,0 +1,167 @@
+"""Video metadata from MP4, Matroska and AVI headers, and damaged input"""
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from media_probe import ProbeError, probe_video
+
+
+# MP4 / MOV
+
+def box(box_type, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def make_mp4(width=1920, height=1080, timescale=1000, duration=12500, rotate=False,
+             codec=b'avc1', moov_last=False):
+    mvhd = box(b'mvhd', bytes(12) + struct.pack('>II', timescale, duration) + bytes(80))
+    a, b = (0, 0x10000) if rotate else (0x10000, 0)
+    matrix = struct.pack('>9i', a, b, 0, -b, a, 0, 0, 0, 0x40000000)
+    tkhd = box(b'tkhd', bytes(40) + matrix + struct.pack('>II', width << 16, height << 16))
+    hdlr = box(b'hdlr', bytes(8) + b'vide' + bytes(12))
+    stsd = box(b'stsd', bytes(4) + struct.pack('>I', 1) + struct.pack('>I4s', 86, codec) + bytes(78))
+    trak = box(b'trak', tkhd + box(b'mdia', hdlr + box(b'minf', box(b'stbl', stsd))))
+    moov = box(b'moov', mvhd + trak)
+    ftyp = box(b'ftyp', b'isom' + bytes(4) + b'isomavc1')
+    mdat = box(b'mdat', bytes(4096))
+    return ftyp + (mdat + moov if moov_last else moov + mdat)
+
+
+# Matroska / WebM
+
+def ebml_element(element_id, payload):
+    # Eight-byte size so the builder does not need minimal encodings
+    return element_id + b'\x01' + len(payload).to_bytes(7, 'big') + payload
+
+
+def make_mkv(width=1280, height=720, duration_ms=8000.0, codec=b'V_VP9'):
+    header = ebml_element(b'\x1a\x45\xdf\xa3', ebml_element(b'\x42\x82', b'webm'))
+    info = ebml_element(b'\x15\x49\xa9\x66',
+                        ebml_element(b'\x2a\xd7\xb1', (1000000).to_bytes(3, 'big'))
+                        + ebml_element(b'\x44\x89', struct.pack('>d', duration_ms)))
+    video = ebml_element(b'\xe0', ebml_element(b'\xb0', width.to_bytes(2, 'big'))
+                         + ebml_element(b'\xba', height.to_bytes(2, 'big')))
+    audio_entry = ebml_element(b'\xae', ebml_element(b'\x83', b'\x02')
+                               + ebml_element(b'\x86', b'A_OPUS'))
+    video_entry = ebml_element(b'\xae', ebml_element(b'\x83', b'\x01')
+                               + ebml_element(b'\x86', codec) + video)
+    tracks = ebml_element(b'\x16\x54\xae\x6b', audio_entry + video_entry)
+    cluster = ebml_element(b'\x1f\x43\xb6\x75', bytes(4096))
+    return header + ebml_element(b'\x18\x53\x80\x67', info + tracks + cluster)
+
+
+# AVI
+
+def riff_chunk(chunk_id, payload):
+    return struct.pack('<4sI', chunk_id, len(payload)) + payload + b'\x00' * (len(payload) & 1)
+
+
+def riff_list(list_type, payload):
+    return riff_chunk(b'LIST', list_type + payload)
+
+
+def make_avi(width=640, height=480, frames=250, fps=25, handler=b'XVID', compression=b'H264'):
+    avih = struct.pack('<IIIIIIIIII', 1000000 // fps, 0, 0, 0, frames, 0, 1, 0, width, height) + bytes(16)
+    strh = b'vids' + handler + bytes(48)
+    strf = struct.pack('<IiiHH4s', 40, width, height, 1, 24, compression) + bytes(20)
+    hdrl = riff_list(b'hdrl', riff_chunk(b'avih', avih)
+                     + riff_list(b'strl', riff_chunk(b'strh', strh) + riff_chunk(b'strf', strf)))
+    body = b'AVI ' + hdrl + riff_list(b'movi', bytes(4096))
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+SAMPLES = {
+    'clip.mp4': make_mp4,
+    'clip.mkv': make_mkv,
+    'clip.avi': make_avi,
+}
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def probe_in_time(path, seconds=5):
+    """probe_video, failing the test instead of hanging"""
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(probe_video, path).result(timeout=seconds)
+
+
+def test_mp4(tmp_path):
+    info = probe_video(write(tmp_path, 'a.mp4', make_mp4()))
+    assert info == {'duration': 12.5, 'width': 1920, 'height': 1080, 'codec': 'h264'}
+
+
+def test_mp4_with_moov_after_mdat(tmp_path):
+    info = probe_video(write(tmp_path, 'a.mov', make_mp4(codec=b'hvc1', moov_last=True)))
+    assert (info['duration'], info['codec']) == (12.5, 'hevc')
+
+
+def test_mp4_rotated_portrait(tmp_path):
+    info = probe_video(write(tmp_path, 'a.mp4', make_mp4(rotate=True)))
+    assert (info['width'], info['height']) == (1080, 1920)
+
+
+def test_matroska(tmp_path):
+    info = probe_video(write(tmp_path, 'a.mkv', make_mkv()))
+    assert info == {'duration': 8.0, 'width': 1280, 'height': 720, 'codec': 'vp9'}
+
+
+def test_avi(tmp_path):
+    info = probe_video(write(tmp_path, 'a.avi', make_avi()))
+    assert info == {'duration': 10.0, 'width': 640, 'height': 480, 'codec': 'h264'}
+
+
+@pytest.mark.parametrize('data', [b'', b'hello', b'not a video at all' * 10])
+def test_unknown_format(tmp_path, data):
+    with pytest.raises(ProbeError):
+        probe_video(write(tmp_path, 'a.mp4', data))
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+def test_truncated_files_never_crash_or_hang(tmp_path, name):
+    data = SAMPLES[name]()
+    # Cut the header region at every byte, then a few points in the payload
+    header_end = len(data) - 4096
+    for length in list(range(header_end + 1)) + [header_end + 100, len(data) - 1]:
+        path = write(tmp_path, name, data[:length])
+        try:
+            info = probe_in_time(path)
+        except ProbeError:
+            continue
+        assert set(info) == {'duration', 'width', 'height', 'codec'}
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+@pytest.mark.parametrize('value', [0x00, 0x01, 0x7f, 0x80, 0xff])
+def test_corrupted_headers_never_crash_or_hang(tmp_path, name, value):
+    data = SAMPLES[name]()
+    header_end = len(data) - 4096
+    for position in range(header_end):
+        corrupted = bytearray(data)
+        corrupted[position] = value
+        path = write(tmp_path, name, bytes(corrupted))
+        try:
+            probe_in_time(path)
+        except ProbeError:
+            pass
+
+
+@pytest.mark.parametrize('data', [
+    # Box sizes smaller than their header, zero and 64-bit sizes
+    box(b'ftyp', b'isom') + struct.pack('>I4s', 4, b'moov'),
+    box(b'ftyp', b'isom') + struct.pack('>I4sQ', 1, b'moov', 8),
+    box(b'ftyp', b'isom') + struct.pack('>I4s', 0, b'moov'),
+    # moov announcing more data than the file holds
+    box(b'ftyp', b'isom') + struct.pack('>I4s', 1 << 20, b'moov') + box(b'mvhd', b'\x01'),
+    # Matroska with an unknown-size Segment and an unknown-size Info
+    ebml_element(b'\x1a\x45\xdf\xa3', b'') + b'\x18\x53\x80\x67\xff' + b'\x15\x49\xa9\x66\xff',
+    # Invalid EBML length marker
+    b'\x1a\x45\xdf\xa3\x00' + bytes(16),
+    # AVI whose hdrl list is shorter than its type
+    b'RIFF\x00\x00\x00\x00AVI LIST\x02\x00\x00\x00hd',
+])
+def test_malformed_headers_raise_probe_error(tmp_path, data):
+    with pytest.raises(ProbeError):
+        probe_in_time(write(tmp_path, 'bad.bin', data))
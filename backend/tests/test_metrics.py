@@ -0,0 +1,37 @@
+"""GET /metrics and the upload counters"""
+import io
+import os
+import re
+
+
+def read_counter(client, sample):
+    text = client.get('/metrics').get_data(as_text=True)
+    match = re.search(rf'^{re.escape(sample)} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_upload_outcomes_are_counted(client, upload):
+    stored = 'pcs_uploads_total{result="stored"}'
+    duplicate = 'pcs_uploads_total{result="duplicate"}'
+    rejected = 'pcs_uploads_total{result="rejected"}'
+    before = {name: read_counter(client, name) for name in (stored, duplicate, rejected)}
+
+    data = os.urandom(100)
+    upload(data, 'metric.jpg')
+    client.post('/upload', data={'file': (io.BytesIO(data), 'again.jpg')},
+                content_type='multipart/form-data')
+    client.post('/upload', data={'file': (io.BytesIO(b'x'), 'tool.exe')},
+                content_type='multipart/form-data')
+    client.post('/upload', data={}, content_type='multipart/form-data')
+
+    assert read_counter(client, stored) == before[stored] + 1
+    assert read_counter(client, duplicate) == before[duplicate] + 1
+    assert read_counter(client, rejected) == before[rejected] + 2
+
+
+def test_metrics_are_prometheus_text(client):
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert '# TYPE pcs_uploads_total counter' in response.get_data(as_text=True)
@@ -0,0 +1,79 @@
+"""Cursor pagination of /files"""
+import base64
+import json
+import os
+import pytest
+import app as app_module
+from database import decode_cursor, make_cursor
+
+ORDER = 'upload_date DESC'
+
+
+def encode_cursor(values):
+    """Encode arbitrary cursor contents the way make_cursor does"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def list_all(client, **query):
+    """Follow next_cursor through every page and return the file IDs in order"""
+    seen = []
+    cursor = None
+    while True:
+        page_query = dict(query)
+        if cursor:
+            page_query['cursor'] = cursor
+        page = client.get('/files', query_string=page_query).get_json()
+        seen.extend(f['id'] for f in page['files'])
+        cursor = page['next_cursor']
+        if not cursor:
+            return seen
+
+
+def test_cursor_round_trip():
+    cursor = make_cursor({'id': 7, 'upload_date': '2024-01-02 03:04:05'}, ORDER)
+    assert decode_cursor(cursor, ORDER) == ('2024-01-02 03:04:05', 7)
+
+
+@pytest.mark.parametrize('values', [
+    [ORDER, {'a': 1}, 3],
+    [ORDER, [1, 2], 3],
+    [ORDER, True, 3],
+    [ORDER, '2024-01-01', '3'],
+    [ORDER, '2024-01-01', True],
+    [ORDER, '2024-01-01'],
+    ['file_size DESC', 100, 3],
+])
+def test_invalid_cursors_are_rejected(values):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(values), ORDER)
+
+
+def test_bad_cursor_is_a_client_error(client):
+    response = client.get('/files', query_string={'cursor': encode_cursor([ORDER, {'a': 1}, 3])})
+    assert response.status_code == 400
+
+
+def test_paging_returns_every_file_once(client, upload):
+    for index in range(5):
+        upload(os.urandom(100) + b'page', f'page_{index}.png')
+
+    expected = [f['id'] for f in client.get('/files').get_json()['files']]
+    assert list_all(client, limit=2) == expected
+
+
+@pytest.mark.parametrize('order_by', ['created_date DESC', 'created_date ASC'])
+def test_paging_includes_null_sort_values(client, upload, order_by):
+    ids = [upload(os.urandom(100) + b'null', f'null_{index}.png') for index in range(6)]
+    conn = app_module.db.get_connection()
+    conn.executemany('UPDATE files SET created_date = NULL WHERE id = ?',
+                     [(file_id,) for file_id in ids[::2]])
+    conn.commit()
+
+    expected = [f['id'] for f in client.get('/files', query_string={'order_by': order_by}).get_json()['files']]
+    seen = list_all(client, order_by=order_by, limit=2)
+
+    assert seen == expected
+    assert len(seen) == len(set(seen))
+    # NULLs come last in either direction
+    null_ids = set(ids[::2])
+    assert set(seen[-len(null_ids):]) == null_ids
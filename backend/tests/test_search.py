@@ -0,0 +1,66 @@
+"""Full-text search and its keyset cursor"""
+import os
+import pytest
+import app as app_module
+from database import decode_search_cursor, encode_cursor
+
+
+def search_all(client, query, limit):
+    """Follow next_cursor through every page of results"""
+    results = []
+    cursor = None
+    while True:
+        params = {'q': query, 'limit': limit}
+        if cursor:
+            params['cursor'] = cursor
+        page = client.get('/search', query_string=params).get_json()
+        results.extend(page['files'])
+        cursor = page['next_cursor']
+        if not cursor:
+            return results
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    encode_cursor({'a': 1}),
+    encode_cursor(['search', 10]),
+    encode_cursor(['search', True, '2024-01-01', 3]),
+    encode_cursor(['search', -1.5, None, 3]),
+    encode_cursor(['search', -1.5, '2024-01-01', '3']),
+])
+def test_invalid_search_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_search_cursor(cursor)
+
+
+def test_bad_search_cursor_is_a_client_error(client):
+    response = client.get('/search', query_string={'q': 'x', 'cursor': encode_cursor(['search', 5])})
+    assert response.status_code == 400
+
+
+def test_prefix_words_match(client, upload):
+    upload(os.urandom(100), 'Beach_Holiday_2024.png')
+
+    names = [f['original_filename'] for f in
+             client.get('/search', query_string={'q': 'beach hol'}).get_json()['files']]
+    assert 'Beach_Holiday_2024.png' in names
+
+
+def test_search_pages_follow_next_cursor(client, upload):
+    for index in range(5):
+        upload(os.urandom(100), f'needle_{index}.png')
+
+    results = search_all(client, 'needle', limit=2)
+
+    names = [f['original_filename'] for f in results]
+    assert sorted(names) == [f'needle_{index}.png' for index in range(5)]
+    assert all('search_rank' not in f for f in results)
+
+
+def test_like_fallback_pages(client, upload, monkeypatch):
+    for index in range(3):
+        upload(os.urandom(100), f'fallback_{index}.png')
+    monkeypatch.setattr(app_module.db, 'fts_enabled', False)
+
+    names = [f['original_filename'] for f in search_all(client, 'fallback', limit=2)]
+    assert sorted(names) == [f'fallback_{index}.png' for index in range(3)]
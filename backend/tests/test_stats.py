@@ -0,0 +1,66 @@
+"""Storage statistics kept up to date by triggers"""
+import pytest
+import database
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'stats.db'))
+    db = Database()
+    yield db
+    db.close()
+
+
+def add(db, name, size, file_type='image'):
+    return db.add_file({
+        'filename': name,
+        'original_filename': name,
+        'file_path': f'/storage/{name}',
+        'file_size': size,
+        'file_type': file_type,
+    })
+
+
+def test_insert_updates_every_breakdown(db):
+    add(db, 'a.JPG', 100)
+    add(db, 'b.jpg', 50)
+    add(db, 'clip.tar.mp4', 1000, 'video')
+    add(db, 'README', 7, 'other')
+
+    stats = db.get_stats()
+
+    assert (stats['total_files'], stats['total_size']) == (4, 1157)
+    assert (stats['image_count'], stats['video_count']) == (2, 1)
+    assert stats['by_type']['image'] == {'count': 2, 'size': 150}
+    assert stats['by_extension']['jpg'] == {'count': 2, 'size': 150}
+    assert stats['by_extension']['mp4'] == {'count': 1, 'size': 1000}
+    assert stats['by_extension'][''] == {'count': 1, 'size': 7}
+    assert sum(month['count'] for month in stats['by_month'].values()) == 4
+
+
+def test_delete_removes_counts_and_empty_rows(db):
+    image_id = add(db, 'a.jpg', 100)
+    video_id = add(db, 'b.mp4', 1000, 'video')
+
+    db.delete_file(video_id)
+    stats = db.get_stats()
+    assert (stats['total_files'], stats['total_size']) == (1, 100)
+    assert stats['video_count'] == 0
+    assert 'video' not in stats['by_type']
+    assert 'mp4' not in stats['by_extension']
+
+    db.delete_file(image_id)
+    stats = db.get_stats()
+    assert (stats['total_files'], stats['total_size']) == (0, 0)
+    assert stats['by_type'] == stats['by_month'] == stats['by_extension'] == {}
+
+
+def test_rebuild_matches_the_triggers(db):
+    for index in range(5):
+        add(db, f'{index}.png', index * 10)
+    db.delete_file(1)
+
+    maintained = db.get_stats()
+    assert db.rebuild_stats() == maintained
+    assert (maintained['total_files'], maintained['total_size']) == (4, 100)
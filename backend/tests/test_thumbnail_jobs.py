@@ -0,0 +1,57 @@
+"""Background thumbnail jobs and the pending /thumbnail response"""
+import io
+import os
+from PIL import Image
+import config
+import app as app_module
+from thumbnails import create_thumbnail
+from worker import get_thumbnail_filename
+
+
+def make_jpeg(color, size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def run_thumbnail_job(file_id):
+    """Run a file's queued thumbnail job in this process, as the worker would"""
+    worker = app_module.worker
+    for job in app_module.db.claim_jobs(100):
+        if job['file_id'] != file_id:
+            continue
+        thumbnail_path = os.path.join(config.THUMBNAILS_PATH, get_thumbnail_filename(job['filename']))
+        worker.finish_thumbnail_job(job, create_thumbnail(job['file_path'], thumbnail_path))
+        app_module.db.complete_job(job['id'])
+
+
+def test_thumbnail_is_pending_until_the_job_runs(client, upload):
+    file_id = upload(make_jpeg('red'), 'photo.jpg')
+
+    response = client.get(f'/thumbnail/{file_id}')
+    assert response.status_code == 202
+    assert response.get_json() == {'status': 'pending'}
+    assert response.headers['Retry-After'] == '1'
+
+    run_thumbnail_job(file_id)
+
+    response = client.get(f'/thumbnail/{file_id}')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    record = app_module.db.get_file_by_id(file_id)
+    assert record['thumbnail_status'] == 'ready'
+    assert (record['width'], record['height']) == (64, 48)
+
+
+def test_failed_thumbnail_is_not_pending(client, upload):
+    file_id = upload(make_jpeg('green'), 'broken.jpg')
+    app_module.db.update_file_thumbnail(file_id, None, 'failed')
+
+    assert client.get(f'/thumbnail/{file_id}').status_code == 404
+
+
+def test_video_queues_no_thumbnail(client, upload):
+    file_id = upload(b'not really a video', 'clip.mp4')
+
+    assert app_module.db.get_file_by_id(file_id)['thumbnail_status'] is None
+    assert client.get(f'/thumbnail/{file_id}').status_code == 404
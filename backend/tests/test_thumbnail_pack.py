@@ -0,0 +1,78 @@
+"""Packed /thumbnails responses for a gallery page"""
+import json
+import os
+import struct
+import pytest
+import config
+import app as app_module
+
+
+def mark_thumbnail_ready(file_id, body):
+    """Store a thumbnail for a file as the background worker would"""
+    name = f'thumb_pack_{file_id}.jpg'
+    with open(os.path.join(config.THUMBNAILS_PATH, name), 'wb') as f:
+        f.write(body)
+    app_module.db.update_file_thumbnail(file_id, name, 'ready', 10, 10)
+    app_module.invalidate_file(file_id)
+
+
+def unpack(data):
+    """Split a packed response into its index and the thumbnail bodies by ID"""
+    index_length, = struct.unpack('>I', data[:4])
+    index = json.loads(data[4:4 + index_length])
+    payload = data[4 + index_length:]
+    bodies = {
+        item['id']: payload[item['offset']:item['offset'] + item['length']]
+        for item in index['items'] if item['status'] == 'ready'
+    }
+    return index['items'], bodies
+
+
+def test_layout_follows_the_requested_order(client, upload):
+    first = upload(os.urandom(100), 'pack_a.jpg')
+    second = upload(os.urandom(100), 'pack_b.jpg')
+    pending = upload(os.urandom(100), 'pack_c.jpg')
+    video = upload(os.urandom(100), 'pack_d.mp4')
+    mark_thumbnail_ready(first, b'first thumbnail')
+    mark_thumbnail_ready(second, b'second')
+
+    ids = [second, pending, 999999, video, first]
+    response = client.get('/thumbnails', query_string={'ids': ','.join(map(str, ids))})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-thumbnail-pack'
+    assert response.content_length == len(response.data)
+    items, bodies = unpack(response.data)
+    assert [(item['id'], item['status']) for item in items] == [
+        (second, 'ready'), (pending, 'pending'), (999999, 'missing'),
+        (video, 'missing'), (first, 'ready')]
+    assert items[0]['offset'] == 0 and items[4]['offset'] == len(b'second')
+    assert bodies == {second: b'second', first: b'first thumbnail'}
+
+
+def test_unchanged_page_is_not_modified(client, upload):
+    file_id = upload(os.urandom(100), 'pack_etag.jpg')
+    mark_thumbnail_ready(file_id, b'thumb')
+
+    first = client.get('/thumbnails', query_string={'ids': str(file_id)})
+    again = client.get('/thumbnails', query_string={'ids': str(file_id)},
+                       headers={'If-None-Match': first.headers['ETag']})
+
+    assert again.status_code == 304
+    assert again.data == b''
+
+
+@pytest.mark.parametrize('ids', ['1,abc', '1;2', '', ',,'])
+def test_bad_ids_are_rejected(client, ids):
+    response = client.get('/thumbnails', query_string={'ids': ids})
+
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_too_many_ids(client, monkeypatch):
+    monkeypatch.setattr(config, 'MAX_THUMBNAIL_BATCH', 2)
+
+    response = client.get('/thumbnails', query_string={'ids': '1,2,3'})
+
+    assert response.status_code == 413
@@ -0,0 +1,119 @@
+"""Thumbnail decoding: EXIF orientation and the embedded preview fast path"""
+import io
+import struct
+import pytest
+from PIL import Image
+from thumbnails import create_thumbnail
+
+RED = (255, 0, 0)
+BLUE = (0, 0, 255)
+GREEN = (0, 255, 0)
+
+
+def jpeg_bytes(img, **kwargs):
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=95, **kwargs)
+    return buffer.getvalue()
+
+
+def make_exif(orientation=1, preview=None):
+    """Big-endian EXIF block with an orientation and an optional IFD1 preview JPEG"""
+    ifd0 = struct.pack('>H', 1) + struct.pack('>HHII', 0x0112, 3, 1, orientation << 16)
+    ifd1_offset = 8 + len(ifd0) + 4
+    if preview is None:
+        tiff = b'MM\x00\x2a' + struct.pack('>I', 8) + ifd0 + struct.pack('>I', 0)
+    else:
+        preview_offset = ifd1_offset + 2 + 2 * 12 + 4
+        ifd1 = (struct.pack('>H', 2)
+                + struct.pack('>HHII', 0x0201, 4, 1, preview_offset)
+                + struct.pack('>HHII', 0x0202, 4, 1, len(preview))
+                + struct.pack('>I', 0))
+        tiff = (b'MM\x00\x2a' + struct.pack('>I', 8) + ifd0 + struct.pack('>I', ifd1_offset)
+                + ifd1 + preview)
+    return b'Exif\x00\x00' + tiff
+
+
+def halves(size, first, second):
+    """Image whose left half is one colour and right half another"""
+    img = Image.new('RGB', size, first)
+    img.paste(second, (size[0] // 2, 0, size[0], size[1]))
+    return img
+
+
+def near(pixel, colour):
+    return all(abs(a - b) < 40 for a, b in zip(pixel, colour))
+
+
+def make_thumbnail(tmp_path, data):
+    source = tmp_path / 'photo.jpg'
+    source.write_bytes(data)
+    target = tmp_path / 'thumb.jpg'
+    dimensions = create_thumbnail(str(source), str(target))
+    assert not (tmp_path / 'thumb.jpg.tmp').exists()
+    return dimensions, Image.open(target)
+
+
+def test_landscape_without_exif(tmp_path):
+    (width, height), thumb = make_thumbnail(tmp_path, jpeg_bytes(halves((1200, 600), RED, BLUE)))
+
+    assert (width, height) == (1200, 600)
+    assert thumb.size == (300, 150)
+    assert near(thumb.getpixel((10, 75)), RED) and near(thumb.getpixel((290, 75)), BLUE)
+
+
+@pytest.mark.parametrize('orientation, top, bottom', [
+    (6, RED, BLUE),  # Rotated 90° clockwise to display: the left edge ends up on top
+    (8, BLUE, RED),  # Rotated 90° counter-clockwise
+])
+def test_exif_orientation_turns_the_thumbnail_upright(tmp_path, orientation, top, bottom):
+    data = jpeg_bytes(halves((1200, 600), RED, BLUE), exif=make_exif(orientation))
+
+    (width, height), thumb = make_thumbnail(tmp_path, data)
+
+    assert (width, height) == (600, 1200)
+    assert thumb.size == (150, 300)
+    assert near(thumb.getpixel((75, 10)), top) and near(thumb.getpixel((75, 290)), bottom)
+
+
+def test_large_enough_exif_preview_is_used(tmp_path):
+    # The preview is a different colour, so the thumbnail shows which one was decoded
+    preview = jpeg_bytes(Image.new('RGB', (480, 320), GREEN))
+    data = jpeg_bytes(Image.new('RGB', (1500, 1000), RED), exif=make_exif(preview=preview))
+
+    (width, height), thumb = make_thumbnail(tmp_path, data)
+
+    assert (width, height) == (1500, 1000)
+    assert thumb.size == (300, 200)
+    assert near(thumb.getpixel((150, 100)), GREEN)
+
+
+@pytest.mark.parametrize('preview_size', [
+    (160, 120),  # Smaller than the thumbnail
+    (480, 360),  # Letterboxed: different aspect ratio from the photo
+])
+def test_unsuitable_exif_preview_is_ignored(tmp_path, preview_size):
+    preview = jpeg_bytes(Image.new('RGB', preview_size, GREEN))
+    data = jpeg_bytes(Image.new('RGB', (1500, 1000), RED), exif=make_exif(preview=preview))
+
+    _, thumb = make_thumbnail(tmp_path, data)
+
+    assert near(thumb.getpixel((150, 100)), RED)
+
+
+def test_damaged_exif_preview_falls_back_to_the_photo(tmp_path):
+    data = jpeg_bytes(Image.new('RGB', (1500, 1000), RED), exif=make_exif(preview=b'\xff\xd8garbage'))
+
+    _, thumb = make_thumbnail(tmp_path, data)
+
+    assert near(thumb.getpixel((150, 100)), RED)
+
+
+def test_transparent_png_is_flattened_onto_white(tmp_path):
+    img = Image.new('RGBA', (600, 600), (0, 0, 0, 0))
+    buffer = io.BytesIO()
+    img.save(buffer, 'PNG')
+
+    dimensions, thumb = make_thumbnail(tmp_path, buffer.getvalue())
+
+    assert dimensions == (600, 600)
+    assert thumb.mode == 'RGB' and near(thumb.getpixel((150, 150)), (255, 255, 255))
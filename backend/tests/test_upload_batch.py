@@ -0,0 +1,57 @@
+"""Batch uploads with a mix of accepted, duplicate and rejected files"""
+import io
+import os
+import pytest
+import config
+
+
+def post_batch(client, parts):
+    data = {'files': [(io.BytesIO(content), name) for name, content in parts]}
+    return client.post('/upload/batch', data=data, content_type='multipart/form-data')
+
+
+def test_rejected_parts_do_not_fail_the_others(client, upload):
+    stored_before = os.urandom(200)
+    existing_id = upload(stored_before, 'before.jpg')
+    new = os.urandom(200)
+
+    response = post_batch(client, [
+        ('new.jpg', new),
+        ('script.exe', os.urandom(50)),
+        ('again.jpg', stored_before),
+        ('copy.png', new),
+    ])
+
+    assert response.status_code == 200
+    body = response.get_json()
+    statuses = [(r['name'], r['status']) for r in body['results']]
+    assert statuses == [('new.jpg', 201), ('script.exe', 400), ('again.jpg', 200), ('copy.png', 200)]
+    assert body['results'][1]['error'] == 'File type not allowed'
+    assert body['results'][2]['file_id'] == existing_id
+    # A repeat within the batch points at the copy stored from it
+    assert body['results'][3]['file_id'] == body['results'][0]['file_id']
+    assert (body['uploaded'], body['duplicates'], body['failed']) == (1, 2, 1)
+
+    new_id = body['results'][0]['file_id']
+    assert client.get(f'/file/{new_id}').data == new
+
+
+def test_all_rejected(client):
+    response = post_batch(client, [('a.exe', b'1'), ('b.sh', b'2')])
+
+    body = response.get_json()
+    assert [r['status'] for r in body['results']] == [400, 400]
+    assert (body['uploaded'], body['failed']) == (0, 2)
+
+
+def test_too_many_parts(client, monkeypatch):
+    monkeypatch.setattr(config, 'MAX_BATCH_FILES', 2)
+
+    response = post_batch(client, [(f'{i}.jpg', os.urandom(10)) for i in range(3)])
+
+    assert response.status_code == 413
+
+
+@pytest.mark.parametrize('data', [{}, {'other': 'field'}])
+def test_no_files(client, data):
+    assert client.post('/upload/batch', data=data).status_code == 400
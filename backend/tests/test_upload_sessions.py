@@ -0,0 +1,99 @@
+"""Resumable upload sessions"""
+import hashlib
+import os
+import pytest
+import config
+from app import get_missing_chunk_ranges
+
+CHUNK = config.MIN_UPLOAD_CHUNK_SIZE
+
+
+def start_session(client, data, chunk_size=CHUNK, filename='movie.mp4', **fields):
+    body = {
+        'filename': filename,
+        'size': len(data),
+        'checksum': hashlib.md5(data).hexdigest(),
+        'chunk_size': chunk_size
+    }
+    body.update(fields)
+    return client.post('/upload/session', json=body)
+
+
+def send_chunk(client, session_id, data, index):
+    return client.put(f'/upload/session/{session_id}/chunk/{index}',
+                      data=data[index * CHUNK:(index + 1) * CHUNK])
+
+
+def test_missing_chunk_ranges():
+    assert get_missing_chunk_ranges([], 4) == [[0, 4]]
+    assert get_missing_chunk_ranges([0, 1, 2, 3], 4) == []
+    assert get_missing_chunk_ranges([3, 0, 5], 8) == [[1, 3], [4, 5], [6, 8]]
+
+
+def test_tiny_chunk_size_is_rejected(client):
+    assert start_session(client, os.urandom(1000), chunk_size=1).status_code == 400
+
+
+def test_large_chunk_size_is_capped(client):
+    response = start_session(client, os.urandom(1000), chunk_size=config.MAX_UPLOAD_CHUNK_SIZE * 4)
+    assert response.status_code == 201
+    assert response.get_json()['chunk_size'] == config.MAX_UPLOAD_CHUNK_SIZE
+
+
+@pytest.mark.parametrize('fields', [
+    {'size': True},
+    {'size': -1},
+    {'size': '1000'},
+    {'checksum': 5},
+    {'checksum': 'abc'},
+    {'checksum': 'D41D8CD98F00B204E9800998ECF8427E'},
+])
+def test_invalid_session_fields_are_rejected(client, fields):
+    assert start_session(client, os.urandom(1000), **fields).status_code == 400
+
+
+def test_status_reports_missing_ranges_and_caps_the_list(client, monkeypatch):
+    monkeypatch.setattr(config, 'UPLOAD_MISSING_LIST_LIMIT', 3)
+    data = os.urandom(CHUNK * 7 + 10)
+    session = start_session(client, data).get_json()
+    assert session['total_chunks'] == 8
+    assert session['missing'] == [0, 1, 2]
+
+    for index in (0, 3):
+        assert send_chunk(client, session['session_id'], data, index).status_code == 200
+    status = client.get(f"/upload/session/{session['session_id']}").get_json()
+    assert status['missing_ranges'] == [[1, 3], [4, 8]]
+    assert status['missing_count'] == 6
+    assert status['received_count'] == 2
+    assert status['missing'] == [1, 2, 4]
+
+
+def test_complete_requires_every_chunk(client):
+    data = os.urandom(CHUNK * 2 + 10)
+    session_id = start_session(client, data).get_json()['session_id']
+    assert send_chunk(client, session_id, data, 0).status_code == 200
+
+    response = client.post(f'/upload/session/{session_id}/complete')
+    assert response.status_code == 409
+    assert response.get_json()['missing_ranges'] == [[1, 3]]
+
+    for index in (1, 2):
+        assert send_chunk(client, session_id, data, index).status_code == 200
+    response = client.post(f'/upload/session/{session_id}/complete')
+    assert response.status_code == 201
+    assert client.get(f"/file/{response.get_json()['file_id']}").data == data
+
+
+def test_bad_resend_keeps_the_received_chunk(client):
+    data = os.urandom(CHUNK * 2)
+    session_id = start_session(client, data).get_json()['session_id']
+    for index in (0, 1):
+        assert send_chunk(client, session_id, data, index).status_code == 200
+
+    url = f'/upload/session/{session_id}/chunk/0'
+    assert client.put(url, data=b'truncated').status_code == 400
+    assert client.put(url, data=os.urandom(CHUNK + 1)).status_code == 400
+
+    response = client.post(f'/upload/session/{session_id}/complete')
+    assert response.status_code == 201
+    assert client.get(f"/file/{response.get_json()['file_id']}").data == data
@@ -0,0 +1,139 @@
+"""
+Thumbnail generation
+
+Kept free of Flask and database imports so it can run inside the
+derivative worker's child processes.
+
+Full-resolution decoding is avoided where possible: a JPEG that embeds an
+EXIF preview at least as large as the thumbnail is thumbnailed from that
+preview, and other JPEGs are decoded with DCT scaling (Image.draft) at the
+smallest power-of-two reduction that still covers the thumbnail size. Other
+formats, and JPEGs whose draft mode is unusable, fall back to a full decode.
+"""
+import io
+import os
+from PIL import Image, ExifTags
+import config
+
+# EXIF orientation -> transpose that makes the image upright
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# IFD1 tags locating the embedded JPEG preview
+JPEG_PREVIEW_OFFSET = 0x0201
+JPEG_PREVIEW_LENGTH = 0x0202
+
+
+def create_thumbnail(image_path, thumbnail_path, size=config.THUMBNAIL_SIZE):
+    """
+    Create thumbnail for image
+
+    The source dimensions are read from the header; the pixels are decoded
+    once, at reduced resolution where the format allows it. The thumbnail is
+    turned upright according to the EXIF orientation and written to a
+    temporary file that is renamed into place, so a half-written thumbnail
+    is never served.
+
+    Returns:
+        tuple: (width, height) of the source image as displayed (after
+        EXIF orientation)
+
+    Raises:
+        Exception: If the image cannot be decoded or the thumbnail saved
+    """
+    with Image.open(image_path) as img:
+        width, height = img.size
+        exif = img.getexif()
+        orientation = exif.get(ExifTags.Base.Orientation, 1)
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+
+        source = None
+        if img.format == 'JPEG':
+            source = open_exif_preview(img, exif, size)
+            if source is None:
+                # Let libjpeg scale by 1/2, 1/4 or 1/8 while decoding, keeping
+                # enough pixels for a good Lanczos downscale
+                img.draft('RGB', (size[0] * 2, size[1] * 2))
+        if source is None:
+            source = img
+
+        thumb = to_rgb(source)
+        thumb.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        transpose = ORIENTATION_TRANSPOSE.get(orientation)
+        if transpose is not None:
+            thumb = thumb.transpose(transpose)
+
+        tmp_path = f"{thumbnail_path}.tmp"
+        thumb.save(tmp_path, 'JPEG', quality=85)
+        os.replace(tmp_path, thumbnail_path)
+
+    return width, height
+
+
+def open_exif_preview(img, exif, size):
+    """
+    Open the preview JPEG embedded in a photo's EXIF data
+
+    Returns:
+        Image: The preview, or None if there is none, it is smaller than the
+        thumbnail, or its aspect ratio differs from the photo's (some cameras
+        letterbox their previews)
+    """
+    try:
+        ifd1 = exif.get_ifd(ExifTags.IFD.IFD1)
+    except (KeyError, ValueError, SyntaxError):
+        return None
+    offset = ifd1.get(JPEG_PREVIEW_OFFSET)
+    length = ifd1.get(JPEG_PREVIEW_LENGTH)
+    raw_exif = img.info.get('exif')
+    if not offset or not length or not raw_exif:
+        return None
+
+    # Offsets are relative to the TIFF header, which follows "Exif\0\0"
+    data = raw_exif[6 + offset:6 + offset + length]
+    try:
+        preview = Image.open(io.BytesIO(data))
+        preview_width, preview_height = preview.size
+    except (OSError, SyntaxError):
+        return None
+
+    width, height = img.size
+    target_width, target_height = fit_size(width, height, size)
+    if preview_width < target_width or preview_height < target_height:
+        return None
+    if abs(preview_width / preview_height - width / height) > 0.01 * width / height:
+        return None
+
+    try:
+        preview.load()
+    except (OSError, SyntaxError):
+        return None
+    return preview
+
+
+def fit_size(width, height, size):
+    """Dimensions of a width x height image scaled down to fit in size"""
+    scale = min(size[0] / width, size[1] / height, 1)
+    return max(round(width * scale), 1), max(round(height * scale), 1)
+
+
+def to_rgb(img):
+    """Convert an image to RGB, flattening transparency onto white"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
@@ -0,0 +1,230 @@
+"""
+Background derivative worker
+
+Thumbnail generation and other per-file derivative work is queued in the
+database's jobs table and executed by a pool of worker processes, so
+uploads return as soon as the file is stored and decoding uses every core.
+Jobs survive restarts: anything left running by a previous process is put
+back in the queue on start, and failures are retried with a growing delay.
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import config
+import metrics
+import chunkstore
+from thumbnails import create_thumbnail
+
+
+class PermanentJobError(Exception):
+    """A job failure that retrying cannot fix"""
+
+
+class DerivativeWorker:
+    """Dispatches queued jobs from the database to a process pool"""
+
+    def __init__(self, db, max_workers=config.WORKER_PROCESSES):
+        self.db = db
+        self.max_workers = max_workers
+        self.executor = None
+        self.thread = None
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+
+        # Job kind -> (function run in a child process, handler for its result)
+        self.handlers = {
+            'thumbnail': (self.run_thumbnail_job, self.finish_thumbnail_job),
+            'checksum': (self.run_checksum_job, self.finish_checksum_job),
+            'chunk': (self.run_chunk_job, self.finish_chunk_job),
+        }
+
+    def start(self):
+        """Start the process pool and the dispatcher thread"""
+        if self.thread is not None:
+            return
+
+        requeued = self.db.requeue_running_jobs()
+        if requeued:
+            print(f"[WORKER] Re-queued {requeued} interrupted jobs")
+
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self.thread = threading.Thread(target=self.run, name='derivative-worker', daemon=True)
+        self.thread.start()
+        print(f"[WORKER] Started with {self.max_workers} processes")
+
+    def stop(self, wait=True):
+        """Stop dispatching jobs and shut the process pool down"""
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=True)
+            self.executor = None
+
+    def notify(self):
+        """
+        Wake the dispatcher because new jobs were queued
+
+        Only a dispatcher started in this process is woken. Under gunicorn
+        it runs in a separate process (see serve.py), which finds the jobs
+        on its next poll instead.
+        """
+        self.wakeup.set()
+
+    def run(self):
+        """Dispatcher loop: claim due jobs while the pool has free capacity"""
+        while not self.stopping.is_set():
+            self.wakeup.clear()
+
+            with self.lock:
+                # Keep a small backlog per process so workers never sit idle
+                free_slots = self.max_workers * 2 - self.in_flight
+
+            if free_slots > 0:
+                try:
+                    jobs = self.db.claim_jobs(free_slots)
+                except Exception as e:
+                    print(f"[WORKER] Could not claim jobs: {e}")
+                    jobs = []
+
+                for job in jobs:
+                    self.submit(job)
+
+                # More work may be waiting; go round again without sleeping
+                if len(jobs) == free_slots:
+                    continue
+
+            self.wakeup.wait(config.JOB_POLL_INTERVAL)
+
+    def submit(self, job):
+        """Hand a claimed job to the process pool"""
+        handler = self.handlers.get(job['kind'])
+        if handler is None:
+            self.db.fail_job(job['id'], f"Unknown job kind: {job['kind']}")
+            return
+
+        run, finish = handler
+        started = time.perf_counter()
+        try:
+            future = run(job)
+        except BrokenProcessPool:
+            # A child died hard (e.g. out of memory); replace the pool
+            print("[WORKER] Process pool broken, restarting it")
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            self.retry_or_fail(job, 'Worker process crashed')
+            return
+
+        with self.lock:
+            self.in_flight += 1
+        future.add_done_callback(lambda f: self.on_done(job, f, finish, started))
+
+    def on_done(self, job, future, finish, started):
+        """Record the result of a finished job"""
+        metrics.JOB_SECONDS.labels(job['kind']).observe(time.perf_counter() - started)
+        try:
+            finish(job, future.result())
+            self.db.complete_job(job['id'])
+            metrics.JOBS.labels(job['kind'], 'done').inc()
+        except PermanentJobError as e:
+            print(f"[WORKER] {job['kind']} job {job['id']} failed permanently: {e}")
+            self.db.fail_job(job['id'], str(e))
+            metrics.JOBS.labels(job['kind'], 'failed').inc()
+        except Exception as e:
+            self.retry_or_fail(job, str(e) or e.__class__.__name__)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            self.wakeup.set()
+
+    def retry_or_fail(self, job, error):
+        """Schedule a retry for a failed job, or give up after JOB_MAX_ATTEMPTS"""
+        if job['attempts'] < config.JOB_MAX_ATTEMPTS:
+            print(f"[WORKER] {job['kind']} job {job['id']} failed, will retry: {error}")
+            self.db.fail_job(job['id'], error, config.JOB_RETRY_DELAY * job['attempts'])
+            metrics.JOBS.labels(job['kind'], 'retry').inc()
+        else:
+            print(f"[WORKER] {job['kind']} job {job['id']} failed permanently: {error}")
+            self.db.fail_job(job['id'], error)
+            metrics.JOBS.labels(job['kind'], 'failed').inc()
+            if job['kind'] == 'thumbnail':
+                self.db.update_file_thumbnail(job['file_id'], None, 'failed')
+
+    def get_source_chunks(self, job):
+        """Chunks of a job's file if it is in the chunk store, else None"""
+        if job['storage'] == 'chunks':
+            return self.db.get_file_chunks(job['file_id'])
+        return None
+
+    def run_thumbnail_job(self, job):
+        """Start generating the thumbnail of an image in a child process"""
+        thumbnail_path = os.path.join(config.THUMBNAILS_PATH, get_thumbnail_filename(job['filename']))
+        return self.executor.submit(create_stored_thumbnail, job['file_path'],
+                                    self.get_source_chunks(job), thumbnail_path)
+
+    def finish_thumbnail_job(self, job, dimensions):
+        """Mark a file's thumbnail as ready and store the image dimensions"""
+        thumbnail_filename = get_thumbnail_filename(job['filename'])
+        width, height = dimensions
+
+        if not self.db.update_file_thumbnail(job['file_id'], thumbnail_filename, 'ready', width, height):
+            # The file was deleted while its thumbnail was being generated
+            thumbnail_path = os.path.join(config.THUMBNAILS_PATH, thumbnail_filename)
+            if os.path.exists(thumbnail_path):
+                os.remove(thumbnail_path)
+
+    def run_checksum_job(self, job):
+        """Start hashing a file that has no checksum yet"""
+        return self.executor.submit(compute_checksum, job['file_path'], self.get_source_chunks(job))
+
+    def finish_checksum_job(self, job, checksum):
+        """Store a backfilled checksum, unless another file already has it"""
+        existing_id = self.db.set_file_checksum(job['file_id'], checksum)
+        if existing_id is not None:
+            raise PermanentJobError(f"Duplicate of file {existing_id}")
+
+    def run_chunk_job(self, job):
+        """Start splitting a stored file into the chunk store"""
+        return self.executor.submit(chunkstore.store_chunks, job['file_path'])
+
+    def finish_chunk_job(self, job, chunks):
+        """Record a file's chunks and remove the plain copy"""
+        if not self.db.add_file_chunks(job['file_id'], chunks):
+            # The file was deleted while it was being split
+            self.db.delete_orphan_chunks(chunkstore.remove_chunk)
+            return
+
+        restored = chunkstore.restore_missing_chunks(job['file_path'], chunks)
+        if restored:
+            print(f"[WORKER] Rewrote {restored} chunks collected while file {job['file_id']} was split")
+
+        try:
+            os.remove(job['file_path'])
+        except OSError as e:
+            print(f"[WORKER] Could not remove {job['file_path']} after chunking: {e}")
+
+
+def create_stored_thumbnail(file_path, chunks, thumbnail_path):
+    """Create the thumbnail of a stored file, which may be in the chunk store"""
+    with chunkstore.open_stored_file(file_path, chunks) as f:
+        return create_thumbnail(f, thumbnail_path)
+
+
+def compute_checksum(file_path, chunks=None):
+    """Calculate the MD5 checksum of a stored file (chunks: see open_stored_file)"""
+    md5 = hashlib.md5()
+    with chunkstore.open_stored_file(file_path, chunks) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def get_thumbnail_filename(filename):
+    """Thumbnail filename for a stored file"""
+    return f"thumb_{filename}"
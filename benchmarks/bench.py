@@ -0,0 +1,508 @@
+"""
+Benchmark suite for the storage server
+
+Generates a synthetic corpus (JPEGs of several sizes, MP4s with real
+headers and noise for media, and thousands to millions of file records),
+then measures:
+
+- the Flask app through its test client, one request at a time, which
+  isolates the server code from the network;
+- the hot functions directly (create_thumbnail, probe_video);
+- optionally (--server) a real local server started with serve.py, driven
+  by concurrent clients over HTTP.
+
+Each scenario reports p50/p90/p99 latency and throughput. Results are
+written as JSON together with the commit they were measured on, and two
+result files can be compared to spot regressions.
+
+Usage:
+    python benchmarks/bench.py run [--quick] [--rows N] [--server] [--output FILE]
+    python benchmarks/bench.py compare BASELINE.json RESULT.json [--threshold 0.15]
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+import corpus
+
+# Fields the web gallery asks for (frontend/src/App.js)
+GALLERY_FIELDS = 'id,original_filename,file_type,file_size,upload_date,width,height,thumbnail_path'
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+
+def summarize(latencies, elapsed, errors=0):
+    """
+    Latency percentiles (milliseconds) and throughput of a scenario
+
+    Args:
+        latencies (list): Seconds taken by each successful operation
+        elapsed (float): Wall time of the whole scenario in seconds
+        errors (int): Operations that failed
+
+    Returns:
+        dict: count, errors, p50_ms, p90_ms, p99_ms, mean_ms, max_ms, throughput_per_s
+    """
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        if not ordered:
+            return None
+        rank = max(math.ceil(p / 100 * len(ordered)), 1)
+        return round(ordered[rank - 1] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'errors': errors,
+        'p50_ms': percentile(50),
+        'p90_ms': percentile(90),
+        'p99_ms': percentile(99),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+        'max_ms': round(ordered[-1] * 1000, 3) if ordered else None,
+        'throughput_per_s': round(len(ordered) / elapsed, 2) if elapsed else None,
+    }
+
+
+def measure(operation, iterations, warmup=2):
+    """
+    Run an operation repeatedly, one call at a time
+
+    Args:
+        operation (callable): Called with the iteration number; returns
+            False (or a response with an error status) on failure
+        iterations (int): Measured calls
+        warmup (int): Unmeasured calls made first
+
+    Returns:
+        dict: Summary as returned by summarize()
+    """
+    for index in range(warmup):
+        operation(-1 - index)
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for index in range(iterations):
+        call_started = time.perf_counter()
+        result = operation(index)
+        if hasattr(result, 'get_data'):
+            result.get_data()  # Streamed bodies are produced as they are read
+        elapsed = time.perf_counter() - call_started
+        if result is False or getattr(result, 'status_code', 200) >= 400:
+            errors += 1
+        else:
+            latencies.append(elapsed)
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def load_backend(work_dir):
+    """Import the server modules with storage and database inside work_dir"""
+    os.environ['PCS_STORAGE_PATH'] = os.path.join(work_dir, 'storage')
+    os.environ['PCS_DATABASE_PATH'] = os.path.join(work_dir, 'storage.db')
+    sys.path.insert(0, BACKEND_DIR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as app_module
+    return app_module
+
+
+def upload_form(name, data):
+    return {'file': (io.BytesIO(data), name)}
+
+
+def bench_test_client(app_module, sizes, report):
+    """Scenarios run through Flask's test client"""
+    import thumbnails
+
+    client = app_module.app.test_client()
+    db = app_module.db
+
+    photo = corpus.make_jpeg(1, seed=1)
+    small_photo = corpus.make_jpeg(0.1, seed=2)
+    video = corpus.make_mp4(media_size=sizes['video_bytes'], seed=3)
+    counter = iter(range(10 ** 9))
+
+    def upload_photo(_):
+        data = corpus.make_unique(photo, next(counter))
+        return client.post('/upload', data=upload_form('bench.jpg', data),
+                           content_type='multipart/form-data')
+
+    def upload_batch(_):
+        files = [(io.BytesIO(corpus.make_unique(small_photo, next(counter))), f'b{i}.jpg')
+                 for i in range(20)]
+        return client.post('/upload/batch', data={'files': files},
+                           content_type='multipart/form-data')
+
+    def upload_video(index):
+        data = video + str(index).encode()  # Distinct content, headers unchanged
+        return client.post('/upload', data=upload_form('bench.mp4', data),
+                           content_type='multipart/form-data')
+
+    report('upload 1 MP JPEG', measure(upload_photo, sizes['uploads']))
+    report('upload batch of 20 JPEGs', measure(upload_batch, max(sizes['uploads'] // 10, 3)))
+    report(f"upload {sizes['video_bytes'] // (1024 * 1024)} MB MP4",
+           measure(upload_video, max(sizes['uploads'] // 5, 3)))
+
+    # Give the uploaded photos thumbnails, as the worker would
+    photo_ids = [row['id'] for row in db.get_all_files(limit=200, file_type='image')
+                 if row['thumbnail_status'] == 'pending']
+    for file_id in photo_ids:
+        record = db.get_file_by_id(file_id)
+        thumbnail_filename = f"thumb_{record['filename']}"
+        thumbnail_path = os.path.join(app_module.config.THUMBNAILS_PATH, thumbnail_filename)
+        width, height = thumbnails.create_thumbnail(record['file_path'], thumbnail_path)
+        db.update_file_thumbnail(file_id, thumbnail_filename, 'ready', width, height)
+
+    report('GET /thumbnail/<id>',
+           measure(lambda i: client.get(f'/thumbnail/{photo_ids[i % len(photo_ids)]}'),
+                   sizes['requests']))
+    pack_ids = ','.join(str(file_id) for file_id in (photo_ids * 100)[:100])
+    report('GET /thumbnails (100 ids)',
+           measure(lambda i: client.get(f'/thumbnails?ids={pack_ids}'), sizes['requests'] // 5))
+
+    report('GET /files (every record)',
+           measure(lambda i: client.get('/files'), max(sizes['requests'] // 25, 3), warmup=1))
+    report('GET /files (every record, gallery fields)',
+           measure(lambda i: client.get('/files', query_string={'fields': GALLERY_FIELDS}),
+                   max(sizes['requests'] // 25, 3), warmup=1))
+    report('GET /files?limit=50',
+           measure(lambda i: client.get('/files?limit=50'), sizes['requests']))
+    report('GET /files?limit=50&type=video',
+           measure(lambda i: client.get('/files?limit=50&type=video'), sizes['requests']))
+    report('GET /files?limit=50 by name',
+           measure(lambda i: client.get('/files', query_string={
+                       'limit': 50, 'order_by': 'original_filename ASC'}),
+                   sizes['requests']))
+
+    # Walk deep into the listing with cursors
+    cursors = [None]
+
+    def next_page(_):
+        cursor = cursors[-1]
+        url = '/files?limit=50' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url)
+        cursors.append(response.get_json()['next_cursor'])
+        if cursors[-1] is None:
+            cursors[:] = [None]
+        return response
+
+    report('GET /files?limit=50 (cursor pages)', measure(next_page, sizes['requests']))
+
+    words = corpus.WORDS
+    report('GET /search (one word)',
+           measure(lambda i: client.get('/search', query_string={
+               'q': words[i % len(words)], 'limit': 50}),
+                   sizes['requests']))
+    report('GET /search (two words and a number)',
+           measure(lambda i: client.get('/search', query_string={
+               'q': f'{words[i % len(words)]} {words[(i + 3) % len(words)]} {i % 10}', 'limit': 50}),
+               sizes['requests']))
+    report('GET /stats', measure(lambda i: client.get('/stats'), sizes['requests']))
+
+    checksums = [f'{index:032x}' for index in range(0, 2000, 2)]
+    report('POST /files/exists (1000 checksums)',
+           measure(lambda i: client.post('/files/exists', json={'checksums': checksums}),
+                   sizes['requests'] // 5))
+
+
+def bench_functions(work_dir, sizes, report):
+    """Scenarios calling the hot functions directly"""
+    import thumbnails
+    import media_probe
+    import chunkstore
+
+    output_path = os.path.join(work_dir, 'thumbnail.jpg')
+    for megapixels in sizes['megapixels']:
+        path = os.path.join(work_dir, f'photo_{megapixels}mp.jpg')
+        with open(path, 'wb') as f:
+            f.write(corpus.make_jpeg(megapixels, seed=megapixels))
+        report(f'create_thumbnail {megapixels} MP',
+               measure(lambda i: thumbnails.create_thumbnail(path, output_path),
+                       sizes['thumbnails'], warmup=1))
+
+    video_path = os.path.join(work_dir, 'video_chunks.mp4')
+    with open(video_path, 'wb') as f:
+        f.write(corpus.make_mp4(media_size=sizes['video_bytes'], seed=5))
+
+    def split_video(_):
+        with open(video_path, 'rb') as f:
+            for _ in chunkstore.split_chunks(f):
+                pass
+
+    report(f"split_chunks {sizes['video_bytes'] // (1024 * 1024)} MB",
+           measure(split_video, sizes['thumbnails'], warmup=1))
+
+    for moov_at_end in (False, True):
+        path = os.path.join(work_dir, f'video_{moov_at_end}.mp4')
+        with open(path, 'wb') as f:
+            f.write(corpus.make_mp4(media_size=sizes['video_bytes'], moov_at_end=moov_at_end))
+        label = 'moov at end' if moov_at_end else 'moov first'
+        report(f'probe_video ({label})',
+               measure(lambda i: media_probe.probe_video(path), sizes['requests']))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_load(url_for, clients, duration, method='get', body_for=None):
+    """
+    Drive a server with concurrent clients for a fixed time
+
+    Args:
+        url_for (callable): Returns the URL for a request number
+        clients (int): Concurrent client threads, each with its own session
+        duration (float): Seconds to run
+        method (str): HTTP method
+        body_for (callable): Returns request kwargs (files=..., json=...)
+
+    Returns:
+        dict: Summary as returned by summarize()
+    """
+    import requests
+
+    latencies = []
+    errors = [0]
+    counter = iter(range(10 ** 9))
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        session = requests.Session()
+        local = []
+        while time.monotonic() < deadline:
+            number = next(counter)
+            kwargs = body_for(number) if body_for else {}
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url_for(number), timeout=60, **kwargs)
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            if ok:
+                local.append(time.perf_counter() - started)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - started, errors[0])
+
+
+def bench_server(work_dir, app_module, sizes, report):
+    """Scenarios against serve.py over HTTP with concurrent clients"""
+    import requests
+
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, PCS_HOST='127.0.0.1', PCS_PORT=str(port))
+    log = open(os.path.join(work_dir, 'server.log'), 'w')
+    server = subprocess.Popen([sys.executable, 'serve.py'], cwd=BACKEND_DIR, env=env,
+                              stdout=log, stderr=subprocess.STDOUT)
+    try:
+        for _ in range(100):
+            try:
+                requests.get(base, timeout=1)
+                break
+            except requests.RequestException:
+                time.sleep(0.2)
+        else:
+            raise RuntimeError(f'Server did not start, see {log.name}')
+
+        db = app_module.db
+        photo_ids = [row['id'] for row in db.get_all_files(limit=200, file_type='image')
+                     if row['thumbnail_status'] == 'ready']
+        photo = corpus.make_jpeg(1, seed=4)
+        clients, duration = sizes['clients'], sizes['duration']
+
+        report(f'server GET /thumbnail/<id> x{clients}',
+               run_load(lambda n: f'{base}/thumbnail/{photo_ids[n % len(photo_ids)]}', clients, duration))
+        report(f'server GET /files?limit=50 x{clients}',
+               run_load(lambda n: f'{base}/files?limit=50', clients, duration))
+        report(f'server GET /search x{clients}',
+               run_load(lambda n: f'{base}/search?q={corpus.WORDS[n % len(corpus.WORDS)]}&limit=50',
+                        clients, duration))
+        report(f'server POST /upload x{clients}',
+               run_load(lambda n: f'{base}/upload', clients, duration, method='post',
+                        body_for=lambda n: {'files': {'file': (
+                            'load.jpg', corpus.make_unique(photo, 10 ** 6 + n))}}))
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        log.close()
+
+
+def git_revision():
+    """(commit, has uncommitted changes) of the repository, or (None, None)"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True, cwd=BACKEND_DIR).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                capture_output=True, text=True, check=True, cwd=BACKEND_DIR).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run(args):
+    """Generate the corpus, run every scenario and write the results"""
+    sizes = {
+        'rows': args.rows if args.rows is not None else (2000 if args.quick else 10000),
+        'uploads': 20 if args.quick else 100,
+        'requests': 50 if args.quick else 300,
+        'thumbnails': 3 if args.quick else 10,
+        'megapixels': [2, 12] if args.quick else [2, 12, 48],
+        'video_bytes': (2 if args.quick else 16) * 1024 * 1024,
+        'clients': args.clients,
+        'duration': args.duration,
+    }
+    commit, dirty = git_revision()
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='pcs-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+
+    results = {}
+
+    def report(name, summary):
+        results[name] = summary
+        print(f"{name:45s} p50 {summary['p50_ms'] or 0:9.2f} ms  p99 {summary['p99_ms'] or 0:9.2f} ms  "
+              f"{summary['throughput_per_s'] or 0:9.1f}/s"
+              + (f"  ({summary['errors']} errors)" if summary['errors'] else ''), flush=True)
+
+    try:
+        print(f"Work directory: {work_dir}")
+        app_module = load_backend(work_dir)
+
+        started = time.perf_counter()
+        import database
+        corpus.seed_file_rows(app_module.config.DATABASE_PATH, sizes['rows'], database.FILE_COLUMNS)
+        app_module.db.rebuild_stats()
+        print(f"Seeded {sizes['rows']} file records in {time.perf_counter() - started:.1f}s\n")
+
+        # Request logging would drown the report
+        with contextlib.redirect_stdout(io.StringIO()) as log:
+            def quiet_report(name, summary):
+                with contextlib.redirect_stdout(sys.__stdout__):
+                    report(name, summary)
+                log.seek(0)
+                log.truncate()
+
+            bench_test_client(app_module, sizes, quiet_report)
+            bench_functions(work_dir, sizes, quiet_report)
+
+        if args.server:
+            print()
+            bench_server(work_dir, app_module, sizes, report)
+    finally:
+        if not args.work_dir and not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'sizes': sizes,
+            'server': args.server,
+        },
+        'results': results,
+    }
+    output_path = args.output or f"benchmark-{commit or 'unknown'}{'-dirty' if dirty else ''}.json"
+    with open(output_path, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"\nResults written to {output_path}")
+
+
+def compare(args):
+    """Compare two result files; exit with status 1 if anything regressed"""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.result) as f:
+        result = json.load(f)
+
+    print(f"Baseline: {baseline['meta'].get('commit')}  Result: {result['meta'].get('commit')}")
+    corpus_keys = ('rows', 'uploads', 'requests', 'thumbnails', 'megapixels', 'video_bytes')
+    if any(baseline['meta']['sizes'].get(key) != result['meta']['sizes'].get(key) for key in corpus_keys):
+        print("Warning: the runs used different corpus sizes")
+    print(f"{'scenario':45s} {'p50 ms':>20s} {'p99 ms':>20s} {'per second':>22s}")
+
+    regressions = []
+    for name, new in result['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+
+        columns = []
+        for key, higher_is_worse in (('p50_ms', True), ('p99_ms', True), ('throughput_per_s', False)):
+            if not old.get(key) or new.get(key) is None:
+                columns.append(f"{'-':>20s}")
+                continue
+            change = (new[key] - old[key]) / old[key]
+            worse = change > args.threshold if higher_is_worse else change < -args.threshold
+            if worse:
+                regressions.append((name, key, change))
+            columns.append(f"{old[key]:8.2f} -> {new[key]:8.2f}{'!' if worse else ' '}")
+        print(f"{name:45s} {' '.join(columns)}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regressions beyond {args.threshold:.0%}:")
+        for name, key, change in regressions:
+            print(f"  {name}: {key} {change:+.0%}")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.threshold:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Personal Cloud Storage benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_run = subparsers.add_parser('run', help='Run the benchmarks')
+    parser_run.add_argument('--quick', action='store_true', help='Smaller corpus and fewer iterations')
+    parser_run.add_argument('--rows', type=int, help='Synthetic file records to seed (10000 by default)')
+    parser_run.add_argument('--server', action='store_true',
+                            help='Also load-test a real server started with serve.py')
+    parser_run.add_argument('--clients', type=int, default=16, help='Concurrent clients for --server')
+    parser_run.add_argument('--duration', type=float, default=10, help='Seconds per --server scenario')
+    parser_run.add_argument('--output', help='Result file (benchmark-<commit>.json by default)')
+    parser_run.add_argument('--work-dir', help='Directory for the corpus and database (kept)')
+    parser_run.add_argument('--keep', action='store_true', help='Keep the temporary work directory')
+    parser_run.set_defaults(func=run)
+
+    parser_compare = subparsers.add_parser('compare', help='Compare two result files')
+    parser_compare.add_argument('baseline', help='Result file of the reference commit')
+    parser_compare.add_argument('result', help='Result file to check')
+    parser_compare.add_argument('--threshold', type=float, default=0.15,
+                                help='Relative change counted as a regression (default 0.15)')
+    parser_compare.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Synthetic test data for the benchmarks
+
+Everything is generated from a fixed seed, so two runs (and two commits)
+measure the same inputs.
+"""
+import io
+import random
+import sqlite3
+import struct
+from datetime import datetime, timedelta
+from PIL import Image
+
+# Words used in generated filenames, so searches have realistic hit rates
+WORDS = [
+    'beach', 'birthday', 'wedding', 'holiday', 'sunset', 'family', 'garden',
+    'mountain', 'concert', 'city', 'snow', 'party', 'dog', 'cat', 'trip',
+    'school', 'graduation', 'lake', 'forest', 'market'
+]
+
+
+def make_jpeg(megapixels, seed=0, quality=90):
+    """
+    Generate a photo-like JPEG (noise over a gradient) of about the given size
+
+    Returns:
+        bytes: JPEG data with a 4:3 aspect ratio
+    """
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+
+    random.seed(seed)
+    noise = Image.effect_noise((400, 300), 40 + seed % 40).convert('RGB')
+    gradient = Image.linear_gradient('L').resize((400, 300)).convert('RGB')
+    image = Image.blend(noise, gradient, 0.5).resize((width, height), Image.BILINEAR)
+
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=quality)
+    return output.getvalue()
+
+
+def make_unique(jpeg_data, index):
+    """
+    Make a distinct copy of a JPEG by adding a comment segment after SOI
+
+    Uploads are deduplicated by checksum, so every upload in a benchmark
+    needs its own content; this avoids encoding a new image each time.
+    """
+    comment = f'benchmark {index}'.encode()
+    segment = b'\xff\xfe' + struct.pack('>H', len(comment) + 2) + comment
+    return jpeg_data[:2] + segment + jpeg_data[2:]
+
+
+def box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def full_box(kind, payload, version=0, flags=0):
+    return box(kind, struct.pack('>I', (version << 24) | flags) + payload)
+
+
+def make_mp4(duration=30.0, width=1920, height=1080, codec=b'avc1',
+             media_size=1024 * 1024, moov_at_end=False, seed=0):
+    """
+    Generate an MP4 whose headers describe a video but whose media is noise
+
+    Enough of the ISO BMFF structure is present for header-only probing
+    (mvhd, tkhd, hdlr, stsd); the mdat box holds random bytes.
+
+    Returns:
+        bytes: The file contents
+    """
+    timescale = 1000
+    identity = struct.pack('>9i', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+    mvhd = full_box(b'mvhd', struct.pack('>IIII', 0, 0, timescale, int(duration * timescale))
+                    + struct.pack('>iH10x', 0x10000, 0x100) + identity + bytes(24)
+                    + struct.pack('>I', 2))
+    tkhd = full_box(b'tkhd', struct.pack('>IIIII', 0, 0, 1, 0, int(duration * timescale))
+                    + bytes(8) + struct.pack('>hhhH', 0, 0, 0, 0) + identity
+                    + struct.pack('>II', width << 16, height << 16), flags=3)
+    hdlr = full_box(b'hdlr', struct.pack('>I4s12s', 0, b'vide', bytes(12)) + b'VideoHandler\x00')
+    sample_entry = box(codec, bytes(6) + struct.pack('>H', 1) + bytes(16)
+                       + struct.pack('>HH', width, height) + bytes(50))
+    stsd = full_box(b'stsd', struct.pack('>I', 1) + sample_entry)
+    stbl = box(b'stbl', stsd)
+    minf = box(b'minf', stbl)
+    mdia = box(b'mdia', hdlr + minf)
+    trak = box(b'trak', tkhd + mdia)
+    moov = box(b'moov', mvhd + trak)
+
+    ftyp = box(b'ftyp', b'isom' + struct.pack('>I', 0x200) + b'isomiso2avc1mp41')
+    mdat = box(b'mdat', random.Random(seed).randbytes(media_size))
+    return ftyp + (mdat + moov if moov_at_end else moov + mdat)
+
+
+def seed_file_rows(db_path, count, file_columns, batch_size=10000):
+    """
+    Insert synthetic file records straight into the files table
+
+    The records point at files that do not exist; they are for listing,
+    search and stats benchmarks. Upload dates are spread over five years.
+
+    Args:
+        db_path (str): Path of the server database (already initialised)
+        count (int): Number of rows to add
+        file_columns (tuple): database.FILE_COLUMNS
+        batch_size (int): Rows per transaction
+    """
+    rng = random.Random(42)
+    start = datetime(2020, 1, 1)
+    columns = file_columns + ('upload_date',)
+    sql = (f"INSERT INTO files ({', '.join(columns)}) "
+           f"VALUES ({', '.join('?' * len(columns))})")
+
+    conn = sqlite3.connect(db_path)
+    try:
+        for offset in range(0, count, batch_size):
+            rows = []
+            for index in range(offset, min(offset + batch_size, count)):
+                is_video = rng.random() < 0.2
+                extension = rng.choice(['.mp4', '.mov']) if is_video else rng.choice(['.jpg', '.jpeg', '.png'])
+                name = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}_{index}{extension}"
+                checksum = f'{index:032x}'
+                record = {
+                    'filename': f'{checksum}{extension}',
+                    'original_filename': name,
+                    'file_path': f'/nonexistent/{checksum}{extension}',
+                    'file_size': rng.randint(100_000, 50_000_000),
+                    'file_type': 'video' if is_video else 'image',
+                    'mime_type': 'video/mp4' if is_video else 'image/jpeg',
+                    'created_date': None,
+                    'thumbnail_path': None,
+                    'width': 4000,
+                    'height': 3000,
+                    'duration': rng.randint(1, 600) if is_video else None,
+                    'codec': 'h264' if is_video else None,
+                    'checksum': checksum,
+                    'thumbnail_status': None,
+                    'upload_date': (start + timedelta(seconds=rng.randint(0, 5 * 365 * 86400)))
+                    .strftime('%Y-%m-%d %H:%M:%S'),
+                }
+                rows.append([record.get(column) for column in columns])
+            with conn:
+                conn.executemany(sql, rows)
+    finally:
+        conn.close()
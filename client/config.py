@@ -23,8 +23,58 @@ FILE_EXTENSIONS = {
 
 # Upload settings
 CHECK_INTERVAL = 5  # Seconds between checking for new files
-RETRY_ATTEMPTS = 3  # Number of retry attempts for failed uploads
-RETRY_DELAY = 10  # Seconds to wait before retrying
+RETRY_ATTEMPTS = 5  # Number of retry attempts for failed uploads
+RETRY_DELAY = 10  # Seconds to wait before the first retry; doubles with every failure
+RETRY_MAX_DELAY = 30 * 60  # Longest wait between retries
+
+# New and changed files are uploaded once they stop changing
+FILE_STABLE_SECONDS = 3  # Size and mtime must be unchanged for this long
+STABILITY_POLL_INTERVAL = 1  # Seconds between checks of files still being written
+
+# Parallel uploads
+UPLOAD_WORKERS = 4  # Files uploaded at the same time (also the connection pool size)
+UPLOAD_QUEUE_SIZE = 1000  # Files waiting for a worker before the scanner pauses
+PROGRESS_INTERVAL = 5  # Seconds between progress lines for a file being uploaded
+EXISTS_BATCH_SIZE = 1000  # Checksums sent per "already on server?" request when scanning
+SCAN_HASH_WORKERS = 4  # Threads hashing files during the initial scan
+SCAN_BATCH_DELAY = 2  # Seconds before a partial batch of scanned files is checked and queued
+
+# Order in which queued files are uploaded: policies from scheduler.ORDER_POLICIES
+# ('photos_first', 'smallest_first', 'largest_first', 'newest_first', 'oldest_first'),
+# most important first. An empty list uploads files in the order they were found.
+UPLOAD_ORDER = ['photos_first', 'smallest_first', 'newest_first']
+
+# Upload bandwidth limit in bytes per second (None for no limit)
+BANDWIDTH_LIMIT = None
+# Limits for times of day, overriding BANDWIDTH_LIMIT; the first matching window wins
+# and windows may run past midnight, e.g. 1 MB/s in the evening, no limit at night:
+# BANDWIDTH_SCHEDULE = [('18:00', '23:00', 1024 * 1024), ('23:00', '07:00', None)]
+BANDWIDTH_SCHEDULE = []
+BANDWIDTH_BURST = 256 * 1024  # Bytes that may be sent at once after an idle spell
+
+# Uploads pause when the server returns 5xx, cannot be reached or answers slowly
+BACKOFF_MIN = 2  # Seconds of the first pause; doubles while problems continue
+BACKOFF_MAX = 300  # Longest pause (also caps a 503's Retry-After)
+SLOW_RESPONSE = 30  # Seconds from sending a request body to the answer counted as too slow
+
+# Small files waiting in the queue are sent together in one request
+BATCH_MAX_FILES = 20  # Files per batch request
+BATCH_MAX_SIZE = 32 * 1024 * 1024  # Total bytes per batch request
+BATCH_MAX_FILE_SIZE = 8 * 1024 * 1024  # Larger files are always sent on their own
+
+# Resumable (chunked) uploads for large files
+CHUNKED_UPLOAD_THRESHOLD = 32 * 1024 * 1024  # Files at least this big are sent in chunks
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Preferred chunk size (the server may cap it)
+UPLOAD_SESSIONS_FILE = 'upload_sessions.json'  # Old session file, imported into the state database
+
+# Upload statistics
+METRICS_REPORT_INTERVAL = 60  # Seconds between upload summary lines
+METRICS_FILE = None  # Also write counters here in Prometheus text format (e.g. for node_exporter)
+
+# Local sync state (what has been uploaded, failed uploads to retry)
+STATE_DB_FILE = 'upload_state.db'
+STATE_BATCH_SIZE = 500  # Buffered state changes written per transaction
+STATE_FLUSH_INTERVAL = 5  # Seconds before buffered state changes are written anyway
 
 # Create watch folder if it doesn't exist
 os.makedirs(WATCH_FOLDER, exist_ok=True)
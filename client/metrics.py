@@ -0,0 +1,88 @@
+"""
+Upload counters for the client
+
+Counts files and bytes sent, time spent sending them, duplicates, failures
+and retries. The main loop prints a summary of the last interval, and can
+also write the totals in the Prometheus text format for node_exporter's
+textfile collector (METRICS_FILE).
+"""
+import os
+import threading
+import time
+
+# Counter name -> help text
+COUNTERS = {
+    'files_uploaded': 'Files stored by the server',
+    'bytes_uploaded': 'Bytes of files stored by the server',
+    'upload_seconds': 'Time spent in upload requests',
+    'duplicates': 'Uploads the server already had',
+    'skipped_existing': 'Files found on the server by the existence check and not sent',
+    'failures': 'Failed upload attempts',
+    'retries': 'Failed uploads queued again',
+    'chunk_retries': 'Chunks of resumable uploads sent again',
+    'server_busy': 'Uploads turned away with 503 by a busy server',
+    'backoffs': 'Times uploads were paused for a failing or slow server',
+}
+
+
+class ClientMetrics:
+    """Thread-safe upload counters"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = dict.fromkeys(COUNTERS, 0)
+        self.last_report = dict(self.values)
+        self.last_report_time = time.monotonic()
+
+    def inc(self, name, amount=1):
+        with self.lock:
+            self.values[name] += amount
+
+    def record_upload(self, size, seconds):
+        """Count a file the server stored"""
+        with self.lock:
+            self.values['files_uploaded'] += 1
+            self.values['bytes_uploaded'] += size
+            self.values['upload_seconds'] += seconds
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    def report(self):
+        """Print what happened since the last report (nothing if idle)"""
+        values = self.snapshot()
+        now = time.monotonic()
+        elapsed = now - self.last_report_time
+        delta = {name: values[name] - self.last_report[name] for name in values}
+        self.last_report, self.last_report_time = values, now
+
+        if not any(delta.values()):
+            return
+
+        megabytes = delta['bytes_uploaded'] / (1024 * 1024)
+        line = (f"📈 Last {elapsed:.0f}s: {delta['files_uploaded']} files, "
+                f"{megabytes:.1f} MB ({megabytes / elapsed:.2f} MB/s)")
+        if delta['upload_seconds']:
+            line += f", {megabytes / delta['upload_seconds']:.2f} MB/s while sending"
+        for name, label in (('duplicates', 'duplicates'), ('skipped_existing', 'already on server'),
+                            ('failures', 'failed'), ('retries', 'retried'),
+                            ('server_busy', 'server busy'), ('backoffs', 'backoffs')):
+            if delta[name]:
+                line += f", {delta[name]} {label}"
+        print(line)
+
+    def write_textfile(self, path):
+        """Write the totals in the Prometheus text format, replacing the file atomically"""
+        values = self.snapshot()
+        lines = []
+        for name, documentation in COUNTERS.items():
+            metric = f'pcs_client_{name}_total'
+            lines.append(f'# HELP {metric} {documentation}')
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {values[name]}')
+
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
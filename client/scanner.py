@@ -0,0 +1,149 @@
+"""
+Initial scan of the watch folder
+
+The folder tree is walked with os.scandir, one directory at a time, and
+candidate files are hashed by a small thread pool while the walk goes on.
+Every few seconds the checksums gathered so far are checked against the
+server and the missing files are handed to the upload pool, so uploads
+start almost at once instead of after the whole tree has been read.
+
+Directory mtimes are remembered once every file in a directory is known to
+be uploaded. On later starts such directories are only searched for
+subdirectories: their files are not stat'ed or looked up again. A
+directory's mtime changes when files are added, removed or renamed in it,
+but not when a file is edited in place; the file watcher picks those up
+while the client is running.
+"""
+import hashlib
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import config
+
+
+def get_file_checksum(file_path):
+    """Calculate MD5 checksum of a local file (matches the server's checksum)"""
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class Scanner:
+    """Streams files that still need uploading from a folder into an upload pool"""
+
+    def __init__(self, uploader, file_extensions, pool, hash_workers=config.SCAN_HASH_WORKERS):
+        self.uploader = uploader
+        self.state = uploader.state
+        self.file_extensions = file_extensions
+        self.pool = pool
+        self.hash_workers = hash_workers
+        self.files_found = 0
+        self.new_uploads = 0
+        self.already_stored = 0
+
+    def scan(self, root):
+        """Scan a folder tree, queueing files that are not on the server yet"""
+        print(f"\n🔍 Scanning existing files in: {root}")
+        started = time.monotonic()
+
+        hashing = deque()  # (path, stat, future) in walk order
+        batch = []
+        batch_started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.hash_workers) as executor:
+            for file_path, stat in self.walk(root):
+                hashing.append((file_path, stat, executor.submit(self.hash_file, file_path, stat)))
+
+                # Collect finished hashes; wait once enough are queued ahead
+                while hashing and (hashing[0][2].done() or len(hashing) >= self.hash_workers * 4):
+                    file_path, stat, future = hashing.popleft()
+                    batch.append((file_path, stat, future.result()))
+
+                if batch and (len(batch) >= config.EXISTS_BATCH_SIZE
+                              or time.monotonic() - batch_started >= config.SCAN_BATCH_DELAY):
+                    self.dispatch(batch)
+                    batch = []
+                    batch_started = time.monotonic()
+
+            for file_path, stat, future in hashing:
+                batch.append((file_path, stat, future.result()))
+            self.dispatch(batch)
+
+        self.state.flush()
+
+        print(f"📁 Checked {self.files_found} files in {time.monotonic() - started:.1f}s")
+        if self.already_stored:
+            print(f"⏭️  {self.already_stored} files are already on the server")
+        print(f"✨ Queued {self.new_uploads} new files for upload ({config.UPLOAD_WORKERS} at a time)")
+
+    def walk(self, root):
+        """
+        Yield (path, stat) for every file under root that needs uploading
+
+        Directories are visited depth first without building a list of the
+        whole tree.
+        """
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime = os.stat(directory).st_mtime
+                unchanged = self.state.get_directory_mtime(directory) == mtime
+                complete = True
+
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                        if unchanged:
+                            continue
+                        if os.path.splitext(entry.name)[1].lower() not in self.file_extensions:
+                            continue
+                        if not entry.is_file():
+                            continue
+
+                        self.files_found += 1
+                        stat = entry.stat()
+                        if self.state.is_uploaded(entry.path, stat):
+                            continue
+
+                        complete = False
+                        yield entry.path, stat
+            except OSError as e:
+                print(f"⚠️  Cannot scan {directory}: {e}")
+                continue
+
+            if complete and not unchanged:
+                self.state.set_directory_mtime(directory, mtime)
+
+    def hash_file(self, file_path, stat):
+        """Checksum of a file (reusing a stored one), or None if it cannot be read"""
+        try:
+            return self.state.get_checksum(file_path, stat) or get_file_checksum(file_path)
+        except OSError as e:
+            print(f"⚠️  Cannot read {file_path}: {e}")
+            return None
+
+    def dispatch(self, batch):
+        """Skip files the server already has and queue the rest for upload"""
+        batch = [item for item in batch if item[2] is not None]
+        if not batch:
+            return
+
+        existing = self.uploader.check_existing(sorted({checksum for _, _, checksum in batch}))
+
+        for file_path, stat, checksum in batch:
+            if existing and checksum in existing:
+                self.uploader.mark_uploaded(file_path, stat, checksum, existing[checksum])
+                self.uploader.metrics.inc('skipped_existing')
+                self.already_stored += 1
+                continue
+
+            # Keep the checksum so the upload does not hash the file again
+            self.state.set_checksum(file_path, stat, checksum)
+            if self.pool.submit(file_path):
+                self.new_uploads += 1
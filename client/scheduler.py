@@ -0,0 +1,215 @@
+"""
+Upload scheduling for the client
+
+Decides which file goes next, how fast bytes may leave the machine and when
+to hold back:
+
+- Queued files are ordered by UPLOAD_ORDER (e.g. photos before videos, small
+  files first), so one large video does not hold up hundreds of photos.
+- A token bucket caps upload bandwidth at BANDWIDTH_LIMIT, or at the limit of
+  the BANDWIDTH_SCHEDULE window the local time falls in.
+- When the server answers with a 5xx, cannot be reached or is slow to answer,
+  every upload thread pauses; the pause doubles while problems continue and
+  shrinks again as requests succeed.
+- Failed files are retried after an exponentially growing delay.
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime
+import config
+
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm'}
+
+# Policy name -> sort key for a file (lower keys are uploaded first)
+ORDER_POLICIES = {
+    'photos_first': lambda path, stat: os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS,
+    'smallest_first': lambda path, stat: stat.st_size,
+    'largest_first': lambda path, stat: -stat.st_size,
+    'newest_first': lambda path, stat: -stat.st_mtime,
+    'oldest_first': lambda path, stat: stat.st_mtime,
+}
+
+
+def upload_priority(file_path, order=None):
+    """
+    Sort key placing a file in the upload queue
+
+    Args:
+        file_path (str): Path of the file
+        order (list): Policy names from ORDER_POLICIES, most important first
+            (defaults to config.UPLOAD_ORDER)
+
+    Returns:
+        tuple: Key to compare with other files' keys; files that cannot be
+        read sort last (their upload fails and is retried)
+    """
+    order = config.UPLOAD_ORDER if order is None else order
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return (1,)
+    return (0,) + tuple(ORDER_POLICIES[name](file_path, stat) for name in order)
+
+
+def retry_delay(attempts):
+    """
+    Seconds to wait before retrying after a number of failed attempts
+
+    RETRY_DELAY doubles with every attempt up to RETRY_MAX_DELAY; up to a
+    quarter is added at random so failures that happened together are not
+    all retried at the same moment.
+    """
+    delay = min(config.RETRY_DELAY * 2 ** max(attempts - 1, 0), config.RETRY_MAX_DELAY)
+    return delay * (1 + random.random() / 4)
+
+
+def parse_time(value):
+    """Minutes since midnight of an 'HH:MM' string"""
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def scheduled_limit(now=None, schedule=None, default=None):
+    """
+    Bandwidth limit in effect at a time of day
+
+    Args:
+        now (datetime): Local time (defaults to now)
+        schedule (list): (start 'HH:MM', end 'HH:MM', bytes per second or
+            None for unlimited) windows; a window may run past midnight and
+            the first one that matches wins (defaults to BANDWIDTH_SCHEDULE)
+        default (int): Limit outside every window (defaults to BANDWIDTH_LIMIT)
+
+    Returns:
+        int: Bytes per second, or None for no limit
+    """
+    now = now or datetime.now()
+    schedule = config.BANDWIDTH_SCHEDULE if schedule is None else schedule
+    default = config.BANDWIDTH_LIMIT if default is None else default
+    minute = now.hour * 60 + now.minute
+
+    for start, end, limit in schedule:
+        start, end = parse_time(start), parse_time(end)
+        if start <= minute < end or (end < start and (minute >= start or minute < end)):
+            return limit
+    return default
+
+
+class BandwidthLimiter:
+    """
+    Token bucket shared by all upload threads
+
+    Every byte sent takes a token; tokens come back at the current limit and
+    at most burst of them are saved up. A sender that takes more tokens
+    than are available sleeps until the bucket has refilled.
+    """
+
+    def __init__(self, burst=config.BANDWIDTH_BURST, limit=scheduled_limit):
+        """
+        Args:
+            burst (int): Bucket size in bytes
+            limit (callable): Returns the current limit in bytes per second
+                (None for no limit); called about once a second
+        """
+        self.burst = burst
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.rate = None
+        self.checked = 0
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def current_rate(self):
+        """Limit in bytes per second now in effect, or None"""
+        now = time.monotonic()
+        if now - self.checked >= 1:
+            self.checked = now
+            rate = self.limit()
+            if rate != self.rate:
+                if rate:
+                    print(f"🚦 Upload bandwidth limited to {rate / (1024 * 1024):.2f} MB/s")
+                elif self.rate:
+                    print("🚦 Upload bandwidth limit lifted")
+                self.rate = rate
+        return self.rate
+
+    def consume(self, count):
+        """Take count tokens, sleeping if the limit has been reached"""
+        with self.lock:
+            rate = self.current_rate()
+            now = time.monotonic()
+            if not rate:
+                self.tokens, self.updated = self.burst, now
+                return
+
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            # Tokens may go negative; each sender then waits for its own share
+            self.tokens -= count
+            wait = -self.tokens / rate
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class AdaptiveBackoff:
+    """
+    Pause shared by all upload threads while the server is struggling
+
+    A failure (5xx, no connection, or a response slower than SLOW_RESPONSE)
+    doubles the pause, starting at BACKOFF_MIN and up to BACKOFF_MAX, or
+    uses the server's Retry-After if that is longer. Each success halves it.
+    """
+
+    def __init__(self, minimum=config.BACKOFF_MIN, maximum=config.BACKOFF_MAX,
+                 slow_response=config.SLOW_RESPONSE):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.slow_response = slow_response
+        self.lock = threading.Lock()
+        self.delay = 0
+        self.resume_at = 0
+
+    def wait(self):
+        """Sleep until the current pause is over"""
+        while True:
+            with self.lock:
+                remaining = self.resume_at - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def record(self, status_code=None, latency=0, retry_after=None):
+        """
+        Adjust the pause after a request
+
+        Args:
+            status_code (int): HTTP status, or None if the request failed
+                without a response
+            latency (float): Seconds the server took to answer once the
+                request body was sent
+            retry_after (str): The response's Retry-After header, if any
+
+        Returns:
+            bool: True if the request counted as a failure
+        """
+        failed = status_code is None or status_code >= 500 or latency > self.slow_response
+        with self.lock:
+            if not failed:
+                self.delay = self.delay / 2 if self.delay > self.minimum else 0
+                return False
+
+            self.delay = min(max(self.delay * 2, self.minimum), self.maximum)
+            delay = self.delay
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, min(int(retry_after), self.maximum))
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+
+        if status_code is None or status_code >= 500:
+            reason = 'unreachable' if status_code is None else f'returned {status_code}'
+        else:
+            reason = f'took {latency:.1f}s to answer'
+        print(f"🐢 Server {reason}, pausing uploads for {delay:.0f}s")
+        return True
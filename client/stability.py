@@ -0,0 +1,103 @@
+"""
+Debouncing of file system events
+
+Watchdog delivers a burst of created/modified events while a file is being
+written, and the observer thread must not block while handling them. The
+StabilityTracker only records the path on the observer thread. Its own
+thread polls the recorded files and hands each one to the upload pool once
+its size and mtime have not changed for FILE_STABLE_SECONDS, so a camera
+dump is coalesced into one upload per file and half-written videos are not
+sent early.
+"""
+import os
+import threading
+import time
+import config
+
+
+class StabilityTracker:
+    """Waits for changed files to stop changing, then queues them for upload"""
+
+    def __init__(self, uploader, pool, settle_time=config.FILE_STABLE_SECONDS,
+                 poll_interval=config.STABILITY_POLL_INTERVAL):
+        self.uploader = uploader
+        self.pool = pool
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.watching = {}  # path -> [size, mtime, time of last change]
+        self.moves = []  # (old path, new path) not yet applied to the state store
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start the polling thread"""
+        self.thread = threading.Thread(target=self.run, name='stability', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop polling; files still settling are picked up by the next scan"""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def touch(self, path):
+        """A file was created or modified: (re)start waiting for it to settle"""
+        with self.lock:
+            self.watching[path] = [None, None, time.monotonic()]
+
+    def forget(self, path):
+        """A file was deleted or moved away"""
+        with self.lock:
+            self.watching.pop(path, None)
+
+    def moved(self, src_path, dest_path):
+        """A file was renamed; carry its upload state over to the new path"""
+        with self.lock:
+            self.watching.pop(src_path, None)
+            self.moves.append((src_path, dest_path))
+            self.watching[dest_path] = [None, None, time.monotonic()]
+
+    def run(self):
+        """Polling loop"""
+        while not self.stopping.wait(self.poll_interval):
+            with self.lock:
+                moves, self.moves = self.moves, []
+            for src_path, dest_path in moves:
+                self.uploader.state.move(src_path, dest_path)
+
+            for path in self.poll():
+                self.pool.submit(path)
+
+    def poll(self):
+        """
+        Check every watched file once
+
+        Returns:
+            list: Paths that have been stable for the settle time
+        """
+        now = time.monotonic()
+        with self.lock:
+            watching = list(self.watching.items())
+
+        ready = []
+        for path, (size, mtime, changed) in watching:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Deleted, or a temporary file that was renamed
+                self.forget(path)
+                continue
+
+            with self.lock:
+                entry = self.watching.get(path)
+                if entry is None or entry[2] != changed:
+                    continue  # A newer event arrived meanwhile
+
+                if (stat.st_size, stat.st_mtime) != (size, mtime):
+                    self.watching[path] = [stat.st_size, stat.st_mtime, now]
+                elif now - changed >= self.settle_time:
+                    del self.watching[path]
+                    ready.append(path)
+        return ready
@@ -0,0 +1,328 @@
+"""
+Local sync state for the client
+
+An SQLite database records, per local path, the size and mtime last seen,
+the content checksum, the server's file ID and the retry state of failed
+uploads. Lookups go through the primary key, so startup does not read the
+upload history and memory use does not grow with it. Routine writes are
+buffered and committed in batches; upload session records, which are needed
+to resume after a crash, are written immediately.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import config
+from scheduler import retry_delay
+
+
+class StateStore:
+    """Indexed, thread-safe record of what has been uploaded"""
+
+    def __init__(self, path=config.STATE_DB_FILE):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.lock = threading.RLock()
+        self.pending = {}  # path -> row waiting to be written
+        self.pending_directories = {}  # directory -> mtime waiting to be written
+        self.last_flush = time.monotonic()
+        self.init_db()
+
+    def init_db(self):
+        """Create tables and indexes"""
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime REAL,
+                    checksum TEXT,
+                    file_id INTEGER,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_retry REAL,
+                    last_error TEXT,
+                    updated_at REAL
+                )
+            ''')
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_files_status_next_retry
+                ON files(status, next_retry)
+            ''')
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_files_checksum
+                ON files(checksum)
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS directories (
+                    path TEXT PRIMARY KEY,
+                    mtime REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS upload_sessions (
+                    path TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL
+                )
+            ''')
+
+    def get(self, path):
+        """
+        Get the recorded state of a path
+
+        Returns:
+            dict: Row for the path, or None if it has never been seen
+        """
+        with self.lock:
+            if path in self.pending:
+                return dict(self.pending[path])
+            row = self.conn.execute('SELECT * FROM files WHERE path = ?', (path,)).fetchone()
+        return dict(row) if row else None
+
+    def is_uploaded(self, path, stat=None):
+        """
+        Check whether a path was uploaded and has not changed since
+
+        Args:
+            path (str): Local file path
+            stat (os.stat_result): Current stat of the file (looked up if None)
+        """
+        row = self.get(path)
+        if row is None or row['status'] != 'uploaded':
+            return False
+        if row['size'] is None:
+            # Migrated from the old log without a stat; trust the path
+            return True
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return True
+        return row['size'] == stat.st_size and row['mtime'] == stat.st_mtime
+
+    def get_checksum(self, path, stat):
+        """Recorded checksum of a path, if the file has not changed since"""
+        row = self.get(path)
+        if row and row['checksum'] and row['size'] == stat.st_size and row['mtime'] == stat.st_mtime:
+            return row['checksum']
+        return None
+
+    def find_uploaded(self, checksum):
+        """
+        Find an uploaded file with the given content
+
+        Returns:
+            dict: Row of a path with that checksum, or None
+        """
+        with self.lock:
+            for row in self.pending.values():
+                if row['checksum'] == checksum and row['status'] == 'uploaded':
+                    return dict(row)
+            row = self.conn.execute('''
+                SELECT * FROM files
+                WHERE checksum = ? AND status = 'uploaded'
+                LIMIT 1
+            ''', (checksum,)).fetchone()
+        return dict(row) if row else None
+
+    def set_checksum(self, path, stat, checksum):
+        """Remember the checksum of a file that is about to be uploaded"""
+        with self.lock:
+            row = self.get(path) or {'path': path, 'file_id': None, 'status': 'pending',
+                                     'attempts': 0, 'next_retry': None, 'last_error': None}
+            row.update(size=stat.st_size, mtime=stat.st_mtime, checksum=checksum)
+            if row['status'] == 'uploaded':
+                row['status'] = 'pending'  # Changed since it was uploaded
+            self.put(row)
+
+    def mark_uploaded(self, path, stat=None, checksum=None, file_id=None):
+        """Record a successful upload (or content found on the server)"""
+        with self.lock:
+            row = self.get(path) or {'path': path, 'checksum': None}
+            if checksum is None and stat is not None and (
+                    row.get('size') != stat.st_size or row.get('mtime') != stat.st_mtime):
+                row['checksum'] = None  # Checksum of an older version
+            row.update(
+                size=stat.st_size if stat else None,
+                mtime=stat.st_mtime if stat else None,
+                checksum=checksum or row['checksum'],
+                file_id=file_id,
+                status='uploaded',
+                attempts=0,
+                next_retry=None,
+                last_error=None
+            )
+            self.put(row)
+
+    def record_failure(self, path, error=None):
+        """
+        Count a failed upload and schedule the next attempt
+
+        Returns:
+            int: Number of failed attempts so far
+        """
+        with self.lock:
+            row = self.get(path) or {'path': path, 'size': None, 'mtime': None,
+                                     'checksum': None, 'file_id': None, 'attempts': 0}
+            attempts = row['attempts'] + 1
+            row.update(
+                status='failed',
+                attempts=attempts,
+                next_retry=time.time() + retry_delay(attempts),
+                last_error=error
+            )
+            self.put(row)
+        return attempts
+
+    def due_retries(self, max_attempts):
+        """Paths of failed uploads that are due for another attempt"""
+        self.flush()
+        with self.lock:
+            rows = self.conn.execute('''
+                SELECT path FROM files
+                WHERE status = 'failed' AND next_retry <= ? AND attempts < ?
+                ORDER BY next_retry
+            ''', (time.time(), max_attempts)).fetchall()
+        return [row['path'] for row in rows]
+
+    def move(self, src_path, dest_path):
+        """Carry the state of a renamed file over to its new path"""
+        with self.lock:
+            if self.get(src_path) is None:
+                return
+            self.flush()
+            with self.conn:
+                self.conn.execute(
+                    'UPDATE OR REPLACE files SET path = ? WHERE path = ?',
+                    (dest_path, src_path)
+                )
+
+    def get_directory_mtime(self, path):
+        """mtime of a directory when all its files were last known to be uploaded"""
+        with self.lock:
+            if path in self.pending_directories:
+                return self.pending_directories[path]
+            row = self.conn.execute(
+                'SELECT mtime FROM directories WHERE path = ?', (path,)
+            ).fetchone()
+        return row['mtime'] if row else None
+
+    def set_directory_mtime(self, path, mtime):
+        """Record that every file in a directory with this mtime is uploaded"""
+        with self.lock:
+            self.pending_directories[path] = mtime
+            self.flush_if_due()
+
+    def put(self, row):
+        """Buffer a row for the next batched write"""
+        row['updated_at'] = time.time()
+        self.pending[row['path']] = row
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """Write buffered changes once the batch is full or old enough"""
+        if (len(self.pending) + len(self.pending_directories) >= config.STATE_BATCH_SIZE
+                or time.monotonic() - self.last_flush >= config.STATE_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows in one transaction"""
+        with self.lock:
+            self.last_flush = time.monotonic()
+            if not self.pending and not self.pending_directories:
+                return
+            rows = list(self.pending.values())
+            with self.conn:
+                self.conn.executemany('''
+                    INSERT OR REPLACE INTO directories (path, mtime) VALUES (?, ?)
+                ''', self.pending_directories.items())
+                self.conn.executemany('''
+                    INSERT OR REPLACE INTO files (
+                        path, size, mtime, checksum, file_id, status,
+                        attempts, next_retry, last_error, updated_at
+                    ) VALUES (
+                        :path, :size, :mtime, :checksum, :file_id, :status,
+                        :attempts, :next_retry, :last_error, :updated_at
+                    )
+                ''', rows)
+            self.pending.clear()
+            self.pending_directories.clear()
+
+    def get_session(self, path):
+        """Saved chunked upload session for a path, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT * FROM upload_sessions WHERE path = ?', (path,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def save_session(self, path, session_id, size, mtime):
+        """Remember a chunked upload session so it can be resumed"""
+        with self.lock, self.conn:
+            self.conn.execute('''
+                INSERT OR REPLACE INTO upload_sessions (path, session_id, size, mtime)
+                VALUES (?, ?, ?, ?)
+            ''', (path, session_id, size, mtime))
+
+    def delete_session(self, path):
+        """Forget a finished or abandoned upload session"""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM upload_sessions WHERE path = ?', (path,))
+
+    def migrate_legacy_files(self, log_file, sessions_file):
+        """
+        Import the old uploaded_files.log and upload sessions JSON
+
+        Each file is renamed with a .migrated suffix afterwards, so this only
+        happens once.
+        """
+        if os.path.exists(log_file):
+            count = 0
+            with open(log_file, 'r') as f:
+                batch = []
+                for line in f:
+                    path = line.strip()
+                    if not path:
+                        continue
+                    try:
+                        stat = os.stat(path)
+                        size, mtime = stat.st_size, stat.st_mtime
+                    except OSError:
+                        size, mtime = None, None
+                    batch.append((path, size, mtime, time.time()))
+                    if len(batch) >= 10000:
+                        count += self.import_uploaded(batch)
+                        batch = []
+                count += self.import_uploaded(batch)
+            os.replace(log_file, f"{log_file}.migrated")
+            print(f"📦 Imported {count} uploaded files from {log_file}")
+
+        if os.path.exists(sessions_file):
+            try:
+                with open(sessions_file, 'r') as f:
+                    sessions = json.load(f)
+            except (OSError, ValueError):
+                sessions = {}
+            for path, session in sessions.items():
+                self.save_session(path, session['session_id'], session['size'], session['mtime'])
+            os.replace(sessions_file, f"{sessions_file}.migrated")
+
+    def import_uploaded(self, batch):
+        """Insert (path, size, mtime, updated_at) rows as uploaded files"""
+        with self.lock, self.conn:
+            self.conn.executemany('''
+                INSERT OR IGNORE INTO files (path, size, mtime, status, updated_at)
+                VALUES (?, ?, ?, 'uploaded', ?)
+            ''', batch)
+        return len(batch)
+
+    def close(self):
+        """Write buffered rows and close the database"""
+        self.flush()
+        with self.lock:
+            self.conn.close()
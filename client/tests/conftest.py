@@ -0,0 +1,12 @@
+"""
+Test setup: make the client modules importable without touching the real home folder
+
+config creates WATCH_FOLDER under the home directory when imported, so HOME
+points at a temporary folder first.
+"""
+import os
+import sys
+import tempfile
+
+os.environ['HOME'] = tempfile.mkdtemp(prefix='pcs-client-tests-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,105 @@
+"""Initial scan of the watch folder"""
+import os
+import pytest
+import scanner
+from metrics import ClientMetrics
+from scanner import Scanner, get_file_checksum
+from state import StateStore
+
+
+class FakeUploader:
+    """Knows the checksums the server has; records what it is told"""
+
+    def __init__(self, state, server_checksums=()):
+        self.state = state
+        self.server_checksums = set(server_checksums)
+        self.checked = []
+        self.metrics = ClientMetrics()
+
+    def check_existing(self, checksums):
+        self.checked.extend(checksums)
+        return {checksum: 1 for checksum in checksums if checksum in self.server_checksums}
+
+    def mark_uploaded(self, file_path, stat=None, checksum=None, file_id=None):
+        self.state.mark_uploaded(file_path, stat, checksum, file_id)
+
+
+class FakePool:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, file_path):
+        self.submitted.append(file_path)
+        return True
+
+
+@pytest.fixture
+def state(tmp_path):
+    state = StateStore(str(tmp_path / 'state.db'))
+    yield state
+    state.close()
+
+
+@pytest.fixture
+def folder(tmp_path):
+    root = tmp_path / 'photos'
+    (root / 'old').mkdir(parents=True)
+    (root / 'old' / 'a.jpg').write_bytes(b'a')
+    (root / 'old' / 'b.jpg').write_bytes(b'b')
+    (root / 'old' / 'notes.txt').write_bytes(b'n')
+    return root
+
+
+def scan(state, root, server_checksums=()):
+    uploader = FakeUploader(state, server_checksums)
+    pool = FakePool()
+    Scanner(uploader, {'.jpg'}, pool, hash_workers=2).scan(str(root))
+    return uploader, pool
+
+
+def test_new_files_are_queued_and_known_files_skipped(state, folder):
+    known = get_file_checksum(str(folder / 'old' / 'a.jpg'))
+
+    uploader, pool = scan(state, folder, server_checksums={known})
+
+    assert pool.submitted == [str(folder / 'old' / 'b.jpg')]
+    assert state.is_uploaded(str(folder / 'old' / 'a.jpg'))
+    assert uploader.metrics.snapshot()['skipped_existing'] == 1
+
+
+def test_unchanged_directory_is_not_read_again(state, folder, monkeypatch):
+    for name in ('a.jpg', 'b.jpg'):
+        path = str(folder / 'old' / name)
+        state.mark_uploaded(path, os.stat(path), None, 1)
+
+    # First scan: everything is uploaded, so the directory mtime is recorded
+    scan(state, folder)
+    assert state.get_directory_mtime(str(folder / 'old')) == os.stat(folder / 'old').st_mtime
+
+    looked_up = []
+    monkeypatch.setattr(state, 'is_uploaded', lambda path, stat=None: looked_up.append(path))
+    (folder / 'new').mkdir()
+    (folder / 'new' / 'c.jpg').write_bytes(b'c')
+
+    uploader, pool = scan(state, folder)
+
+    # Only the new directory's file was looked at, and subdirectories are still walked
+    assert looked_up == [str(folder / 'new' / 'c.jpg')]
+    assert pool.submitted == [str(folder / 'new' / 'c.jpg')]
+
+
+def test_directory_with_pending_files_is_scanned_again(state, folder):
+    scan(state, folder)
+
+    assert state.get_directory_mtime(str(folder / 'old')) is None
+
+
+def test_unreadable_file_is_skipped(state, folder, monkeypatch):
+    def unreadable(file_path):
+        raise PermissionError('denied')
+    monkeypatch.setattr(scanner, 'get_file_checksum', unreadable)
+
+    uploader, pool = scan(state, folder)
+
+    assert pool.submitted == []
+    assert uploader.checked == []
@@ -0,0 +1,74 @@
+"""Upload ordering, bandwidth limits, backoff and retry delays"""
+import time
+from datetime import datetime
+import pytest
+import config
+import scheduler
+
+SCHEDULE = [('18:00', '23:00', 1000), ('23:00', '07:00', None)]
+
+
+@pytest.mark.parametrize('hour, minute, expected', [
+    (19, 0, 1000),
+    (23, 0, None),
+    (3, 30, None),
+    (7, 0, 5),
+    (12, 0, 5),
+])
+def test_scheduled_limit(hour, minute, expected):
+    now = datetime(2026, 1, 1, hour, minute)
+    assert scheduler.scheduled_limit(now, SCHEDULE, 5) == expected
+
+
+def test_retry_delay_doubles_up_to_the_maximum(monkeypatch):
+    monkeypatch.setattr(config, 'RETRY_DELAY', 10)
+    monkeypatch.setattr(config, 'RETRY_MAX_DELAY', 100)
+    for attempts, base in [(1, 10), (2, 20), (3, 40), (4, 80), (5, 100), (9, 100)]:
+        assert base <= scheduler.retry_delay(attempts) <= base * 1.25
+
+
+def test_unreadable_files_sort_last(tmp_path):
+    path = tmp_path / 'a.jpg'
+    path.write_bytes(b'x')
+    assert scheduler.upload_priority(str(path)) < scheduler.upload_priority(str(tmp_path / 'missing.jpg'))
+
+
+def test_bandwidth_limiter_paces_senders():
+    limiter = scheduler.BandwidthLimiter(burst=1000, limit=lambda: 100000)
+    started = time.monotonic()
+    for _ in range(21):
+        limiter.consume(1000)
+    # 20 KB beyond the burst at 100 KB/s
+    assert 0.15 <= time.monotonic() - started < 1
+
+
+def test_unlimited_bandwidth_does_not_wait():
+    limiter = scheduler.BandwidthLimiter(burst=1000, limit=lambda: None)
+    started = time.monotonic()
+    limiter.consume(10 ** 9)
+    assert time.monotonic() - started < 0.1
+
+
+def test_backoff_grows_on_failures_and_shrinks_on_success():
+    backoff = scheduler.AdaptiveBackoff(minimum=2, maximum=10, slow_response=5)
+    assert not backoff.record(200, latency=1)
+    assert backoff.delay == 0
+
+    assert backoff.record(500)
+    assert backoff.record(None)
+    assert backoff.record(200, latency=6)
+    assert backoff.delay == 8
+    assert backoff.record(503)
+    assert backoff.delay == 10
+
+    backoff.record(200)
+    assert backoff.delay == 5
+    for _ in range(3):
+        backoff.record(200)
+    assert backoff.delay == 0
+
+
+def test_backoff_honours_retry_after():
+    backoff = scheduler.AdaptiveBackoff(minimum=1, maximum=30, slow_response=5)
+    backoff.record(503, retry_after='20')
+    assert backoff.resume_at - time.monotonic() > 15
@@ -0,0 +1,85 @@
+"""Debouncing of watcher events until files stop changing"""
+import pytest
+import stability
+from stability import StabilityTracker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(stability, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def tracker(clock):
+    return StabilityTracker(uploader=None, pool=None, settle_time=3, poll_interval=1)
+
+
+def test_file_is_ready_once_it_stops_changing(tmp_path, clock, tracker):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(b'x')
+    tracker.touch(str(path))
+
+    assert tracker.poll() == []  # First look records size and mtime
+    clock.now += 2
+    path.write_bytes(b'xx')  # Still being written
+    assert tracker.poll() == []
+    clock.now += 2
+    assert tracker.poll() == []  # Only 2s since the last change
+    clock.now += 1
+    assert tracker.poll() == [str(path)]
+    assert tracker.watching == {}
+
+
+def test_burst_of_events_is_one_upload(tmp_path, clock, tracker):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(b'x')
+    for _ in range(5):
+        tracker.touch(str(path))
+        clock.now += 1
+
+    tracker.poll()
+    clock.now += 3
+    assert tracker.poll() == [str(path)]
+    clock.now += 3
+    assert tracker.poll() == []
+
+
+def test_new_event_restarts_the_wait(tmp_path, clock, tracker):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(b'x')
+    tracker.touch(str(path))
+    tracker.poll()
+    clock.now += 2
+    tracker.touch(str(path))
+    clock.now += 2
+
+    assert tracker.poll() == []
+
+
+def test_deleted_file_is_forgotten(tmp_path, clock, tracker):
+    tracker.touch(str(tmp_path / 'temp.jpg'))
+
+    assert tracker.poll() == []
+    assert tracker.watching == {}
+
+
+def test_renamed_file_settles_under_its_new_name(tmp_path, clock, tracker):
+    path = tmp_path / 'final.jpg'
+    path.write_bytes(b'x')
+    tracker.touch(str(tmp_path / 'partial.tmp'))
+    tracker.moved(str(tmp_path / 'partial.tmp'), str(path))
+
+    tracker.poll()
+    clock.now += 3
+    assert tracker.poll() == [str(path)]
+    assert tracker.moves == [(str(tmp_path / 'partial.tmp'), str(path))]
@@ -0,0 +1,73 @@
+"""Client sync state and the import of the old log and session files"""
+import json
+import os
+import pytest
+from state import StateStore
+
+
+@pytest.fixture
+def state(tmp_path):
+    state = StateStore(str(tmp_path / 'state.db'))
+    yield state
+    state.close()
+
+
+def test_legacy_files_are_imported_once(tmp_path, state):
+    photo = tmp_path / 'photo.jpg'
+    photo.write_bytes(b'x' * 10)
+    gone = str(tmp_path / 'deleted.jpg')
+    log_file = tmp_path / 'uploaded_files.log'
+    log_file.write_text(f'{photo}\n\n{gone}\n')
+    sessions_file = tmp_path / 'upload_sessions.json'
+    sessions_file.write_text(json.dumps({
+        str(photo): {'session_id': 'abc', 'size': 10, 'mtime': 1.5},
+    }))
+
+    state.migrate_legacy_files(str(log_file), str(sessions_file))
+
+    assert state.is_uploaded(str(photo))
+    assert state.get(str(photo))['size'] == 10
+    # Paths that no longer exist are still remembered, without a stat
+    assert state.is_uploaded(gone)
+    assert state.get(gone)['size'] is None
+    assert state.get_session(str(photo)) == {
+        'path': str(photo), 'session_id': 'abc', 'size': 10, 'mtime': 1.5}
+    assert not log_file.exists() and os.path.exists(f'{log_file}.migrated')
+    assert not sessions_file.exists() and os.path.exists(f'{sessions_file}.migrated')
+
+    # A second run finds nothing left to import
+    state.migrate_legacy_files(str(log_file), str(sessions_file))
+    assert state.get_session(str(photo))['session_id'] == 'abc'
+
+
+def test_unreadable_sessions_file_is_skipped(tmp_path, state):
+    sessions_file = tmp_path / 'upload_sessions.json'
+    sessions_file.write_text('{not json')
+
+    state.migrate_legacy_files(str(tmp_path / 'missing.log'), str(sessions_file))
+
+    assert os.path.exists(f'{sessions_file}.migrated')
+
+
+def test_changed_file_is_not_uploaded(tmp_path, state):
+    path = tmp_path / 'a.jpg'
+    path.write_bytes(b'one')
+    state.mark_uploaded(str(path), os.stat(path), 'c1', 7)
+    assert state.is_uploaded(str(path))
+
+    path.write_bytes(b'three')
+    assert not state.is_uploaded(str(path))
+
+
+def test_buffered_rows_survive_close(tmp_path):
+    path = str(tmp_path / 'state.db')
+    state = StateStore(path)
+    state.record_failure('/photos/a.jpg', 'timeout')
+    state.close()
+
+    reopened = StateStore(path)
+    try:
+        row = reopened.get('/photos/a.jpg')
+        assert (row['status'], row['attempts'], row['last_error']) == ('failed', 1, 'timeout')
+    finally:
+        reopened.close()
@@ -0,0 +1,191 @@
+"""Upload pool and streamed multipart bodies"""
+import threading
+import config
+import uploader
+from transfer import STOP, MultipartFileStream, UploadPool
+
+
+class FakeUploader:
+    """Records the batches it is asked to upload; blocks until released"""
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size
+        self.batches = []
+        self.failures = []
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+
+    @property
+    def uploads(self):
+        return [path for batch in self.batches for path in batch]
+
+    def get_batchable_size(self, file_path):
+        return self.batch_size
+
+    def upload_files(self, batch):
+        self.started.set()
+        self.release.wait()
+        self.batches.append(list(batch))
+        return []
+
+    def record_failure(self, file_path, error=None):
+        self.failures.append(file_path)
+
+
+def make_files(tmp_path, sizes):
+    paths = []
+    for name, size in sizes:
+        path = tmp_path / name
+        path.write_bytes(b'x' * size)
+        paths.append(str(path))
+    return paths
+
+
+def test_duplicate_submissions_are_ignored(tmp_path):
+    path, = make_files(tmp_path, [('a.jpg', 10)])
+    fake = FakeUploader()
+    fake.release.clear()
+    pool = UploadPool(fake, workers=1)
+    assert pool.submit(path)
+    assert not pool.submit(path)
+    pool.start()
+    fake.release.set()
+    pool.stop()
+    assert fake.uploads == [path]
+
+
+def test_files_are_taken_in_priority_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'UPLOAD_ORDER', ['photos_first', 'smallest_first'])
+    blocker, video, big, small = make_files(tmp_path, [
+        ('blocker.jpg', 1), ('video.mp4', 10), ('big.jpg', 5000), ('small.jpg', 100)])
+    fake = FakeUploader()
+    fake.release.clear()
+    pool = UploadPool(fake, workers=1)
+    pool.start()
+
+    pool.submit(blocker)
+    fake.started.wait(5)
+    for path in (video, big, small):
+        pool.submit(path)
+    fake.release.set()
+    pool.join()
+    pool.stop()
+
+    assert fake.uploads == [blocker, small, big, video]
+
+
+def test_stop_finishes_queued_files(tmp_path):
+    paths = make_files(tmp_path, [(f'{i}.jpg', 10) for i in range(6)])
+    fake = FakeUploader()
+    pool = UploadPool(fake, workers=2)
+    pool.start()
+    for path in paths:
+        pool.submit(path)
+    pool.stop()
+    assert sorted(fake.uploads) == sorted(paths)
+    assert pool.queued == set()
+    assert pool.threads == []
+
+
+def test_stop_can_discard_files_not_started(tmp_path):
+    paths = make_files(tmp_path, [(f'{i}.jpg', 10) for i in range(6)])
+    fake = FakeUploader()
+    fake.release.clear()
+    pool = UploadPool(fake, workers=1)
+    pool.start()
+    for path in paths:
+        pool.submit(path)
+    fake.started.wait(5)
+
+    threading.Timer(0.2, fake.release.set).start()
+    pool.stop(discard_queued=True)
+
+    # Only the upload already in progress ran, and it ran to completion
+    assert len(fake.uploads) == 1
+    assert pool.queued == set()
+
+
+def test_small_queued_files_are_batched(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'BATCH_MAX_FILES', 3)
+    paths = make_files(tmp_path, [(f'{i}.jpg', 10) for i in range(5)])
+    fake = FakeUploader(batch_size=10)
+    pool = UploadPool(fake, workers=1)
+    for path in paths:
+        pool.submit(path)
+    pool.start()
+    pool.stop()
+
+    assert [len(batch) for batch in fake.batches] == [3, 2]
+    assert sorted(fake.uploads) == sorted(paths)
+
+
+def test_stop_is_not_lost_while_batching(tmp_path):
+    # A stop entry taken while filling a batch must still stop the thread
+    paths = make_files(tmp_path, [('a.jpg', 10), ('b.jpg', 10)])
+    fake = FakeUploader(batch_size=10)
+    pool = UploadPool(fake, workers=1)
+    for path in paths:
+        pool.submit(path)
+    pool.queue.put(STOP)
+    pool.start()
+    pool.threads[0].join(5)
+
+    assert not pool.threads[0].is_alive()
+    assert [sorted(batch) for batch in fake.batches] == [sorted(paths)]
+
+
+def test_main_stops_the_pool_before_closing_the_state(monkeypatch):
+    events = []
+
+    class FakeState:
+        def flush(self):
+            events.append('flush')
+
+        def close(self):
+            events.append('state.close')
+
+    class FakeFileUploader:
+        def __init__(self, *args):
+            self.state = FakeState()
+
+    class FakePool:
+        def __init__(self, uploader):
+            pass
+
+        def start(self):
+            events.append('pool.start')
+
+        def stop(self, discard_queued=False):
+            events.append('pool.stop')
+
+    def interrupted_scan(*args):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(uploader.requests, 'get', lambda *args, **kwargs: None)
+    monkeypatch.setattr(uploader, 'FileUploader', FakeFileUploader)
+    monkeypatch.setattr(uploader, 'UploadPool', FakePool)
+    monkeypatch.setattr(uploader, 'scan_existing_files', interrupted_scan)
+    monkeypatch.setattr(uploader, 'report_metrics', lambda uploader: events.append('report'))
+
+    uploader.main()
+
+    assert events.index('pool.stop') < events.index('report') < events.index('state.close')
+
+
+def test_multipart_stream_matches_its_length(tmp_path):
+    first, second = make_files(tmp_path, [('a.jpg', 5000), ('b"c.jpg', 3)])
+
+    with MultipartFileStream([('files', first), ('files', second)]) as body:
+        data = b''
+        while True:
+            chunk = body.read(1000)
+            if not chunk:
+                break
+            data += chunk
+
+    assert len(data) == len(body)
+    assert data.startswith(f'--{body.boundary}\r\n'.encode())
+    assert data.endswith(f'--{body.boundary}--\r\n'.encode())
+    assert b'filename="b%22c.jpg"' in data
+    assert b'x' * 5000 in data
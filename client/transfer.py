@@ -0,0 +1,288 @@
+"""
+Upload transport for the client
+
+A shared HTTP session with connection pooling (so uploads reuse TCP/TLS
+connections through the tunnel), a multipart body that streams files from
+disk instead of loading them into memory, per-file progress reporting and
+a bounded pool of upload threads that takes files in priority order (see
+scheduler.py).
+"""
+import io
+import os
+import queue
+import threading
+import time
+import uuid
+from itertools import count
+import requests
+from requests.adapters import HTTPAdapter
+import config
+from scheduler import upload_priority
+
+
+def create_session(pool_size):
+    """Create an HTTP session that keeps up to pool_size connections alive"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def format_rate(bytes_per_second):
+    """Format a transfer rate for display"""
+    return f"{bytes_per_second / (1024 * 1024):.2f} MB/s"
+
+
+class TransferProgress:
+    """Tracks bytes sent for one file and prints progress periodically"""
+
+    def __init__(self, name, total):
+        self.name = name
+        self.total = total
+        self.sent = 0
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def update(self, count):
+        """Record count more bytes sent"""
+        self.sent += count
+        now = time.monotonic()
+        if now - self.last_report >= config.PROGRESS_INTERVAL and self.total:
+            self.last_report = now
+            percent = min(100, self.sent * 100 // self.total)
+            print(f"   ⏫ {self.name}: {percent}% ({format_rate(self.rate())})")
+
+    def elapsed(self):
+        """Seconds since the transfer started"""
+        return max(time.monotonic() - self.started, 1e-6)
+
+    def rate(self):
+        """Average throughput in bytes per second"""
+        return self.sent / self.elapsed()
+
+    def summary(self):
+        """One-line description of the finished transfer"""
+        return f"{self.sent / (1024 * 1024):.1f} MB in {self.elapsed():.1f}s, {format_rate(self.rate())}"
+
+
+class RequestBody:
+    """
+    Request body read in pieces through a bandwidth limiter
+
+    Has a length, so requests sends a Content-Length header instead of
+    chunked encoding. Remembers when the last byte was read, so the time
+    the server takes to answer can be told apart from the upload time.
+    """
+
+    def __init__(self, stream, length, progress=None, limiter=None):
+        """
+        Args:
+            stream: Binary file object holding the body
+            length (int): Size of the body in bytes
+            progress (TransferProgress): Optional progress tracker
+            limiter (BandwidthLimiter): Optional bandwidth limit
+        """
+        self.stream = stream
+        self.length = length
+        self.progress = progress
+        self.limiter = limiter
+        self.finished = None
+
+    def __len__(self):
+        return self.length
+
+    def read_body(self, size):
+        return self.stream.read(size)
+
+    def read(self, size=-1):
+        """Read the next bytes of the body"""
+        data = self.read_body(size)
+        if not data:
+            self.finished = time.monotonic()
+            return data
+
+        if self.limiter is not None:
+            self.limiter.consume(len(data))
+        if self.progress is not None:
+            self.progress.update(len(data))
+        return data
+
+    def response_latency(self):
+        """Seconds since the whole body was sent (0 if it was not)"""
+        return time.monotonic() - self.finished if self.finished is not None else 0
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MultipartFileStream(RequestBody):
+    """multipart/form-data request body that streams files from disk"""
+
+    def __init__(self, files, progress=None, limiter=None):
+        """
+        Args:
+            files (list): (field name, file path) pairs
+            progress (TransferProgress): Optional progress tracker
+            limiter (BandwidthLimiter): Optional bandwidth limit
+        """
+        super().__init__(None, 0, progress, limiter)
+        self.boundary = uuid.uuid4().hex
+        self.parts = []
+        self.length = 0
+
+        for field_name, file_path in files:
+            filename = os.path.basename(file_path).replace('"', '%22')
+            header = (
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n'
+            ).encode('utf-8')
+            self.parts.append(io.BytesIO(header))
+            self.parts.append(open(file_path, 'rb'))
+            self.parts.append(io.BytesIO(b'\r\n'))
+            self.length += len(header) + os.path.getsize(file_path) + 2
+
+        closing = f'--{self.boundary}--\r\n'.encode()
+        self.parts.append(io.BytesIO(closing))
+        self.length += len(closing)
+        self.current = 0
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def read_body(self, size):
+        chunks = []
+        while self.current < len(self.parts) and size != 0:
+            data = self.parts[self.current].read(size)
+            if not data:
+                self.current += 1
+                continue
+            chunks.append(data)
+            if size > 0:
+                size -= len(data)
+
+        return b''.join(chunks)
+
+    def close(self):
+        for part in self.parts:
+            part.close()
+
+
+# Queue entry that stops an upload thread; sorts after every file
+STOP = ((2,), 0, None)
+
+
+class UploadPool:
+    """
+    Bounded pool of upload threads fed by a priority queue
+
+    Files are taken in UPLOAD_ORDER (see scheduler.upload_priority), and in
+    the order they were queued when their keys are equal.
+    """
+
+    def __init__(self, uploader, workers=config.UPLOAD_WORKERS,
+                 queue_size=config.UPLOAD_QUEUE_SIZE):
+        self.uploader = uploader
+        self.workers = workers
+        self.queue = queue.PriorityQueue(maxsize=queue_size)
+        self.sequence = count()
+        self.threads = []
+        self.queued = set()
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the upload threads"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.run, name=f'upload-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, file_path):
+        """
+        Queue a file for upload (blocks while the queue is full)
+
+        Returns:
+            bool: False if the file is already queued or being uploaded
+        """
+        with self.lock:
+            if file_path in self.queued:
+                return False
+            self.queued.add(file_path)
+
+        self.queue.put((upload_priority(file_path), next(self.sequence), file_path))
+        return True
+
+    def run(self):
+        """
+        Upload thread: take files off the queue until stopped
+
+        Small files waiting in the queue are taken together and sent in one
+        batch request.
+        """
+        carry = None  # Entry taken while filling a batch that did not fit in it
+        while True:
+            file_path = (carry or self.queue.get())[2]
+            carry = None
+            batch = [file_path]
+            try:
+                if file_path is None:
+                    return
+
+                batch_size = self.uploader.get_batchable_size(file_path)
+                while batch_size is not None and len(batch) < config.BATCH_MAX_FILES:
+                    try:
+                        entry = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    next_path = entry[2]
+                    size = self.uploader.get_batchable_size(next_path) if next_path else None
+                    if size is None or batch_size + size > config.BATCH_MAX_SIZE:
+                        carry = entry
+                        break
+                    batch.append(next_path)
+                    batch_size += size
+
+                for failed_path in self.uploader.upload_files(batch):
+                    self.uploader.record_failure(failed_path)
+            finally:
+                with self.lock:
+                    self.queued.difference_update(batch)
+                for _ in batch:
+                    self.queue.task_done()
+
+    def join(self):
+        """Wait until every queued file has been processed"""
+        self.queue.join()
+
+    def stop(self, discard_queued=False):
+        """
+        Stop the threads once the uploads in progress have finished
+
+        Args:
+            discard_queued (bool): Drop files that have not been started
+                instead of uploading them first (the next scan finds them
+                again)
+        """
+        if discard_queued:
+            while True:
+                try:
+                    _, _, file_path = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                with self.lock:
+                    self.queued.discard(file_path)
+                self.queue.task_done()
+
+        for _ in self.threads:
+            self.queue.put(STOP)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
@@ -2,6 +2,7 @@
 Personal Cloud Storage - Client Uploader
 Monitors a folder and automatically uploads new photos/videos to the server
 """
+import io
 import os
 import time
 import requests
@@ -10,29 +11,40 @@ from datetime import datetime
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import config
+from transfer import create_session, MultipartFileStream, RequestBody, TransferProgress, UploadPool
+from scheduler import AdaptiveBackoff, BandwidthLimiter, retry_delay
+from state import StateStore
+from scanner import Scanner, get_file_checksum
+from stability import StabilityTracker
+from metrics import ClientMetrics
 
 
 class FileUploader:
     def __init__(self, server_url, auth_token=None):
         self.server_url = server_url
         self.auth_token = auth_token
-        self.uploaded_files = set()
-        self.failed_files = {}
         
-        # Load previously uploaded files from log
-        self.load_uploaded_log()
-    
-    def load_uploaded_log(self):
-        """Load list of previously uploaded files"""
-        log_file = 'uploaded_files.log'
-        if os.path.exists(log_file):
-            with open(log_file, 'r') as f:
-                self.uploaded_files = set(line.strip() for line in f)
+        # What has been uploaded, failed uploads and resumable sessions
+        self.state = StateStore()
+        self.state.migrate_legacy_files('uploaded_files.log', config.UPLOAD_SESSIONS_FILE)
+        
+        # One keep-alive session shared by all upload threads
+        self.session = create_session(config.UPLOAD_WORKERS)
+        self.batch_supported = True
+        
+        # Bandwidth cap, and a pause for all threads while the server struggles
+        self.limiter = BandwidthLimiter()
+        self.backoff = AdaptiveBackoff()
+        
+        # Upload throughput, failures and retries
+        self.metrics = ClientMetrics()
     
-    def save_uploaded_log(self, file_path):
-        """Save uploaded file to log"""
-        with open('uploaded_files.log', 'a') as f:
-            f.write(f"{file_path}\n")
+    def get_headers(self):
+        """Build request headers, including authentication if configured"""
+        headers = {}
+        if self.auth_token:
+            headers['Authorization'] = f'Bearer {self.auth_token}'
+        return headers
     
     def upload_file(self, file_path):
         """
@@ -45,148 +57,436 @@ class FileUploader:
             bool: True if upload successful, False otherwise
         """
         try:
-            # Check if already uploaded
-            if file_path in self.uploaded_files:
-                print(f"⏭️  Already uploaded: {os.path.basename(file_path)}")
-                return True
-            
             # Check if file exists and is accessible
-            if not os.path.exists(file_path):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
                 print(f"❌ File not found: {file_path}")
                 return False
             
-            # Wait a bit to ensure file is fully written
-            time.sleep(1)
+            uploaded, checksum = self.check_uploaded(file_path, stat)
+            if uploaded:
+                return True
             
             print(f"📤 Uploading: {os.path.basename(file_path)}")
             
-            # Prepare request
-            headers = {}
-            if self.auth_token:
-                headers['Authorization'] = f'Bearer {self.auth_token}'
+            file_size = stat.st_size
+            progress = TransferProgress(os.path.basename(file_path), file_size)
+            started = time.monotonic()
             
-            # Open and upload file
-            with open(file_path, 'rb') as f:
-                files = {'file': (os.path.basename(file_path), f)}
-                response = requests.post(
-                    f'{self.server_url}/upload',
-                    files=files,
-                    headers=headers,
-                    timeout=300  # 5 minutes timeout for large files
-                )
+            # Large files go through a resumable session instead
+            if file_size >= config.CHUNKED_UPLOAD_THRESHOLD:
+                response = self.upload_file_chunked(file_path, progress, checksum)
+                if response is None:
+                    self.count_failure()
+                    return False
+            else:
+                # Stream the file from disk as a multipart body
+                self.backoff.wait()
+                with MultipartFileStream([('file', file_path)], progress, self.limiter) as body:
+                    headers = self.get_headers()
+                    headers['Content-Type'] = body.content_type
+                    response = self.session.post(
+                        f'{self.server_url}/upload',
+                        data=body,
+                        headers=headers,
+                        timeout=300  # 5 minutes timeout for large files
+                    )
+                self.record_response(response, body)
             
             if response.status_code in [200, 201]:
                 result = response.json()
                 if result.get('duplicate'):
                     print(f"✅ File already exists on server (duplicate): {os.path.basename(file_path)}")
+                    self.metrics.inc('duplicates')
                 else:
-                    print(f"✅ Upload successful: {os.path.basename(file_path)}")
-                
-                # Mark as uploaded
-                self.uploaded_files.add(file_path)
-                self.save_uploaded_log(file_path)
-                
-                # Remove from failed list if it was there
-                if file_path in self.failed_files:
-                    del self.failed_files[file_path]
+                    print(f"✅ Upload successful: {os.path.basename(file_path)} ({progress.summary()})")
+                    self.metrics.record_upload(file_size, time.monotonic() - started)
                 
+                self.mark_uploaded(file_path, stat, checksum, result.get('file_id'))
                 return True
             else:
                 print(f"❌ Upload failed: {response.status_code} - {response.text}")
+                self.count_failure(response.status_code)
                 return False
         
-        except requests.exceptions.ConnectionError:
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
             print(f"❌ Connection error: Cannot reach server at {self.server_url}")
+            self.count_failure()
+            self.record_response(None)
             return False
         except Exception as e:
             print(f"❌ Upload error: {str(e)}")
+            self.count_failure()
             return False
     
-    def retry_failed_uploads(self):
-        """Retry previously failed uploads"""
-        if not self.failed_files:
-            return
+    def count_failure(self, status_code=None):
+        """Count a failed upload request"""
+        self.metrics.inc('failures')
+        if status_code == 503:
+            self.metrics.inc('server_busy')
+    
+    def record_response(self, response, body=None):
+        """
+        Let the adaptive backoff see how the server answered a request
         
-        print(f"\n🔄 Retrying {len(self.failed_files)} failed uploads...")
+        Args:
+            response (requests.Response): The response, or None if the
+                server could not be reached
+            body (RequestBody): The request body, to measure how long the
+                server took to answer once it was sent
+        """
+        if response is None:
+            paused = self.backoff.record()
+        else:
+            latency = body.response_latency() if body is not None else 0
+            paused = self.backoff.record(response.status_code, latency,
+                                         response.headers.get('Retry-After'))
+        if paused:
+            self.metrics.inc('backoffs')
+    
+    def check_uploaded(self, file_path, stat):
+        """
+        Check the local state for an earlier upload of a file
+        
+        Returns:
+            tuple: (already uploaded, known checksum or None)
+        """
+        # Check if already uploaded (and unchanged since)
+        if self.state.is_uploaded(file_path, stat):
+            print(f"⏭️  Already uploaded: {os.path.basename(file_path)}")
+            return True, None
+        
+        # Same content already uploaded from another path (e.g. a rename)
+        checksum = self.state.get_checksum(file_path, stat)
+        if checksum:
+            previous = self.state.find_uploaded(checksum)
+            if previous:
+                print(f"⏭️  Already uploaded as {os.path.basename(previous['path'])}: {os.path.basename(file_path)}")
+                self.mark_uploaded(file_path, stat, checksum, previous['file_id'])
+                return True, checksum
         
-        failed_files_copy = dict(self.failed_files)
-        for file_path, attempts in failed_files_copy.items():
-            if attempts < config.RETRY_ATTEMPTS:
-                if self.upload_file(file_path):
-                    if file_path in self.failed_files:
-                        del self.failed_files[file_path]
+        return False, checksum
+    
+    def get_batchable_size(self, file_path):
+        """
+        Size of a file that is small enough to be sent in a batch with others
+        
+        Returns:
+            int: File size, or None if the file should be sent on its own
+        """
+        if not self.batch_supported:
+            return None
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return None
+        return size if size <= config.BATCH_MAX_FILE_SIZE else None
+    
+    def upload_files(self, file_paths):
+        """
+        Upload several small files in one request
+        
+        Falls back to one request per file for a single file or when the
+        server has no batch endpoint.
+        
+        Args:
+            file_paths (list): Paths of files to upload
+        
+        Returns:
+            list: Paths whose upload failed
+        """
+        if len(file_paths) == 1 or not self.batch_supported:
+            return [path for path in file_paths if not self.upload_file(path)]
+        
+        failed = []
+        pending = []  # (path, stat, checksum)
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                print(f"❌ File not found: {file_path}")
+                failed.append(file_path)
+                continue
+            
+            uploaded, checksum = self.check_uploaded(file_path, stat)
+            if not uploaded:
+                pending.append((file_path, stat, checksum))
+        
+        if not pending:
+            return failed
+        
+        print(f"📤 Uploading batch of {len(pending)} files")
+        total_size = sum(stat.st_size for _, stat, _ in pending)
+        progress = TransferProgress(f'batch of {len(pending)} files', total_size)
+        started = time.monotonic()
+        
+        self.backoff.wait()
+        try:
+            with MultipartFileStream([('files', path) for path, _, _ in pending], progress, self.limiter) as body:
+                headers = self.get_headers()
+                headers['Content-Type'] = body.content_type
+                response = self.session.post(
+                    f'{self.server_url}/upload/batch',
+                    data=body,
+                    headers=headers,
+                    timeout=300
+                )
+            self.record_response(response, body)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            print(f"❌ Connection error: Cannot reach server at {self.server_url}")
+            self.metrics.inc('failures', len(pending))
+            self.record_response(None)
+            return failed + [path for path, _, _ in pending]
+        except Exception as e:
+            print(f"❌ Upload error: {str(e)}")
+            self.metrics.inc('failures', len(pending))
+            return failed + [path for path, _, _ in pending]
+        
+        if response.status_code in (404, 405):
+            # Older server without /upload/batch
+            print("⚠️  Server does not support batch uploads, sending files one by one")
+            self.batch_supported = False
+            return failed + [path for path, _, _ in pending if not self.upload_file(path)]
+        
+        if response.status_code != 200:
+            print(f"❌ Batch upload failed: {response.status_code} - {response.text}")
+            self.metrics.inc('failures', len(pending))
+            if response.status_code == 503:
+                self.metrics.inc('server_busy', len(pending))
+            return failed + [path for path, _, _ in pending]
+        
+        # The request time is shared out by size
+        elapsed = time.monotonic() - started
+        for (file_path, stat, checksum), result in zip(pending, response.json()['results']):
+            if result['status'] in (200, 201):
+                self.mark_uploaded(file_path, stat, checksum, result.get('file_id'))
+                if result.get('duplicate'):
+                    self.metrics.inc('duplicates')
                 else:
-                    self.failed_files[file_path] = attempts + 1
+                    self.metrics.record_upload(stat.st_size, elapsed * stat.st_size / (total_size or 1))
             else:
-                print(f"⚠️  Max retry attempts reached for: {os.path.basename(file_path)}")
+                self.metrics.inc('failures')
+                print(f"❌ Upload failed: {os.path.basename(file_path)} - {result.get('error')}")
+                failed.append(file_path)
+        
+        print(f"✅ Batch uploaded: {len(pending) - len(failed)} files ({progress.summary()})")
+        return failed
+    
+    def mark_uploaded(self, file_path, stat=None, checksum=None, file_id=None):
+        """Remember that a file is on the server so it is never sent again"""
+        self.state.mark_uploaded(file_path, stat, checksum, file_id)
+    
+    def check_existing(self, checksums):
+        """
+        Ask the server which checksums it already stores
+        
+        Args:
+            checksums (list): MD5 checksums of local files
+        
+        Returns:
+            dict: Mapping of each checksum already on the server to its file ID,
+            or None if the server could not answer (everything gets uploaded)
+        """
+        try:
+            response = self.session.post(
+                f'{self.server_url}/files/exists',
+                json={'checksums': checksums},
+                headers=self.get_headers(),
+                timeout=60
+            )
+            if response.status_code == 200:
+                return response.json()['existing']
+            print(f"⚠️  Existence check failed: {response.status_code} - {response.text}")
+        except requests.exceptions.RequestException as e:
+            print(f"⚠️  Existence check failed: {e}")
+        return None
+    
+    def record_failure(self, file_path, error=None):
+        """Count a failed upload attempt so the file is retried later"""
+        attempts = self.state.record_failure(file_path, error)
+        if attempts >= config.RETRY_ATTEMPTS:
+            print(f"⚠️  Max retry attempts reached for: {os.path.basename(file_path)}")
+    
+    def upload_file_chunked(self, file_path, progress=None, checksum=None):
+        """
+        Upload a large file through a resumable upload session
+        
+        The session is remembered on disk, so an interrupted upload continues
+        from the chunks the server already has, even after a restart.
+        
+        Args:
+            file_path (str): Path to file to upload
+            progress (TransferProgress): Optional progress tracker
+            checksum (str): MD5 of the file, if already known
+        
+        Returns:
+            requests.Response: Final server response, or None if the upload
+            could not be completed (the session is kept for a later resume)
+        """
+        stat = os.stat(file_path)
+        headers = self.get_headers()
+        session = None
+        
+        # Resume a previous session if the file has not changed since
+        saved = self.state.get_session(file_path)
+        if saved and saved['size'] == stat.st_size and saved['mtime'] == stat.st_mtime:
+            response = self.session.get(
+                f"{self.server_url}/upload/session/{saved['session_id']}",
+                headers=headers,
+                timeout=30
+            )
+            if response.status_code == 200:
+                session = response.json()
+                print(f"🔁 Resuming upload: {session['bytes_received']} of {session['size']} bytes already on server")
+        
+        if session is None:
+            response = self.session.post(
+                f'{self.server_url}/upload/session',
+                json={
+                    'filename': os.path.basename(file_path),
+                    'size': stat.st_size,
+                    'checksum': checksum or get_file_checksum(file_path),
+                    'chunk_size': config.UPLOAD_CHUNK_SIZE
+                },
+                headers=headers,
+                timeout=30
+            )
+            self.record_response(response)
+            if response.status_code != 201:
+                # Duplicates and errors are reported like a normal upload
+                return response
+            
+            session = response.json()
+            self.state.save_session(file_path, session['session_id'], stat.st_size, stat.st_mtime)
+        
+        session_url = f"{self.server_url}/upload/session/{session['session_id']}"
+        chunk_size = session['chunk_size']
+        
+        missing = (index for start, end in session['missing_ranges'] for index in range(start, end))
+        
+        with open(file_path, 'rb') as f:
+            for chunk_index in missing:
+                f.seek(chunk_index * chunk_size)
+                data = f.read(chunk_size)
+                
+                for attempt in range(1, config.RETRY_ATTEMPTS + 1):
+                    self.backoff.wait()
+                    body = RequestBody(io.BytesIO(data), len(data), limiter=self.limiter)
+                    try:
+                        response = self.session.put(
+                            f'{session_url}/chunk/{chunk_index}',
+                            data=body,
+                            headers=headers,
+                            timeout=120
+                        )
+                        self.record_response(response, body)
+                        if response.status_code == 200:
+                            break
+                        print(f"⚠️  Chunk {chunk_index} rejected: {response.status_code} - {response.text}")
+                    except requests.exceptions.RequestException as e:
+                        print(f"⚠️  Chunk {chunk_index} failed (attempt {attempt}): {e}")
+                        self.record_response(None)
+                    
+                    if attempt < config.RETRY_ATTEMPTS:
+                        self.metrics.inc('chunk_retries')
+                        time.sleep(retry_delay(attempt))
+                else:
+                    return None
+                
+                if progress is not None:
+                    progress.update(len(data))
+        
+        self.backoff.wait()
+        response = self.session.post(f'{session_url}/complete', headers=headers, timeout=300)
+        self.record_response(response)
+        
+        # Forget the session once the server has finished with it
+        if response.status_code != 409:
+            self.state.delete_session(file_path)
+        
+        return response
+    
+    def retry_failed_uploads(self, pool):
+        """
+        Queue failed uploads that are due for another attempt
+        
+        Each failure pushes a file's next attempt further out (see
+        scheduler.retry_delay), so this can be called often.
+        """
+        due = self.state.due_retries(config.RETRY_ATTEMPTS)
+        
+        if not due:
+            return
+        
+        print(f"\n🔄 Retrying {len(due)} failed uploads...")
+        self.metrics.inc('retries', len(due))
+        
+        for file_path in due:
+            pool.submit(file_path)
 
 
 class FileWatchHandler(FileSystemEventHandler):
-    """Handle file system events"""
+    """
+    Handle file system events
     
-    def __init__(self, uploader, file_extensions):
-        self.uploader = uploader
+    Runs on the observer thread, so it only passes paths on to the
+    stability tracker, which decides when a file is ready to upload.
+    """
+    
+    def __init__(self, file_extensions, tracker):
         self.file_extensions = file_extensions
+        self.tracker = tracker
+    
+    def is_watched(self, file_path):
+        """Check if file type should be uploaded"""
+        return os.path.splitext(file_path)[1].lower() in self.file_extensions
     
     def on_created(self, event):
         """Called when a file is created"""
-        if event.is_directory:
+        if event.is_directory or not self.is_watched(event.src_path):
             return
         
-        file_path = event.src_path
-        file_ext = os.path.splitext(file_path)[1].lower()
-        
-        # Check if file type should be uploaded
-        if file_ext in self.file_extensions:
-            print(f"\n🆕 New file detected: {os.path.basename(file_path)}")
-            
-            # Upload file
-            if not self.uploader.upload_file(file_path):
-                # Add to failed files for retry
-                self.uploader.failed_files[file_path] = 1
+        print(f"\n🆕 New file detected: {os.path.basename(event.src_path)}")
+        self.tracker.touch(event.src_path)
     
     def on_modified(self, event):
         """Called when a file is modified"""
         # Some systems trigger modified instead of created
-        if event.is_directory:
+        if event.is_directory or not self.is_watched(event.src_path):
             return
         
-        file_path = event.src_path
+        self.tracker.touch(event.src_path)
+    
+    def on_moved(self, event):
+        """Called when a file is renamed or moved within the watch folder"""
+        if event.is_directory:
+            return
         
-        # Only process if not already uploaded
-        if file_path not in self.uploader.uploaded_files:
-            file_ext = os.path.splitext(file_path)[1].lower()
-            if file_ext in self.file_extensions:
-                time.sleep(1)  # Wait for file to be fully written
-                if not self.uploader.upload_file(file_path):
-                    self.uploader.failed_files[file_path] = 1
+        if self.is_watched(event.dest_path):
+            self.tracker.moved(event.src_path, event.dest_path)
+        else:
+            self.tracker.forget(event.src_path)
+    
+    def on_deleted(self, event):
+        """Called when a file is deleted"""
+        if not event.is_directory:
+            self.tracker.forget(event.src_path)
 
 
-def scan_existing_files(watch_folder, uploader, file_extensions):
-    """Scan for existing files in the watch folder and upload them"""
-    print(f"\n🔍 Scanning existing files in: {watch_folder}")
-    
-    files_found = []
-    for root, dirs, files in os.walk(watch_folder):
-        for file in files:
-            file_path = os.path.join(root, file)
-            file_ext = os.path.splitext(file_path)[1].lower()
-            
-            if file_ext in file_extensions:
-                files_found.append(file_path)
-    
-    print(f"📁 Found {len(files_found)} files to check")
-    
-    # Upload files that haven't been uploaded yet
-    new_uploads = 0
-    for file_path in files_found:
-        if file_path not in uploader.uploaded_files:
-            if uploader.upload_file(file_path):
-                new_uploads += 1
-            else:
-                uploader.failed_files[file_path] = 1
-    
-    print(f"✨ Uploaded {new_uploads} new files")
+def scan_existing_files(watch_folder, uploader, file_extensions, pool):
+    """Scan for existing files in the watch folder and queue them for upload"""
+    Scanner(uploader, file_extensions, pool).scan(watch_folder)
+
+
+def report_metrics(uploader):
+    """Print upload activity since the last report and update METRICS_FILE"""
+    uploader.metrics.report()
+    if config.METRICS_FILE:
+        try:
+            uploader.metrics.write_textfile(config.METRICS_FILE)
+        except OSError as e:
+            print(f"⚠️  Cannot write metrics to {config.METRICS_FILE}: {e}")
 
 
 def main():
@@ -212,33 +512,52 @@ def main():
         config.AUTH_TOKEN if config.AUTH_TOKEN != 'your-secret-token-here' else None
     )
     
-    # Scan for existing files
-    scan_existing_files(config.WATCH_FOLDER, uploader, config.FILE_EXTENSIONS)
+    # Start the upload threads
+    pool = UploadPool(uploader)
+    pool.start()
     
-    # Set up file watcher
-    event_handler = FileWatchHandler(uploader, config.FILE_EXTENSIONS)
+    tracker = StabilityTracker(uploader, pool)
     observer = Observer()
-    observer.schedule(event_handler, config.WATCH_FOLDER, recursive=True)
-    observer.start()
-    
-    print(f"\n👁️  Watching for new files... (Press Ctrl+C to stop)")
     
     try:
-        retry_counter = 0
+        # Scan for existing files
+        scan_existing_files(config.WATCH_FOLDER, uploader, config.FILE_EXTENSIONS, pool)
+        
+        # Set up file watcher; files are queued once they stop changing
+        tracker.start()
+        event_handler = FileWatchHandler(config.FILE_EXTENSIONS, tracker)
+        observer.schedule(event_handler, config.WATCH_FOLDER, recursive=True)
+        observer.start()
+        
+        print(f"\n👁️  Watching for new files... (Press Ctrl+C to stop)")
+        
+        metrics_counter = 0
         while True:
             time.sleep(config.CHECK_INTERVAL)
             
-            # Retry failed uploads every minute
-            retry_counter += config.CHECK_INTERVAL
-            if retry_counter >= 60:
-                uploader.retry_failed_uploads()
-                retry_counter = 0
+            # Retry failed uploads whose backoff delay has passed
+            uploader.retry_failed_uploads(pool)
+            
+            metrics_counter += config.CHECK_INTERVAL
+            if metrics_counter >= config.METRICS_REPORT_INTERVAL:
+                report_metrics(uploader)
+                metrics_counter = 0
+            
+            uploader.state.flush()
     
     except KeyboardInterrupt:
         print("\n\n🛑 Stopping uploader...")
+    
+    if observer.is_alive():
         observer.stop()
+        observer.join()
+    tracker.stop()
     
-    observer.join()
+    # Let uploads in progress finish before their results are written
+    print("⏳ Waiting for uploads in progress...")
+    pool.stop(discard_queued=True)
+    report_metrics(uploader)
+    uploader.state.close()
     print("👋 Goodbye!")
 
 
@@ -9,16 +9,24 @@ import SearchBar from './components/SearchBar';
 // Use environment variable for API URL (for Vercel deployment)
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5000';
 
+// Fields the gallery shows; the server leaves the others out of listings
+const LIST_FIELDS = 'id,original_filename,file_type,file_size,upload_date,width,height,thumbnail_path,thumbnail_status';
+
 function App() {
   const [files, setFiles] = useState([]);
   const [stats, setStats] = useState(null);
   const [loading, setLoading] = useState(true);
   const [filterType, setFilterType] = useState('all');
+  const [searchQuery, setSearchQuery] = useState('');
+  const [searchCursor, setSearchCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   const fetchFiles = async () => {
+    setSearchQuery('');
+    setSearchCursor(null);
     try {
       setLoading(true);
-      const params = {};
+      const params = { fields: LIST_FIELDS };
       if (filterType !== 'all') {
         params.type = filterType;
       }
@@ -60,9 +68,11 @@ function App() {
     try {
       setLoading(true);
       const response = await axios.get(`${API_URL}/search`, {
-        params: { q: query }
+        params: { q: query, fields: LIST_FIELDS }
       });
       setFiles(response.data.files);
+      setSearchQuery(query);
+      setSearchCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error searching files:', error);
     } finally {
@@ -70,6 +80,22 @@ function App() {
     }
   };
 
+  // Search results come a page at a time; append the next page
+  const loadMoreResults = async () => {
+    try {
+      setLoadingMore(true);
+      const response = await axios.get(`${API_URL}/search`, {
+        params: { q: searchQuery, fields: LIST_FIELDS, cursor: searchCursor }
+      });
+      setFiles((current) => current.concat(response.data.files));
+      setSearchCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error loading more results:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleUploadComplete = () => {
     fetchFiles();
     fetchStats();
@@ -135,11 +161,20 @@ function App() {
             <p>Loading files...</p>
           </div>
         ) : (
-          <FileGrid
-            files={files}
-            onDelete={handleDelete}
-            apiUrl={API_URL}
-          />
+          <>
+            <FileGrid
+              files={files}
+              onDelete={handleDelete}
+              apiUrl={API_URL}
+            />
+            {searchCursor && (
+              <div className="load-more">
+                <button onClick={loadMoreResults} disabled={loadingMore}>
+                  {loadingMore ? 'Loading...' : 'Load more results'}
+                </button>
+              </div>
+            )}
+          </>
         )}
       </main>
 
@@ -1,6 +1,103 @@
-import React from 'react';
+import React, { useState, useEffect } from 'react';
+
+// Thumbnails requested per /thumbnails call
+const THUMBNAIL_BATCH_SIZE = 200;
+
+// Delay before asking again for thumbnails still being generated (doubles each time)
+const THUMBNAIL_RETRY_DELAY = 1000;
+const THUMBNAIL_RETRY_MAX_DELAY = 30000;
+
+// Split a /thumbnails response into object URLs keyed by file ID and the IDs still pending
+const unpackThumbnails = (buffer) => {
+  const indexLength = new DataView(buffer).getUint32(0);
+  const index = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, indexLength)));
+  const dataStart = 4 + indexLength;
+  const urls = {};
+  const pending = [];
+  index.items.forEach((item) => {
+    if (item.status === 'ready') {
+      const start = dataStart + item.offset;
+      const blob = new Blob([buffer.slice(start, start + item.length)], { type: 'image/jpeg' });
+      urls[item.id] = URL.createObjectURL(blob);
+    } else if (item.status === 'pending') {
+      pending.push(item.id);
+    }
+  });
+  return { urls, pending };
+};
 
 function FileGrid({ files, onDelete, apiUrl }) {
+  // Thumbnails fetched in batches: file ID -> object URL
+  const [thumbnails, setThumbnails] = useState({});
+  // Set when the batch endpoint fails; tiles then load /thumbnail/<id> one by one
+  const [batchFailed, setBatchFailed] = useState(false);
+
+  useEffect(() => {
+    const ids = files
+      .filter((file) => file.file_type === 'image' && file.thumbnail_status !== 'failed')
+      .map((file) => file.id);
+    let cancelled = false;
+    let created = [];
+    let timer = null;
+
+    // Fetch thumbnails in batches and return the IDs still being generated
+    const load = async (loadIds) => {
+      const pending = [];
+      for (let i = 0; i < loadIds.length; i += THUMBNAIL_BATCH_SIZE) {
+        const batch = loadIds.slice(i, i + THUMBNAIL_BATCH_SIZE);
+        const response = await fetch(`${apiUrl}/thumbnails?ids=${batch.join(',')}`);
+        if (!response.ok) {
+          throw new Error(`Thumbnail batch failed with ${response.status}`);
+        }
+        const result = unpackThumbnails(await response.arrayBuffer());
+        if (cancelled) {
+          Object.values(result.urls).forEach((url) => URL.revokeObjectURL(url));
+          return [];
+        }
+        created = created.concat(Object.values(result.urls));
+        setThumbnails((current) => ({ ...current, ...result.urls }));
+        pending.push(...result.pending);
+      }
+      return pending;
+    };
+
+    // Ask again for pending thumbnails, waiting longer each time
+    const retry = (pending, delay) => {
+      if (cancelled || pending.length === 0) return;
+      const nextDelay = Math.min(delay * 2, THUMBNAIL_RETRY_MAX_DELAY);
+      timer = setTimeout(() => {
+        load(pending)
+          .then((stillPending) => retry(stillPending, nextDelay))
+          .catch((error) => {
+            console.error('Thumbnail retry error:', error);
+            retry(pending, nextDelay);
+          });
+      }, delay);
+    };
+
+    load(ids)
+      .then((pending) => retry(pending, THUMBNAIL_RETRY_DELAY))
+      .catch((error) => {
+        console.error('Thumbnail batch error:', error);
+        if (!cancelled) {
+          setBatchFailed(true);
+        }
+      });
+
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+      created.forEach((url) => URL.revokeObjectURL(url));
+      setThumbnails({});
+    };
+  }, [files, apiUrl]);
+
+  const getThumbnailUrl = (file) => {
+    if (thumbnails[file.id]) return thumbnails[file.id];
+    // /thumbnail/<id> answers 202 until a thumbnail exists, so only ready ones fall back
+    return batchFailed && file.thumbnail_path ? `${apiUrl}/thumbnail/${file.id}` : null;
+  };
+
   const formatDate = (dateString) => {
     const date = new Date(dateString);
     return date.toLocaleDateString() + ' ' + date.toLocaleTimeString();
@@ -45,9 +142,9 @@ function FileGrid({ files, onDelete, apiUrl }) {
     <div className="file-grid">
       {files.map((file) => (
         <div key={file.id} className="file-card">
-          {file.file_type === 'image' && file.thumbnail_path ? (
+          {file.file_type === 'image' && getThumbnailUrl(file) ? (
             <img
-              src={`${apiUrl}/thumbnail/${file.id}`}
+              src={getThumbnailUrl(file)}
               alt={file.original_filename}
               className="file-thumbnail"
             />